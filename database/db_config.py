@@ -7,6 +7,7 @@ Versión: 1.0
 """
 
 import os
+import re
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.pool import QueuePool
@@ -280,6 +281,628 @@ def obtener_estadisticas_db(engine=None):
         return {}
 
 
+def _registro_almacenes():
+    """Registro de almacenamiento por modelo (importación diferida)"""
+    try:
+        from database.models import ALMACENES_EMBEDDING, almacen_embedding
+    except ImportError:  # Ejecutado como python database/db_config.py
+        from models import ALMACENES_EMBEDDING, almacen_embedding
+    return ALMACENES_EMBEDDING, almacen_embedding
+
+
+TABLAS_EMBEDDING = ('embeddings_vectoriales', 'embeddings_fragmentos')
+
+# Proyección de recuperación copiada del artículo en cada fila de embeddings
+COLUMNAS_PROYECCION = (
+    ('pais_id', 'INTEGER'),
+    ('codigo_pais', 'CHAR(2)'),
+    ('estado', 'VARCHAR(20)'),
+    ('vigente', 'BOOLEAN'),
+    ('numero_documento', 'VARCHAR(100)'),
+    ('numero_articulo', 'VARCHAR(50)')
+)
+
+SCHEMA_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+def _ddl_tabla_embeddings(padre, schema_path=SCHEMA_SQL):
+    """CREATE TABLE particionada, índices comunes y comentario de padre, tomados de schema.sql"""
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        sql_script = re.sub(r'--[^\n]*', '', f.read())
+    
+    tabla = re.search(
+        rf"CREATE TABLE {padre} \(.*?\) PARTITION BY LIST \(modelo_embedding\)",
+        sql_script, re.S
+    )
+    if tabla is None:
+        raise ValueError(f"{schema_path} no define {padre} particionada por modelo")
+    return (
+        [tabla.group(0)]
+        + re.findall(rf"CREATE INDEX \w+ ON {padre}\([^;]*\)", sql_script)
+        + re.findall(rf"COMMENT ON TABLE {padre} IS '[^']*'", sql_script)
+    )
+
+
+def _preparar_migracion_particiones(conn, schema_path=SCHEMA_SQL):
+    """Apartar las tablas de embeddings sin particionar y crear las particionadas
+    
+    Las bases creadas antes de particionar por modelo tienen
+    embeddings_vectoriales / embeddings_fragmentos como tablas normales,
+    y CREATE TABLE ... PARTITION OF falla sobre ellas. Cada una se renombra
+    a <tabla>_legado (con sus índices y su secuencia, para liberar los
+    nombres) y se crea la tabla particionada de schema.sql en su lugar.
+    
+    Returns:
+        Lista de (tabla, tabla_legado) pendientes de copiar
+    """
+    migraciones = []
+    for padre in TABLAS_EMBEDDING:
+        tipo = conn.execute(text(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(:tabla)"
+        ), {'tabla': padre}).scalar()
+        if tipo != 'r':
+            continue
+        
+        legado = f"{padre}_legado"
+        logger.info(f"⚙ {padre} no está particionada: se migra (copia en {legado})")
+        conn.execute(text(f"ALTER TABLE {padre} RENAME TO {legado}"))
+        
+        indices = conn.execute(text("""
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = CAST(:tabla AS regclass) ORDER BY c.relname
+        """), {'tabla': legado}).scalars().all()
+        for numero, indice in enumerate(indices, 1):
+            conn.execute(text(f'ALTER INDEX "{indice}" RENAME TO {legado}_idx{numero}'))
+        
+        secuencia = conn.execute(text(
+            "SELECT pg_get_serial_sequence(:tabla, 'id')"
+        ), {'tabla': legado}).scalar()
+        if secuencia:
+            conn.execute(text(f"ALTER SEQUENCE {secuencia} RENAME TO {legado}_id_seq"))
+        
+        for ddl in _ddl_tabla_embeddings(padre, schema_path):
+            conn.execute(text(ddl))
+        migraciones.append((padre, legado))
+    return migraciones
+
+
+def _copiar_embeddings_legado(conn, migraciones, modelos):
+    """Copiar las filas apartadas a las particiones y eliminar las tablas legado
+    
+    Se copian las columnas comunes conservando los id; las columnas nuevas
+    quedan a NULL (la proyección de recuperación se rellena después). Cada
+    fila va a la partición de su modelo, cuyo CHECK valida la dimensión.
+    """
+    for padre, legado in migraciones:
+        sin_particion = conn.execute(text(f"""
+            SELECT DISTINCT modelo_embedding FROM {legado}
+            WHERE modelo_embedding <> ALL(CAST(:modelos AS text[]))
+        """), {'modelos': list(modelos)}).scalars().all()
+        if sin_particion:
+            raise ValueError(
+                f"{padre} tiene embeddings de modelos sin partición ({', '.join(sin_particion)}): "
+                f"registrarlos en ALMACENES_EMBEDDING (database/models.py) o eliminar esas "
+                f"filas y repetir 'python database/db_config.py almacenes'"
+            )
+        
+        columnas = conn.execute(text("""
+            SELECT n.column_name
+            FROM information_schema.columns n
+            JOIN information_schema.columns l
+                ON l.table_schema = n.table_schema
+                AND l.table_name = :legado
+                AND l.column_name = n.column_name
+            WHERE n.table_schema = current_schema() AND n.table_name = :tabla
+            ORDER BY n.ordinal_position
+        """), {'tabla': padre, 'legado': legado}).scalars().all()
+        lista = ', '.join(columnas)
+        
+        filas = conn.execute(text(
+            f"INSERT INTO {padre} ({lista}) SELECT {lista} FROM {legado}"
+        )).rowcount
+        conn.execute(text(f"""
+            SELECT setval(pg_get_serial_sequence(:tabla, 'id'),
+                          GREATEST(MAX(id), 1), MAX(id) IS NOT NULL)
+            FROM {padre}
+        """), {'tabla': padre})
+        conn.execute(text(f"DROP TABLE {legado}"))
+        logger.info(f"✓ {padre}: {filas} filas migradas a las particiones por modelo")
+
+
+def crear_almacenes_embedding(engine=None, schema_path=SCHEMA_SQL):
+    """Crear las particiones por modelo que falten y su índice HNSW
+    
+    Para modelos añadidos a ALMACENES_EMBEDDING después de ejecutar
+    schema.sql: cada modelo recibe una partición de embeddings_vectoriales
+    y otra de embeddings_fragmentos con su dimensión real. Los modelos con
+    índice IVFFlat lo reciben al reconstruir índices tras la primera carga.
+    
+    En bases anteriores al particionado, las tablas sin particionar se
+    migran en la misma transacción: se recrean particionadas, se copian sus
+    filas y los índices HNSW se construyen después de la copia. Las
+    columnas de la proyección de recuperación que falten se añaden y se
+    rellenan (sincronizar_proyeccion_embeddings): sin ellas la búsqueda
+    pgvector no encontraría las filas ya existentes.
+    """
+    ALMACENES_EMBEDDING, almacen_embedding = _registro_almacenes()
+    
+    if engine is None:
+        engine = DatabaseEngine.get_engine()
+    
+    try:
+        with engine.connect() as conn:
+            migraciones = _preparar_migracion_particiones(conn, schema_path)
+            for padre in TABLAS_EMBEDDING:
+                for columna, tipo in COLUMNAS_PROYECCION:
+                    conn.execute(text(f"ALTER TABLE {padre} ADD COLUMN IF NOT EXISTS {columna} {tipo}"))
+            
+            indices = []
+            for modelo_path in ALMACENES_EMBEDDING:
+                almacen = almacen_embedding(modelo_path)
+                for padre, tabla, indice in (
+                    ('embeddings_vectoriales', almacen['tabla'], almacen['indice']),
+                    ('embeddings_fragmentos', almacen['tabla_fragmentos'], almacen['indice_fragmentos'])
+                ):
+                    # DDL sin parámetros enlazados: los valores vienen del registro
+                    literal = modelo_path.replace("'", "''")
+                    conn.execute(text(f"""
+                        CREATE TABLE IF NOT EXISTS {tabla} PARTITION OF {padre} (
+                            CHECK (vector_dims(embedding) = {almacen['dimension']}),
+                            CHECK (vector_dims(embedding_half) = {almacen['dimension']})
+                        ) FOR VALUES IN ('{literal}')
+                    """))
+                    if almacen['tipo_indice'] == 'hnsw':
+                        indices.append(sql_indice_ann(
+                            tabla, indice, almacen, 'hnsw', concurrente=False
+                        ))
+                logger.info(f"✓ {almacen['tabla']} / {almacen['tabla_fragmentos']} "
+                            f"({almacen['dimension']}D, {almacen['tipo_indice']})")
+            
+            _copiar_embeddings_legado(conn, migraciones, ALMACENES_EMBEDDING)
+            
+            for sql in indices:
+                conn.execute(text(sql))
+            conn.commit()
+        
+        sincronizar_proyeccion_embeddings(engine)
+        return True
+    except Exception as e:
+        logger.error(f"Error creando particiones de embeddings: {str(e)}")
+        return False
+
+
+# ============================================================================
+# GESTIÓN DE ÍNDICES ANN
+# ============================================================================
+# Cada fila escrita en una partición con índice ANN paga también la inserción
+# en el índice. Para cargas masivas es mucho más rápido eliminar el índice,
+# cargar y reconstruirlo de una vez (con IVFFlat, además, las listas se
+# entrenan con los datos reales y no con una tabla vacía).
+
+TIPOS_INDICE_ANN = ('hnsw', 'ivfflat')
+
+
+def nombre_indice_ann(prefijo, tipo, pais=None):
+    """Nombre del índice ANN: <prefijo>_<tipo>[_<codigo_iso>]"""
+    nombre = f"{prefijo}_{tipo}"
+    if pais is not None:
+        nombre = f"{nombre}_{pais[1].lower()}"
+    return nombre
+
+
+def sql_indice_ann(tabla, nombre, almacen, tipo, filas=0, concurrente=True, pais=None):
+    """Sentencia CREATE INDEX para el índice ANN de una partición
+    
+    Args:
+        tabla: Partición (embeddings_vectoriales_<modelo> o de fragmentos)
+        nombre: Prefijo del índice; se le añade _hnsw o _ivfflat
+        almacen: Almacenamiento del modelo (columna, tipo con dimensión y
+            opclase: vector_cosine_ops o halfvec_cosine_ops)
+        tipo: 'hnsw' o 'ivfflat'
+        filas: Filas indexadas (dimensiona lists en IVFFlat)
+        concurrente: CREATE INDEX CONCURRENTLY (no bloquea escrituras)
+        pais: (pais_id, codigo_iso) para un índice parcial sobre los
+            artículos vigentes de ese país (sufijo _<codigo_iso>)
+    """
+    if tipo == 'hnsw':
+        parametros = "m = 16, ef_construction = 64"
+    else:
+        # Recomendación pgvector: filas/1000 hasta 1M, sqrt(filas) por encima
+        listas = filas // 1000 if filas <= 1_000_000 else int(filas ** 0.5)
+        parametros = f"lists = {max(1, listas)}"
+    
+    condicion = ""
+    if pais is not None:
+        condicion = f" WHERE pais_id = {int(pais[0])} AND vigente"
+    
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrente else ''}IF NOT EXISTS "
+        f"{nombre_indice_ann(nombre, tipo, pais)} "
+        f"ON {tabla} USING {tipo} (({almacen['columna']}::{almacen['tipo']}) {almacen['opclase']}) "
+        f"WITH ({parametros}){condicion}"
+    )
+
+
+def _resolver_almacenes(modelo=None, fragmentos=True, articulos=True, almacenamiento=None):
+    """Particiones afectadas: lista de (modelo_path, almacen, tabla, indice)
+    
+    Args:
+        modelo: modelo_embedding completo o sufijo ('mpnet'); None = todos
+        fragmentos: Incluir las particiones de embeddings_fragmentos
+        articulos: Incluir las particiones de embeddings_vectoriales
+        almacenamiento: 'vector' o 'halfvec' (None = el del registro)
+    """
+    ALMACENES_EMBEDDING, almacen_embedding = _registro_almacenes()
+    
+    modelos = [
+        modelo_path for modelo_path, config in ALMACENES_EMBEDDING.items()
+        if modelo is None or modelo in (modelo_path, config['sufijo'])
+    ]
+    if not modelos:
+        raise ValueError(f"Modelo sin almacenamiento de embeddings: {modelo}")
+    
+    particiones = []
+    for modelo_path in modelos:
+        almacen = almacen_embedding(modelo_path, almacenamiento)
+        if articulos:
+            particiones.append((modelo_path, almacen, almacen['tabla'], almacen['indice']))
+        if fragmentos:
+            particiones.append((
+                modelo_path, almacen, almacen['tabla_fragmentos'], almacen['indice_fragmentos']
+            ))
+    return particiones
+
+
+def estado_indices_ann(modelo=None, engine=None):
+    """Filas, índices ANN presentes y tamaño por partición de embeddings
+    
+    Returns:
+        Lista de diccionarios (tabla, filas, tipo esperado, índices presentes)
+    """
+    if engine is None:
+        engine = DatabaseEngine.get_engine()
+    
+    estado = []
+    with engine.connect() as conn:
+        for modelo_path, almacen, tabla, indice in _resolver_almacenes(modelo):
+            filas = conn.execute(text(f"SELECT COUNT(*) FROM {tabla}")).scalar()
+            tamano_tabla = conn.execute(text(
+                "SELECT pg_size_pretty(pg_table_size(CAST(:tabla AS regclass)))"
+            ), {'tabla': tabla}).scalar()
+            indices = conn.execute(text("""
+                SELECT
+                    c.relname AS nombre,
+                    pg_size_pretty(pg_relation_size(c.oid)) AS tamano,
+                    i.indisvalid AS valido
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_am am ON am.oid = c.relam
+                WHERE i.indrelid = CAST(:tabla AS regclass)
+                    AND am.amname IN ('hnsw', 'ivfflat')
+            """), {'tabla': tabla}).all()
+            estado.append({
+                'tabla': tabla,
+                'filas': filas,
+                'tamano': tamano_tabla,
+                'almacenamiento': almacen['almacenamiento'],
+                'tipo_indice': almacen['tipo_indice'],
+                'indices': [
+                    f"{fila.nombre} ({fila.tamano}{'' if fila.valido else ', INVÁLIDO'})"
+                    for fila in indices
+                ]
+            })
+    return estado
+
+
+def _indices_ann_existentes(conn, tabla):
+    """Índices ANN (globales, por país, vector o halfvec) de una partición
+    
+    Returns:
+        Filas con nombre, tipo ('hnsw' o 'ivfflat'), parcial (índice por
+        país, con WHERE) y almacenamiento ('vector' o 'halfvec')
+    """
+    return conn.execute(text("""
+        SELECT
+            c.relname AS nombre,
+            am.amname AS tipo,
+            i.indpred IS NOT NULL AS parcial,
+            CASE WHEN pg_get_indexdef(c.oid) LIKE '%halfvec_cosine_ops%'
+                THEN 'halfvec' ELSE 'vector' END AS almacenamiento
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = CAST(:tabla AS regclass)
+            AND am.amname IN ('hnsw', 'ivfflat')
+    """), {'tabla': tabla}).all()
+
+
+def sincronizar_proyeccion_embeddings(engine=None):
+    """Rellenar la proyección de recuperación en embeddings_vectoriales y embeddings_fragmentos
+    
+    Copia país, estado y números de documento y artículo en las filas
+    antiguas o desalineadas; las nuevas los reciben al escribirse y los
+    triggers de países, documentos y artículos los mantienen después.
+    crear_almacenes_embedding la ejecuta al actualizar una base existente.
+    
+    Returns:
+        Filas actualizadas
+    """
+    if engine is None:
+        engine = DatabaseEngine.get_engine()
+    
+    total = 0
+    with engine.connect() as conn:
+        for tabla in TABLAS_EMBEDDING:
+            total += conn.execute(text(f"""
+                UPDATE {tabla} e
+                SET pais_id = d.pais_id,
+                    codigo_pais = p.codigo_iso,
+                    estado = d.estado,
+                    vigente = (d.estado = 'vigente'),
+                    numero_documento = d.numero_documento,
+                    numero_articulo = a.numero_articulo
+                FROM articulos_normativos a
+                JOIN documentos_normativos d ON a.documento_id = d.id
+                JOIN paises p ON d.pais_id = p.id
+                WHERE e.articulo_id = a.id
+                    AND (e.pais_id IS DISTINCT FROM d.pais_id
+                         OR e.codigo_pais IS DISTINCT FROM p.codigo_iso
+                         OR e.estado IS DISTINCT FROM d.estado
+                         OR e.vigente IS DISTINCT FROM (d.estado = 'vigente')
+                         OR e.numero_documento IS DISTINCT FROM d.numero_documento
+                         OR e.numero_articulo IS DISTINCT FROM a.numero_articulo)
+            """)).rowcount
+        conn.commit()
+    
+    logger.info(f"✓ Proyección de recuperación sincronizada en {total} embeddings")
+    return total
+
+
+def eliminar_indices_ann(modelo=None, fragmentos=True, articulos=True, engine=None):
+    """Eliminar los índices ANN de las particiones (antes de una carga masiva)
+    
+    DROP INDEX CONCURRENTLY no bloquea lecturas ni escrituras, pero no puede
+    ejecutarse dentro de una transacción: se usa una conexión AUTOCOMMIT.
+    Se eliminan también los índices parciales por país; pasar el resultado
+    a reconstruir_indices_eliminados para rehacer exactamente lo mismo.
+    
+    Returns:
+        Lista de diccionarios (nombre, tabla, modelo, fragmentos, tipo,
+        parcial, almacenamiento) con los índices eliminados
+    """
+    if engine is None:
+        engine = DatabaseEngine.get_engine()
+    
+    eliminados = []
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for modelo_path, almacen, tabla, _ in _resolver_almacenes(modelo, fragmentos, articulos):
+            for indice in _indices_ann_existentes(conn, tabla):
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {indice.nombre}"))
+                eliminados.append({
+                    'nombre': indice.nombre,
+                    'tabla': tabla,
+                    'modelo': modelo_path,
+                    'fragmentos': tabla == almacen['tabla_fragmentos'],
+                    'tipo': indice.tipo,
+                    'parcial': indice.parcial,
+                    'almacenamiento': indice.almacenamiento
+                })
+                logger.info(f"✓ Índice eliminado: {indice.nombre} ({tabla})")
+    return eliminados
+
+
+def reconstruir_indices_eliminados(
+    eliminados,
+    por_pais=False,
+    almacenamiento=None,
+    engine=None,
+    **opciones
+):
+    """Reconstruir los índices que devolvió eliminar_indices_ann
+    
+    Cada partición recupera su tipo (hnsw / ivfflat) y almacenamiento
+    (vector / halfvec), y los índices parciales por país si los tenía.
+    
+    Args:
+        eliminados: Resultado de eliminar_indices_ann
+        por_pais: Construir índices por país aunque no existieran antes
+        almacenamiento: Forzar 'vector' o 'halfvec' (None = el que tenía
+            cada partición)
+        **opciones: maintenance_work_mem, workers
+        
+    Returns:
+        Diccionario índice -> segundos de construcción
+    """
+    particiones = {}
+    for indice in eliminados:
+        clave = (indice['modelo'], indice['fragmentos'])
+        particion = particiones.setdefault(clave, {'tipo': None, 'almacenamiento': None, 'parcial': False})
+        if indice['parcial']:
+            particion['parcial'] = True
+        else:
+            particion['tipo'] = indice['tipo']
+            particion['almacenamiento'] = indice['almacenamiento']
+    
+    tiempos = {}
+    for (modelo, fragmentos), particion in particiones.items():
+        tiempos.update(reconstruir_indices_ann(
+            modelo,
+            particion['tipo'],
+            fragmentos=fragmentos,
+            articulos=not fragmentos,
+            por_pais=por_pais or particion['parcial'],
+            almacenamiento=almacenamiento or particion['almacenamiento'],
+            engine=engine,
+            **opciones
+        ))
+    return tiempos
+
+
+def _monitorear_creacion_indice(engine, pid, nombre, detener, intervalo=10.0):
+    """Informar del avance de CREATE INDEX (pg_stat_progress_create_index)"""
+    while not detener.wait(intervalo):
+        try:
+            with engine.connect() as conn:
+                fila = conn.execute(text("""
+                    SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+                    FROM pg_stat_progress_create_index
+                    WHERE pid = :pid
+                """), {'pid': pid}).first()
+        except Exception:
+            continue
+        if fila is None:
+            continue
+        
+        if fila.tuples_total:
+            avance = f"{fila.tuples_done}/{fila.tuples_total} filas"
+        elif fila.blocks_total:
+            avance = f"{fila.blocks_done}/{fila.blocks_total} bloques"
+        else:
+            avance = ""
+        logger.info(f"   … {nombre}: {fila.phase} {avance}")
+
+
+def _construir_indice_ann(conn, engine, pid, nombre, sql, filas, tabla):
+    """Ejecutar un CREATE INDEX informando del avance
+    
+    Returns:
+        Segundos de construcción, o None si el índice ya existía y es válido
+    """
+    import threading
+    import time
+    
+    valido = conn.execute(text("""
+        SELECT i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :nombre
+    """), {'nombre': nombre}).scalar()
+    if valido:
+        # IF NOT EXISTS volvería al instante: no es una construcción
+        logger.info(f"= {nombre} ya existe: se omite")
+        return None
+    if valido is not None:
+        # Un CONCURRENTLY interrumpido deja el índice INVALID: rehacerlo
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}"))
+    
+    logger.info(f"🔨 {nombre}: {filas} filas de {tabla}")
+    detener = threading.Event()
+    monitor = threading.Thread(
+        target=_monitorear_creacion_indice,
+        args=(engine, pid, nombre, detener),
+        daemon=True
+    )
+    monitor.start()
+    inicio = time.perf_counter()
+    try:
+        conn.execute(text(sql))
+    finally:
+        detener.set()
+        monitor.join()
+    
+    segundos = time.perf_counter() - inicio
+    logger.info(f"✓ {nombre} construido en {segundos:.1f} s")
+    return segundos
+
+
+def reconstruir_indices_ann(
+    modelo=None,
+    tipo=None,
+    fragmentos=True,
+    articulos=True,
+    maintenance_work_mem='2GB',
+    workers=4,
+    por_pais=False,
+    almacenamiento=None,
+    engine=None
+):
+    """Construir los índices ANN tras una carga masiva
+    
+    Cada índice se construye con CREATE INDEX CONCURRENTLY (la tabla sigue
+    aceptando lecturas y escrituras) en una sesión con maintenance_work_mem
+    y max_parallel_maintenance_workers ajustados. Si el grafo HNSW cabe en
+    maintenance_work_mem la construcción es mucho más rápida. Un índice del
+    otro tipo que quede en la partición se elimina, y las particiones vacías
+    con IVFFlat se omiten (las listas se entrenarían sin datos).
+    
+    Args:
+        modelo: modelo_embedding completo o sufijo; None = todos
+        tipo: 'hnsw' o 'ivfflat' (None = el del registro para cada modelo)
+        fragmentos: Incluir las particiones de embeddings_fragmentos
+        articulos: Incluir las particiones de embeddings_vectoriales
+        maintenance_work_mem: Memoria para la construcción (p. ej. '2GB')
+        workers: max_parallel_maintenance_workers
+        por_pais: Construir además un índice parcial por país sobre los
+            artículos vigentes (WHERE pais_id = N AND vigente), que
+            SemanticRetriever usa con indices_por_pais=True
+        almacenamiento: 'vector' o 'halfvec' (None = el del registro)
+        
+    Returns:
+        Diccionario índice -> segundos de construcción (sin los índices
+        válidos que ya existían, que se omiten)
+    """
+    import re
+    
+    if tipo is not None and tipo not in TIPOS_INDICE_ANN:
+        raise ValueError(f"Tipo de índice no soportado: {tipo}")
+    # SET no admite parámetros enlazados: validar antes de interpolar
+    if not re.fullmatch(r"\d+\s*(kB|MB|GB|TB)?", str(maintenance_work_mem)):
+        raise ValueError(f"maintenance_work_mem no válido: {maintenance_work_mem}")
+    
+    if engine is None:
+        engine = DatabaseEngine.get_engine()
+    
+    tiempos = {}
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text(f"SET maintenance_work_mem = '{maintenance_work_mem}'"))
+        conn.execute(text(f"SET max_parallel_maintenance_workers = {int(workers)}"))
+        pid = conn.execute(text("SELECT pg_backend_pid()")).scalar()
+        
+        for _, almacen, tabla, indice in _resolver_almacenes(
+            modelo, fragmentos, articulos, almacenamiento
+        ):
+            tipo_indice = tipo or almacen['tipo_indice']
+            nombre = f"{indice}_{tipo_indice}"
+            filas = conn.execute(text(
+                f"SELECT COUNT(*) FROM {tabla} WHERE {almacen['columna']} IS NOT NULL"
+            )).scalar()
+            
+            if tipo_indice == 'ivfflat' and filas == 0:
+                logger.warning(f"⚠ {tabla} vacía: se omite {nombre} (IVFFlat necesita datos)")
+                continue
+            
+            # Índices de otro tipo o de la otra columna (vector / halfvec)
+            for existente in _indices_ann_existentes(conn, tabla):
+                if not existente.nombre.startswith(nombre):
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {existente.nombre}"))
+            
+            objetivos = [(None, filas)]
+            if por_pais and tabla == almacen['tabla']:
+                objetivos += [
+                    ((fila.pais_id, fila.codigo_iso), fila.filas)
+                    for fila in conn.execute(text(f"""
+                        SELECT e.pais_id, p.codigo_iso, COUNT(*) AS filas
+                        FROM {tabla} e JOIN paises p ON p.id = e.pais_id
+                        WHERE e.vigente AND e.{almacen['columna']} IS NOT NULL
+                        GROUP BY e.pais_id, p.codigo_iso
+                        ORDER BY p.codigo_iso
+                    """))
+                ]
+            
+            for pais, filas_indice in objetivos:
+                nombre_indice = nombre_indice_ann(indice, tipo_indice, pais)
+                segundos = _construir_indice_ann(
+                    conn, engine, pid, nombre_indice,
+                    sql_indice_ann(tabla, indice, almacen, tipo_indice, filas_indice, pais=pais),
+                    filas_indice, tabla
+                )
+                if segundos is not None:
+                    tiempos[nombre_indice] = segundos
+            
+            conn.execute(text(f"ANALYZE {tabla}"))
+    
+    return tiempos
+
+
 # ============================================================================
 # FUNCIONES DE SETUP INICIAL
 # ============================================================================
@@ -355,6 +978,50 @@ if __name__ == "__main__":
             verificar_conexion()
             verificar_extension_pgvector()
             
+        elif comando == "almacenes":
+            # Particiones por modelo de embeddings
+            DatabaseEngine.initialize()
+            crear_almacenes_embedding()
+            
+        elif comando == "indices":
+            # Ciclo de vida de índices ANN alrededor de cargas masivas
+            import argparse
+            parser = argparse.ArgumentParser(prog='db_config.py indices')
+            parser.add_argument('accion', choices=['estado', 'eliminar', 'reconstruir', 'sincronizar'])
+            parser.add_argument('--modelo', help='modelo_embedding o sufijo (mpnet, minilm...); default: todos')
+            parser.add_argument('--tipo', choices=TIPOS_INDICE_ANN,
+                                help='Tipo de índice (default: el del registro por modelo)')
+            parser.add_argument('--sin-fragmentos', action='store_true',
+                                help='No tocar las particiones de embeddings_fragmentos')
+            parser.add_argument('--maintenance-work-mem', default='2GB')
+            parser.add_argument('--workers', type=int, default=4,
+                                help='max_parallel_maintenance_workers')
+            parser.add_argument('--por-pais', action='store_true',
+                                help='Añadir índices parciales por país sobre artículos vigentes')
+            parser.add_argument('--almacenamiento', choices=['vector', 'halfvec'],
+                                help='Columna a indexar (default: la del registro por modelo)')
+            args = parser.parse_args(sys.argv[2:])
+            
+            DatabaseEngine.initialize()
+            if args.accion == 'estado':
+                for fila in estado_indices_ann(args.modelo):
+                    print(f"  {fila['tabla']}: {fila['filas']} filas ({fila['tamano']}), "
+                          f"{fila['almacenamiento']}/{fila['tipo_indice']} → "
+                          f"{', '.join(fila['indices']) or 'sin índice ANN'}")
+            elif args.accion == 'sincronizar':
+                sincronizar_proyeccion_embeddings()
+            elif args.accion == 'eliminar':
+                eliminar_indices_ann(args.modelo, not args.sin_fragmentos)
+            else:
+                if args.por_pais:
+                    sincronizar_proyeccion_embeddings()
+                tiempos = reconstruir_indices_ann(
+                    args.modelo, args.tipo, not args.sin_fragmentos,
+                    maintenance_work_mem=args.maintenance_work_mem, workers=args.workers,
+                    por_pais=args.por_pais, almacenamiento=args.almacenamiento
+                )
+                print(f"\nÍndices construidos: {len(tiempos)} en {sum(tiempos.values()):.1f} s")
+            
         elif comando == "stats":
             # Mostrar estadísticas
             DatabaseEngine.initialize()
@@ -368,6 +1035,8 @@ if __name__ == "__main__":
             print("\nComandos disponibles:")
             print("  setup   - Setup completo de la base de datos")
             print("  verify  - Verificar conexión y extensiones")
+            print("  almacenes - Crear particiones de embeddings por modelo (migra tablas sin particionar)")
+            print("  indices {estado|eliminar|reconstruir|sincronizar} - Índices ANN y proyección")
             print("  stats   - Mostrar estadísticas")
     
     else:
@@ -375,4 +1044,6 @@ if __name__ == "__main__":
         print("\nComandos disponibles:")
         print("  setup   - Setup completo de la base de datos")
         print("  verify  - Verificar conexión y extensiones")
+        print("  almacenes - Crear particiones de embeddings por modelo (migra tablas sin particionar)")
+        print("  indices {estado|eliminar|reconstruir|sincronizar} - Índices ANN y proyección")
         print("  stats   - Mostrar estadísticas")
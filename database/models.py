@@ -8,7 +8,7 @@ Versión: 1.0
 """
 
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Dict
 from sqlalchemy import (
     Column, Integer, String, Text, Boolean, DateTime, Date, 
     Float, ForeignKey, ARRAY, CheckConstraint, UniqueConstraint
@@ -16,7 +16,8 @@ from sqlalchemy import (
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC
+import numpy as np
 import uuid
 
 Base = declarative_base()
@@ -146,6 +147,7 @@ class ArticuloNormativo(Base):
     # Relaciones
     documento = relationship("DocumentoNormativo", back_populates="articulos")
     embeddings = relationship("EmbeddingVectorial", back_populates="articulo", cascade="all, delete-orphan")
+    fragmentos = relationship("EmbeddingFragmento", back_populates="articulo", cascade="all, delete-orphan")
     requisitos = relationship("RequisitoPorSeccion", back_populates="articulo")
     
     def __repr__(self):
@@ -156,19 +158,93 @@ class ArticuloNormativo(Base):
 # MODELO: Embedding Vectorial
 # ============================================================================
 
+# Almacenamiento por modelo: embeddings_vectoriales y embeddings_fragmentos
+# están particionadas por modelo_embedding; cada partición tiene la dimensión
+# real del modelo y su propio índice ANN (hnsw o ivfflat). 'almacenamiento'
+# elige la columna: embedding (vector, float32) o embedding_half (halfvec,
+# float16: mitad de tabla e índice; medir la pérdida con
+# generate_embeddings.py --perdida-float16 antes de cambiarlo)
+ALMACENES_EMBEDDING = {
+    'sentence-transformers/paraphrase-multilingual-mpnet-base-v2': {'sufijo': 'mpnet', 'dimension': 768, 'indice': 'hnsw', 'almacenamiento': 'vector'},
+    'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2': {'sufijo': 'minilm', 'dimension': 384, 'indice': 'hnsw', 'almacenamiento': 'vector'},
+    'hiiamsid/sentence_similarity_spanish_es': {'sufijo': 'roberta', 'dimension': 768, 'indice': 'hnsw', 'almacenamiento': 'vector'},
+    'sentence-transformers/LaBSE': {'sufijo': 'labse', 'dimension': 768, 'indice': 'ivfflat', 'almacenamiento': 'vector'},  # Poco usado: menos memoria
+}
+
+TIPOS_ALMACENAMIENTO = ('vector', 'halfvec')
+
+
+def almacen_embedding(modelo_path: str, almacenamiento: Optional[str] = None) -> Dict:
+    """Particiones, columna y dimensión donde se guardan los vectores de un modelo
+    
+    Args:
+        modelo_path: Nombre completo del modelo (valor de modelo_embedding)
+        almacenamiento: 'vector' o 'halfvec' (None = el del registro)
+        
+    Returns:
+        Diccionario con dimension, almacenamiento, columna, tipo
+        ('vector(N)' o 'halfvec(N)'), opclase, tipo_indice, tabla,
+        tabla_fragmentos e indice / indice_fragmentos (prefijo del nombre
+        del índice ANN, que termina en _hnsw o _ivfflat)
+    """
+    if modelo_path not in ALMACENES_EMBEDDING:
+        raise ValueError(f"Modelo sin almacenamiento de embeddings: {modelo_path}")
+    
+    config = ALMACENES_EMBEDDING[modelo_path]
+    almacenamiento = almacenamiento or config['almacenamiento']
+    if almacenamiento not in TIPOS_ALMACENAMIENTO:
+        raise ValueError(f"Almacenamiento no soportado: {almacenamiento}")
+    
+    # Los índices halfvec llevan su propio nombre: no se confunden con los float32
+    sufijo_indice = config['sufijo'] + ('_half' if almacenamiento == 'halfvec' else '')
+    return {
+        'dimension': config['dimension'],
+        'almacenamiento': almacenamiento,
+        'columna': 'embedding_half' if almacenamiento == 'halfvec' else 'embedding',
+        'tipo': f"{almacenamiento}({config['dimension']})",
+        'opclase': f"{almacenamiento}_cosine_ops",
+        'tipo_indice': config['indice'],
+        'tabla': f"embeddings_vectoriales_{config['sufijo']}",
+        'tabla_fragmentos': f"embeddings_fragmentos_{config['sufijo']}",
+        'indice': f"idx_embeddings_{sufijo_indice}",
+        'indice_fragmentos': f"idx_fragmentos_{sufijo_indice}"
+    }
+
+
+def vector_a_numpy(valor) -> np.ndarray:
+    """Vector leído de embedding (ndarray) o embedding_half (HalfVector) como float32"""
+    if hasattr(valor, 'to_numpy'):
+        valor = valor.to_numpy()
+    return np.asarray(valor, dtype=np.float32)
+
+
 class EmbeddingVectorial(Base):
-    """Modelo para embeddings vectoriales de artículos"""
+    """Modelo para embeddings vectoriales de artículos (particionada por modelo)"""
     __tablename__ = 'embeddings_vectoriales'
     
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     articulo_id = Column(Integer, ForeignKey('articulos_normativos.id', ondelete='CASCADE'), nullable=False)
     
-    # Modelo utilizado
-    modelo_embedding = Column(String(100), nullable=False)
+    # Modelo utilizado (clave de partición)
+    modelo_embedding = Column(String(100), primary_key=True)
     dimension_vector = Column(Integer, nullable=False)
     
-    # Vector
-    embedding = Column(Vector(1536))  # Ajustar dimensión según modelo
+    # Vector (dimensión fijada por la partición del modelo); según el
+    # almacenamiento del modelo se usa embedding (float32) o embedding_half (float16)
+    embedding = Column(Vector())
+    embedding_half = Column(HALFVEC())
+    
+    # SHA-256 de modelo + texto normalizado: textos idénticos reutilizan el vector
+    hash_contenido = Column(String(64))
+    
+    # Proyección de recuperación: filtros y campos de presentación copiados
+    # del artículo y su documento (mantenidos por triggers en schema.sql)
+    pais_id = Column(Integer)
+    codigo_pais = Column(String(2))
+    estado = Column(String(20))
+    vigente = Column(Boolean)
+    numero_documento = Column(String(100))
+    numero_articulo = Column(String(50))
     
     # Metadatos
     fecha_generacion = Column(DateTime, default=datetime.utcnow)
@@ -177,6 +253,7 @@ class EmbeddingVectorial(Base):
     
     __table_args__ = (
         UniqueConstraint('articulo_id', 'modelo_embedding', name='uq_articulo_modelo'),
+        {'postgresql_partition_by': 'LIST (modelo_embedding)'},
     )
     
     # Relaciones
@@ -186,6 +263,58 @@ class EmbeddingVectorial(Base):
         return f"<EmbeddingVectorial(articulo_id={self.articulo_id}, modelo={self.modelo_embedding}, dim={self.dimension_vector})>"
 
 
+# ============================================================================
+# MODELO: Embedding de Fragmento
+# ============================================================================
+
+class EmbeddingFragmento(Base):
+    """Modelo para embeddings de ventanas solapadas de un artículo (particionada por modelo)"""
+    __tablename__ = 'embeddings_fragmentos'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    articulo_id = Column(Integer, ForeignKey('articulos_normativos.id', ondelete='CASCADE'), nullable=False)
+    
+    # Modelo utilizado (clave de partición)
+    modelo_embedding = Column(String(100), primary_key=True)
+    dimension_vector = Column(Integer, nullable=False)
+    
+    # Posición del fragmento dentro del texto del artículo
+    posicion = Column(Integer, nullable=False)  # 0, 1, 2...
+    offset_inicio = Column(Integer, nullable=False)  # Caracteres
+    offset_fin = Column(Integer, nullable=False)
+    num_tokens = Column(Integer)
+    
+    # Vector (dimensión fijada por la partición del modelo); según el
+    # almacenamiento del modelo se usa embedding (float32) o embedding_half (float16)
+    embedding = Column(Vector())
+    embedding_half = Column(HALFVEC())
+    
+    # SHA-256 de modelo + texto del artículo fragmentado (regenerar si cambia)
+    hash_contenido = Column(String(64))
+    
+    # Proyección de recuperación (como en EmbeddingVectorial)
+    pais_id = Column(Integer)
+    codigo_pais = Column(String(2))
+    estado = Column(String(20))
+    vigente = Column(Boolean)
+    numero_documento = Column(String(100))
+    numero_articulo = Column(String(50))
+    
+    # Metadatos
+    fecha_generacion = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('articulo_id', 'modelo_embedding', 'posicion', name='uq_fragmento_modelo'),
+        {'postgresql_partition_by': 'LIST (modelo_embedding)'},
+    )
+    
+    # Relaciones
+    articulo = relationship("ArticuloNormativo", back_populates="fragmentos")
+    
+    def __repr__(self):
+        return f"<EmbeddingFragmento(articulo_id={self.articulo_id}, posicion={self.posicion}, modelo={self.modelo_embedding})>"
+
+
 # ============================================================================
 # MODELO: Sección de Etiqueta
 # ============================================================================
@@ -342,6 +471,35 @@ class MetricaCalidad(Base):
         return f"<MetricaCalidad(proceso_id={self.proceso_id}, aprobado={self.aprobado}, validado_por={self.validado_por})>"
 
 
+# ============================================================================
+# MODELO: Cache de Armonizaciones
+# ============================================================================
+
+class CacheArmonizacion(Base):
+    """Modelo para respuestas LLM cacheadas por contenido del prompt"""
+    __tablename__ = 'cache_armonizaciones'
+    
+    id = Column(Integer, primary_key=True)
+    clave_hash = Column(String(64), unique=True, nullable=False)  # SHA-256 de prompt + configuración
+    
+    # Contexto
+    codigo_seccion = Column(String(50))
+    modelo_llm = Column(String(100), nullable=False)
+    temperatura = Column(Float)
+    max_tokens = Column(Integer)
+    
+    # Respuesta
+    respuesta = Column(Text, nullable=False)
+    
+    # Uso
+    num_usos = Column(Integer, default=0)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_ultimo_uso = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<CacheArmonizacion(seccion={self.codigo_seccion}, modelo={self.modelo_llm}, usos={self.num_usos})>"
+
+
 # ============================================================================
 # FUNCIONES AUXILIARES
 # ============================================================================
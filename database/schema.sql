@@ -143,18 +143,45 @@ CREATE INDEX idx_articulos_temas_array ON articulos_normativos USING GIN(temas_r
 -- ============================================================================
 -- TABLA 4: EMBEDDINGS_VECTORIALES
 -- ============================================================================
--- Representaciones vectoriales de artículos para búsqueda semántica
+-- Representaciones vectoriales de artículos para búsqueda semántica.
+-- Particionada por modelo: cada partición guarda solo los vectores de un
+-- modelo, con su dimensión real (CHECK) y su propio índice HNSW sobre
+-- embedding::vector(N). Las consultas ANN van a la partición del modelo
+-- (ALMACENES_EMBEDDING en database/models.py). En bases creadas antes del
+-- particionado, python database/db_config.py almacenes migra las tablas
+-- existentes (embeddings y fragmentos) conservando sus filas.
 
 CREATE TABLE embeddings_vectoriales (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     articulo_id INTEGER REFERENCES articulos_normativos(id) ON DELETE CASCADE,
     
     -- Modelo de embeddings utilizado
-    modelo_embedding VARCHAR(100) NOT NULL,  -- sentence-transformers, openai-ada-002
-    dimension_vector INTEGER NOT NULL,        -- 384, 768, 1536, etc.
-    
-    -- Vector de representación
-    embedding vector(1536),                   -- Ajustar dimensión según modelo
+    modelo_embedding VARCHAR(100) NOT NULL,  -- Clave de partición
+    dimension_vector INTEGER NOT NULL,        -- 384, 768
+    
+    -- Vector de representación (dimensión fijada por partición). Cada modelo
+    -- usa una de las dos columnas según su almacenamiento: float32 (vector) o
+    -- float16 (halfvec, pgvector >= 0.7: mitad de tabla e índice)
+    embedding vector,
+    embedding_half halfvec,
+    
+    -- SHA-256 de modelo + texto normalizado: artículos idénticos (nuevas
+    -- versiones, texto repetido entre países) copian el vector existente
+    hash_contenido CHAR(64),
+    
+    -- Proyección de recuperación: país, estado y campos de presentación del
+    -- artículo copiados en la fila, para que la búsqueda ANN filtre sin el
+    -- join embeddings → artículos → documentos → países. pais_id + vigente
+    -- definen los índices HNSW parciales por (modelo, país). Se fijan al
+    -- escribir el embedding y los mantienen los triggers de países,
+    -- documentos y artículos (trigger_embeddings_pais /
+    -- trigger_embeddings_documento / trigger_embeddings_articulo).
+    pais_id INTEGER,
+    codigo_pais CHAR(2),
+    estado VARCHAR(20),
+    vigente BOOLEAN,
+    numero_documento VARCHAR(100),
+    numero_articulo VARCHAR(50),
     
     -- Metadatos del embedding
     fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -163,21 +190,134 @@ CREATE TABLE embeddings_vectoriales (
     -- Métricas de calidad
     confianza_embedding FLOAT,
     
+    PRIMARY KEY (id, modelo_embedding),
     UNIQUE(articulo_id, modelo_embedding)
-);
+) PARTITION BY LIST (modelo_embedding);
+
+CREATE TABLE embeddings_vectoriales_mpnet PARTITION OF embeddings_vectoriales (
+    CHECK (vector_dims(embedding) = 768),
+    CHECK (vector_dims(embedding_half) = 768)
+) FOR VALUES IN ('sentence-transformers/paraphrase-multilingual-mpnet-base-v2');
+
+CREATE TABLE embeddings_vectoriales_minilm PARTITION OF embeddings_vectoriales (
+    CHECK (vector_dims(embedding) = 384),
+    CHECK (vector_dims(embedding_half) = 384)
+) FOR VALUES IN ('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2');
+
+CREATE TABLE embeddings_vectoriales_roberta PARTITION OF embeddings_vectoriales (
+    CHECK (vector_dims(embedding) = 768),
+    CHECK (vector_dims(embedding_half) = 768)
+) FOR VALUES IN ('hiiamsid/sentence_similarity_spanish_es');
+
+CREATE TABLE embeddings_vectoriales_labse PARTITION OF embeddings_vectoriales (
+    CHECK (vector_dims(embedding) = 768),
+    CHECK (vector_dims(embedding_half) = 768)
+) FOR VALUES IN ('sentence-transformers/LaBSE');
+
+-- Un índice ANN por modelo, sobre el vector con su dimensión real. Para
+-- cargas masivas, eliminarlos antes y reconstruirlos después con
+-- CREATE INDEX CONCURRENTLY: python database/db_config.py indices ...
+-- LaBSE usa IVFFlat, que se entrena con los datos: su índice se construye
+-- tras la primera carga (indices reconstruir --modelo labse). Los modelos con
+-- almacenamiento halfvec indexan embedding_half::halfvec(N) con
+-- halfvec_cosine_ops (idx_embeddings_<modelo>_half_*).
+CREATE INDEX idx_embeddings_mpnet_hnsw ON embeddings_vectoriales_mpnet
+    USING hnsw ((embedding::vector(768)) vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
 
--- Índice HNSW para búsqueda de vecinos más cercanos (FAST)
-CREATE INDEX idx_embeddings_hnsw ON embeddings_vectoriales 
-    USING hnsw (embedding vector_cosine_ops)
+CREATE INDEX idx_embeddings_minilm_hnsw ON embeddings_vectoriales_minilm
+    USING hnsw ((embedding::vector(384)) vector_cosine_ops)
     WITH (m = 16, ef_construction = 64);
 
--- Índice IVFFlat alternativo (menos memoria)
-CREATE INDEX idx_embeddings_ivfflat ON embeddings_vectoriales 
-    USING ivfflat (embedding vector_cosine_ops)
-    WITH (lists = 100);
+CREATE INDEX idx_embeddings_roberta_hnsw ON embeddings_vectoriales_roberta
+    USING hnsw ((embedding::vector(768)) vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
 
 CREATE INDEX idx_embeddings_articulo ON embeddings_vectoriales(articulo_id);
 CREATE INDEX idx_embeddings_modelo ON embeddings_vectoriales(modelo_embedding);
+CREATE INDEX idx_embeddings_hash ON embeddings_vectoriales(modelo_embedding, hash_contenido);
+
+-- ============================================================================
+-- TABLA 4b: EMBEDDINGS_FRAGMENTOS
+-- ============================================================================
+-- Embeddings de ventanas solapadas (por tokens) de cada artículo, para que la
+-- cola de los artículos largos también sea recuperable. La búsqueda puntúa
+-- fragmentos y agrega por artículo (máximo o suma). Particionada por modelo
+-- igual que embeddings_vectoriales.
+
+CREATE TABLE embeddings_fragmentos (
+    id SERIAL,
+    articulo_id INTEGER REFERENCES articulos_normativos(id) ON DELETE CASCADE,
+    
+    -- Modelo de embeddings utilizado
+    modelo_embedding VARCHAR(100) NOT NULL,
+    dimension_vector INTEGER NOT NULL,
+    
+    -- Posición del fragmento en el texto del artículo
+    posicion INTEGER NOT NULL,                -- 0, 1, 2...
+    offset_inicio INTEGER NOT NULL,           -- Offsets en caracteres
+    offset_fin INTEGER NOT NULL,
+    num_tokens INTEGER,
+    
+    -- Vector de representación (dimensión fijada por partición). Cada modelo
+    -- usa una de las dos columnas según su almacenamiento: float32 (vector) o
+    -- float16 (halfvec, pgvector >= 0.7: mitad de tabla e índice)
+    embedding vector,
+    embedding_half halfvec,
+    
+    -- Hash (modelo + texto normalizado) del artículo fragmentado: si el
+    -- texto cambia, sus fragmentos se regeneran
+    hash_contenido CHAR(64),
+    
+    -- Proyección de recuperación del artículo, igual que en
+    -- embeddings_vectoriales y mantenida por los mismos triggers
+    pais_id INTEGER,
+    codigo_pais CHAR(2),
+    estado VARCHAR(20),
+    vigente BOOLEAN,
+    numero_documento VARCHAR(100),
+    numero_articulo VARCHAR(50),
+    
+    fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    
+    PRIMARY KEY (id, modelo_embedding),
+    UNIQUE(articulo_id, modelo_embedding, posicion)
+) PARTITION BY LIST (modelo_embedding);
+
+CREATE TABLE embeddings_fragmentos_mpnet PARTITION OF embeddings_fragmentos (
+    CHECK (vector_dims(embedding) = 768),
+    CHECK (vector_dims(embedding_half) = 768)
+) FOR VALUES IN ('sentence-transformers/paraphrase-multilingual-mpnet-base-v2');
+
+CREATE TABLE embeddings_fragmentos_minilm PARTITION OF embeddings_fragmentos (
+    CHECK (vector_dims(embedding) = 384),
+    CHECK (vector_dims(embedding_half) = 384)
+) FOR VALUES IN ('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2');
+
+CREATE TABLE embeddings_fragmentos_roberta PARTITION OF embeddings_fragmentos (
+    CHECK (vector_dims(embedding) = 768),
+    CHECK (vector_dims(embedding_half) = 768)
+) FOR VALUES IN ('hiiamsid/sentence_similarity_spanish_es');
+
+CREATE TABLE embeddings_fragmentos_labse PARTITION OF embeddings_fragmentos (
+    CHECK (vector_dims(embedding) = 768),
+    CHECK (vector_dims(embedding_half) = 768)
+) FOR VALUES IN ('sentence-transformers/LaBSE');
+
+CREATE INDEX idx_fragmentos_mpnet_hnsw ON embeddings_fragmentos_mpnet
+    USING hnsw ((embedding::vector(768)) vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX idx_fragmentos_minilm_hnsw ON embeddings_fragmentos_minilm
+    USING hnsw ((embedding::vector(384)) vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX idx_fragmentos_roberta_hnsw ON embeddings_fragmentos_roberta
+    USING hnsw ((embedding::vector(768)) vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX idx_fragmentos_articulo ON embeddings_fragmentos(articulo_id);
+CREATE INDEX idx_fragmentos_modelo ON embeddings_fragmentos(modelo_embedding);
 
 -- ============================================================================
 -- TABLA 5: SECCIONES_ETIQUETA
@@ -322,6 +462,35 @@ CREATE INDEX idx_metricas_proceso ON metricas_calidad(proceso_id);
 CREATE INDEX idx_metricas_validado ON metricas_calidad(validado_por);
 CREATE INDEX idx_metricas_aprobado ON metricas_calidad(aprobado);
 
+-- ============================================================================
+-- TABLA 9: CACHE_ARMONIZACIONES
+-- ============================================================================
+-- Respuestas LLM por sección, direccionadas por el hash del prompt final y la
+-- configuración del modelo. El prompt de sección no incluye el producto, por
+-- lo que la misma respuesta sirve para todo el catálogo.
+
+CREATE TABLE cache_armonizaciones (
+    id SERIAL PRIMARY KEY,
+    clave_hash CHAR(64) UNIQUE NOT NULL,   -- SHA-256 (prompt + modelo + parámetros)
+    
+    -- Contexto
+    codigo_seccion VARCHAR(50),
+    modelo_llm VARCHAR(100) NOT NULL,
+    temperatura FLOAT,
+    max_tokens INTEGER,
+    
+    -- Respuesta cruda del LLM (se parsea al leer)
+    respuesta TEXT NOT NULL,
+    
+    -- Uso
+    num_usos INTEGER DEFAULT 0,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_ultimo_uso TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_cache_arm_seccion ON cache_armonizaciones(codigo_seccion);
+CREATE INDEX idx_cache_arm_modelo ON cache_armonizaciones(modelo_llm);
+
 -- ============================================================================
 -- VISTAS ÚTILES
 -- ============================================================================
@@ -378,10 +547,13 @@ ORDER BY fecha DESC;
 -- ============================================================================
 
 -- Función para buscar artículos similares por embedding
+-- Cada modelo guarda sus vectores en embedding (vector) o en embedding_half
+-- (halfvec); la columna se elige según las filas del modelo y la distancia
+-- se calcula sobre columna::tipo(N), la misma expresión que su índice ANN.
 CREATE OR REPLACE FUNCTION buscar_articulos_similares(
-    query_embedding vector(1536),
+    query_embedding vector,
     limite INTEGER DEFAULT 5,
-    modelo VARCHAR(100) DEFAULT 'sentence-transformers'
+    modelo VARCHAR(100) DEFAULT 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
 )
 RETURNS TABLE (
     articulo_id INTEGER,
@@ -391,22 +563,108 @@ RETURNS TABLE (
     documento VARCHAR,
     similitud FLOAT
 ) AS $$
+DECLARE
+    columna TEXT := 'embedding';
+    tipo TEXT := format('vector(%s)', vector_dims(query_embedding));
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM embeddings_vectoriales e
+        WHERE e.modelo_embedding = modelo AND e.embedding_half IS NOT NULL
+    ) THEN
+        columna := 'embedding_half';
+        tipo := format('halfvec(%s)', vector_dims(query_embedding));
+    END IF;
+    
+    RETURN QUERY EXECUTE format($consulta$
+        SELECT
+            a.id,
+            a.numero_articulo,
+            a.texto_completo,
+            p.nombre,
+            e.numero_documento,
+            1 - (e.%1$I::%2$s <=> $1::%2$s) AS similitud
+        FROM embeddings_vectoriales e
+        JOIN articulos_normativos a ON e.articulo_id = a.id
+        JOIN paises p ON e.pais_id = p.id
+        WHERE e.modelo_embedding = $2
+        ORDER BY e.%1$I::%2$s <=> $1::%2$s
+        LIMIT $3
+    $consulta$, columna, tipo)
+    USING query_embedding, modelo, limite;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Funciones para mantener la proyección de recuperación en
+-- embeddings_vectoriales y embeddings_fragmentos
+CREATE OR REPLACE FUNCTION propagar_documento_embeddings()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE embeddings_vectoriales e
+    SET pais_id = NEW.pais_id,
+        codigo_pais = p.codigo_iso,
+        estado = NEW.estado,
+        vigente = (NEW.estado = 'vigente'),
+        numero_documento = NEW.numero_documento
+    FROM articulos_normativos a, paises p
+    WHERE a.documento_id = NEW.id
+        AND e.articulo_id = a.id
+        AND p.id = NEW.pais_id;
+    
+    UPDATE embeddings_fragmentos f
+    SET pais_id = NEW.pais_id,
+        codigo_pais = p.codigo_iso,
+        estado = NEW.estado,
+        vigente = (NEW.estado = 'vigente'),
+        numero_documento = NEW.numero_documento
+    FROM articulos_normativos a, paises p
+    WHERE a.documento_id = NEW.id
+        AND f.articulo_id = a.id
+        AND p.id = NEW.pais_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION propagar_articulo_embeddings()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE embeddings_vectoriales e
+    SET pais_id = d.pais_id,
+        codigo_pais = p.codigo_iso,
+        estado = d.estado,
+        vigente = (d.estado = 'vigente'),
+        numero_documento = d.numero_documento,
+        numero_articulo = NEW.numero_articulo
+    FROM documentos_normativos d
+    JOIN paises p ON p.id = d.pais_id
+    WHERE d.id = NEW.documento_id
+        AND e.articulo_id = NEW.id;
+    
+    UPDATE embeddings_fragmentos f
+    SET pais_id = d.pais_id,
+        codigo_pais = p.codigo_iso,
+        estado = d.estado,
+        vigente = (d.estado = 'vigente'),
+        numero_documento = d.numero_documento,
+        numero_articulo = NEW.numero_articulo
+    FROM documentos_normativos d
+    JOIN paises p ON p.id = d.pais_id
+    WHERE d.id = NEW.documento_id
+        AND f.articulo_id = NEW.id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION propagar_pais_embeddings()
+RETURNS TRIGGER AS $$
 BEGIN
-    RETURN QUERY
-    SELECT 
-        a.id,
-        a.numero_articulo,
-        a.texto_completo,
-        p.nombre,
-        d.numero_documento,
-        1 - (e.embedding <=> query_embedding) as similitud
-    FROM embeddings_vectoriales e
-    JOIN articulos_normativos a ON e.articulo_id = a.id
-    JOIN documentos_normativos d ON a.documento_id = d.id
-    JOIN paises p ON d.pais_id = p.id
-    WHERE e.modelo_embedding = modelo
-    ORDER BY e.embedding <=> query_embedding
-    LIMIT limite;
+    UPDATE embeddings_vectoriales e
+    SET codigo_pais = NEW.codigo_iso
+    WHERE e.pais_id = NEW.id;
+    
+    UPDATE embeddings_fragmentos f
+    SET codigo_pais = NEW.codigo_iso
+    WHERE f.pais_id = NEW.id;
+    RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -432,6 +690,28 @@ CREATE TRIGGER trigger_actualizar_articulos
     BEFORE UPDATE ON articulos_normativos
     FOR EACH ROW EXECUTE FUNCTION actualizar_timestamp();
 
+-- Refresco incremental de la proyección de recuperación (solo filas afectadas)
+CREATE TRIGGER trigger_embeddings_pais
+    AFTER UPDATE OF codigo_iso ON paises
+    FOR EACH ROW
+    WHEN (OLD.codigo_iso IS DISTINCT FROM NEW.codigo_iso)
+    EXECUTE FUNCTION propagar_pais_embeddings();
+
+CREATE TRIGGER trigger_embeddings_documento
+    AFTER UPDATE OF pais_id, estado, numero_documento ON documentos_normativos
+    FOR EACH ROW
+    WHEN (OLD.pais_id IS DISTINCT FROM NEW.pais_id
+          OR OLD.estado IS DISTINCT FROM NEW.estado
+          OR OLD.numero_documento IS DISTINCT FROM NEW.numero_documento)
+    EXECUTE FUNCTION propagar_documento_embeddings();
+
+CREATE TRIGGER trigger_embeddings_articulo
+    AFTER UPDATE OF documento_id, numero_articulo ON articulos_normativos
+    FOR EACH ROW
+    WHEN (OLD.documento_id IS DISTINCT FROM NEW.documento_id
+          OR OLD.numero_articulo IS DISTINCT FROM NEW.numero_articulo)
+    EXECUTE FUNCTION propagar_articulo_embeddings();
+
 -- ============================================================================
 -- COMENTARIOS EN TABLAS Y COLUMNAS
 -- ============================================================================
@@ -444,6 +724,7 @@ COMMENT ON TABLE secciones_etiqueta IS 'Catálogo de secciones estándar de etiq
 COMMENT ON TABLE requisitos_por_seccion IS 'Requisitos normativos específicos por país y sección';
 COMMENT ON TABLE historial_procesamiento IS 'Log de etiquetas procesadas por el sistema';
 COMMENT ON TABLE metricas_calidad IS 'Métricas de calidad y validación de documentos generados';
+COMMENT ON TABLE cache_armonizaciones IS 'Cache de respuestas LLM por sección, direccionada por contenido del prompt';
 
 -- ============================================================================
 -- FIN DEL SCHEMA
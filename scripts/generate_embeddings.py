@@ -8,8 +8,12 @@ Versión: 1.0
 
 import sys
 import os
+import hashlib
+import queue
+import multiprocessing as mp
+import threading
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple, Iterator
 from dataclasses import dataclass
 from datetime import datetime
 import numpy as np
@@ -21,8 +25,14 @@ from sentence_transformers import SentenceTransformer
 
 # Database
 sys.path.append(str(Path(__file__).parent.parent))
-from database.db_config import get_db_session, DatabaseEngine
-from database.models import ArticuloNormativo, EmbeddingVectorial, DocumentoNormativo
+from database.db_config import (
+    get_db_session, DatabaseEngine, eliminar_indices_ann, reconstruir_indices_ann,
+    reconstruir_indices_eliminados
+)
+from database.models import (
+    ArticuloNormativo, EmbeddingVectorial, DocumentoNormativo, EmbeddingFragmento,
+    Pais, almacen_embedding, vector_a_numpy
+)
 
 # ============================================================================
 # CONFIGURACIÓN DE MODELOS
@@ -79,6 +89,168 @@ class EmbeddingGenerado:
     tiempo_generacion: float
     modelo: str
     dimension: int
+    hash_contenido: Optional[str] = None
+
+
+@dataclass
+class Fragmento:
+    """Ventana de tokens de un artículo"""
+    articulo_id: int
+    posicion: int
+    offset_inicio: int
+    offset_fin: int
+    num_tokens: int
+
+
+# ============================================================================
+# HASH DE CONTENIDO
+# ============================================================================
+
+def hash_contenido(texto: str, modelo: str) -> str:
+    """SHA-256 de modelo + texto normalizado (espacios colapsados)
+    
+    Dos artículos con el mismo hash producen el mismo vector con el mismo
+    modelo, así que el segundo puede copiar el embedding del primero.
+    """
+    normalizado = ' '.join(texto.split())
+    return hashlib.sha256(f"{modelo}\n{normalizado}".encode('utf-8')).hexdigest()
+
+
+# ============================================================================
+# POOL MULTIPROCESO (CPU)
+# ============================================================================
+
+def _trabajador_codificacion(
+    modelo_path: str,
+    nucleos: List[int],
+    hilos_torch: int,
+    entrada: 'mp.Queue',
+    salida: 'mp.Queue'
+):
+    """Proceso del pool: fija afinidad e hilos, carga el modelo y codifica lotes"""
+    if nucleos and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, nucleos)
+    torch.set_num_threads(hilos_torch)
+    modelo = SentenceTransformer(modelo_path, device='cpu')
+    
+    while True:
+        tarea = entrada.get()
+        if tarea is None:
+            return
+        id_lote, textos = tarea
+        try:
+            vectores = modelo.encode(
+                textos,
+                batch_size=len(textos),
+                convert_to_numpy=True,
+                show_progress_bar=False,
+                normalize_embeddings=True
+            )
+            salida.put((id_lote, vectores, None))
+        except Exception as e:
+            salida.put((id_lote, None, f"{type(e).__name__}: {e}"))
+
+
+class PoolCodificacion:
+    """Pool de procesos de codificación en CPU
+    
+    Equivalente a start_multi_process_pool de sentence-transformers, pero
+    cada proceso queda fijado a su propio grupo de núcleos y con un número
+    fijo de hilos de torch, para que los procesos no compitan entre sí.
+    Los lotes se reparten por una cola común y los resultados se devuelven
+    en el orden en que se enviaron.
+    """
+    
+    def __init__(
+        self,
+        modelo_path: str,
+        procesos: Optional[int] = None,
+        hilos_por_proceso: Optional[int] = None
+    ):
+        """Arrancar el pool
+        
+        Args:
+            modelo_path: Nombre o ruta del modelo SentenceTransformer
+            procesos: Procesos trabajadores (None = núcleos / hilos_por_proceso)
+            hilos_por_proceso: Hilos de torch por proceso (None = núcleos / procesos)
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            nucleos = sorted(os.sched_getaffinity(0))
+        else:
+            nucleos = list(range(os.cpu_count() or 1))
+        
+        if procesos is None:
+            procesos = max(1, len(nucleos) // (hilos_por_proceso or 1))
+        if hilos_por_proceso is None:
+            hilos_por_proceso = max(1, len(nucleos) // procesos)
+        
+        self.procesos = procesos
+        self.hilos_por_proceso = hilos_por_proceso
+        
+        # spawn: torch no es seguro tras fork con hilos ya creados
+        contexto = mp.get_context('spawn')
+        self.entrada = contexto.Queue()
+        self.salida = contexto.Queue()
+        self.trabajadores = []
+        
+        for i in range(procesos):
+            # Grupos contiguos de núcleos; si hay más procesos que grupos, se reparten
+            inicio = (i * hilos_por_proceso) % len(nucleos)
+            asignados = [nucleos[(inicio + j) % len(nucleos)] for j in range(hilos_por_proceso)]
+            proceso = contexto.Process(
+                target=_trabajador_codificacion,
+                args=(modelo_path, sorted(set(asignados)), hilos_por_proceso,
+                      self.entrada, self.salida),
+                name=f'embeddings-cpu-{i}',
+                daemon=True
+            )
+            proceso.start()
+            self.trabajadores.append(proceso)
+        
+        print(f"   Pool CPU: {procesos} procesos × {hilos_por_proceso} hilos "
+              f"({len(nucleos)} núcleos disponibles)")
+    
+    def codificar(self, lotes: List[List[str]], mostrar_progreso: bool = False) -> List[np.ndarray]:
+        """Codificar lotes en paralelo
+        
+        Args:
+            lotes: Lotes de textos (cada uno se codifica entero en un proceso)
+            mostrar_progreso: Mostrar barra de progreso por lotes
+            
+        Returns:
+            Matrices de embeddings, una por lote y en el mismo orden
+        """
+        for id_lote, textos in enumerate(lotes):
+            self.entrada.put((id_lote, textos))
+        
+        resultados: List[Optional[np.ndarray]] = [None] * len(lotes)
+        error = None
+        for _ in tqdm(range(len(lotes)), desc="Lotes", disable=not mostrar_progreso):
+            while True:
+                try:
+                    id_lote, vectores, mensaje = self.salida.get(timeout=5)
+                    break
+                except queue.Empty:
+                    caidos = [p.name for p in self.trabajadores if not p.is_alive()]
+                    if caidos:
+                        raise RuntimeError(f"Procesos de codificación caídos: {', '.join(caidos)}")
+            if mensaje is not None:
+                error = error or mensaje  # Se sigue drenando la cola
+            resultados[id_lote] = vectores
+        
+        if error is not None:
+            raise RuntimeError(f"Error en pool de codificación: {error}")
+        return resultados
+    
+    def cerrar(self):
+        """Detener los procesos del pool"""
+        for _ in self.trabajadores:
+            self.entrada.put(None)
+        for proceso in self.trabajadores:
+            proceso.join(timeout=10)
+            if proceso.is_alive():
+                proceso.terminate()
+        self.trabajadores = []
 
 
 # ============================================================================
@@ -117,6 +289,27 @@ class EmbeddingGenerator:
         )
         
         print(f"   ✓ Modelo cargado exitosamente")
+        
+        self.pool: Optional[PoolCodificacion] = None
+    
+    def iniciar_pool(self, procesos: Optional[int] = None, hilos_por_proceso: Optional[int] = None):
+        """Arrancar un pool multiproceso en CPU para generar_batch
+        
+        Args:
+            procesos: Procesos trabajadores (None = automático)
+            hilos_por_proceso: Hilos de torch por proceso (None = automático)
+        """
+        if self.device != 'cpu':
+            print(f"   ⚠ Pool multiproceso solo para CPU; se usa {self.device.upper()}")
+            return
+        if self.pool is None:
+            self.pool = PoolCodificacion(self.modelo_path, procesos, hilos_por_proceso)
+    
+    def cerrar_pool(self):
+        """Detener el pool multiproceso si está activo"""
+        if self.pool is not None:
+            self.pool.cerrar()
+            self.pool = None
     
     def generar_embedding(self, texto: str) -> np.ndarray:
         """Generar embedding para un texto
@@ -127,9 +320,8 @@ class EmbeddingGenerator:
         Returns:
             Vector numpy de embeddings
         """
-        # Normalizar texto (limitar longitud)
-        max_length = 512  # Tokens máximos
-        texto = texto[:max_length * 4]  # Aproximado (4 chars = 1 token)
+        # Limitar longitud a la secuencia máxima del modelo (tokens reales)
+        texto = self.truncar(texto)
         
         # Generar embedding
         embedding = self.modelo.encode(
@@ -141,25 +333,143 @@ class EmbeddingGenerator:
         
         return embedding
     
-    def generar_batch(self, textos: List[str], batch_size: int = 32) -> List[np.ndarray]:
-        """Generar embeddings por lotes (más eficiente)
+    def contar_tokens(self, textos: List[str]) -> List[int]:
+        """Tokens de cada texto tras truncar a la secuencia máxima (incluye especiales)"""
+        codificados = self.modelo.tokenizer(
+            textos,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=self.modelo.max_seq_length
+        )
+        return [len(ids) for ids in codificados['input_ids']]
+    
+    def truncar(self, texto: str, max_tokens: Optional[int] = None) -> str:
+        """Recortar el texto a max_tokens tokens reales del modelo
+        
+        Args:
+            texto: Texto a recortar
+            max_tokens: Tokens máximos (None = secuencia máxima menos especiales)
+        """
+        if max_tokens is None:
+            max_tokens = self.modelo.max_seq_length - 2
+        
+        offsets = self.modelo.tokenizer(
+            texto,
+            add_special_tokens=False,
+            return_offsets_mapping=True
+        )['offset_mapping']
+        
+        if len(offsets) <= max_tokens:
+            return texto
+        return texto[:offsets[max_tokens - 1][1]]
+    
+    def generar_batch(
+        self,
+        textos: List[str],
+        batch_size: int = 32,
+        max_tokens_lote: Optional[int] = None,
+        mostrar_progreso: bool = True
+    ) -> np.ndarray:
+        """Generar embeddings por lotes homogéneos en longitud
+        
+        Los textos se tokenizan primero y se ordenan por número de tokens,
+        de modo que cada lote rellena (padding) casi nada; los lotes de
+        textos cortos admiten más textos mientras no superen max_tokens_lote
+        tokens con relleno. El resultado conserva el orden de entrada.
         
         Args:
             textos: Lista de textos
-            batch_size: Tamaño del lote
+            batch_size: Textos por lote para la longitud máxima del modelo
+            max_tokens_lote: Tokens (con relleno) por lote
+                (None = batch_size * secuencia máxima)
+            mostrar_progreso: Mostrar barra de progreso por lotes
             
         Returns:
-            Lista de embeddings
+            Matriz (len(textos), dimensión) en el orden original
         """
-        embeddings = self.modelo.encode(
-            textos,
-            batch_size=batch_size,
-            convert_to_numpy=True,
-            show_progress_bar=True,
-            normalize_embeddings=True
-        )
+        if not textos:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        
+        if max_tokens_lote is None:
+            max_tokens_lote = batch_size * self.modelo.max_seq_length
+        
+        longitudes = np.array(self.contar_tokens(textos))
+        orden = np.argsort(-longitudes, kind='stable')  # Largos primero
+        
+        # Lotes: el primer texto de cada lote es el más largo y fija el relleno
+        lotes = []
+        inicio = 0
+        while inicio < len(orden):
+            capacidad = max(1, max_tokens_lote // int(longitudes[orden[inicio]]))
+            lotes.append(orden[inicio:inicio + capacidad])
+            inicio += capacidad
+        
+        if self.pool is not None:
+            resultados = self.pool.codificar(
+                [[textos[i] for i in lote] for lote in lotes],
+                mostrar_progreso=mostrar_progreso
+            )
+        else:
+            resultados = (
+                self.modelo.encode(
+                    [textos[i] for i in lote],
+                    batch_size=len(lote),
+                    convert_to_numpy=True,
+                    show_progress_bar=False,
+                    normalize_embeddings=True
+                )
+                for lote in tqdm(lotes, desc="Lotes", disable=not mostrar_progreso)
+            )
+        
+        embeddings = None
+        for lote, vectores in zip(lotes, resultados):
+            if embeddings is None:
+                embeddings = np.empty((len(textos), vectores.shape[1]), dtype=vectores.dtype)
+            embeddings[lote] = vectores
         
         return embeddings
+    
+    def fragmentar(
+        self,
+        texto: str,
+        ventana: Optional[int] = None,
+        solape: int = 64
+    ) -> List[Tuple[int, int, int]]:
+        """Dividir un texto en ventanas de tokens solapadas
+        
+        Las ventanas se cuentan con el tokenizer del modelo y se devuelven
+        como offsets de caracteres, de modo que cada fragmento cabe entero
+        en la secuencia máxima del modelo.
+        
+        Args:
+            texto: Texto del artículo
+            ventana: Tokens por fragmento (None = secuencia máxima del modelo)
+            solape: Tokens compartidos entre fragmentos consecutivos
+            
+        Returns:
+            Lista de (offset_inicio, offset_fin, num_tokens)
+        """
+        if ventana is None:
+            ventana = self.modelo.max_seq_length - 2  # [CLS] y [SEP]
+        paso = max(1, ventana - solape)
+        
+        offsets = self.modelo.tokenizer(
+            texto,
+            add_special_tokens=False,
+            return_offsets_mapping=True
+        )['offset_mapping']
+        
+        if not offsets:
+            return []
+        
+        fragmentos = []
+        for inicio in range(0, len(offsets), paso):
+            fin = min(inicio + ventana, len(offsets))
+            fragmentos.append((offsets[inicio][0], offsets[fin - 1][1], fin - inicio))
+            if fin == len(offsets):
+                break
+        
+        return fragmentos
 
 
 # ============================================================================
@@ -169,154 +479,350 @@ class EmbeddingGenerator:
 class ArticulosEmbedder:
     """Procesa artículos y genera embeddings"""
     
-    def __init__(self, modelo_nombre: str = MODELO_DEFAULT):
+    # Columnas de embeddings_vectoriales y embeddings_fragmentos copiadas del
+    # artículo y su documento
+    COLUMNAS_PROYECCION = (
+        'pais_id', 'codigo_pais', 'estado', 'vigente', 'numero_documento', 'numero_articulo'
+    )
+    
+    def __init__(
+        self,
+        modelo_nombre: str = MODELO_DEFAULT,
+        procesos: Optional[int] = None,
+        hilos_por_proceso: Optional[int] = None,
+        almacenamiento: Optional[str] = None
+    ):
+        """Inicializar procesador
+        
+        Args:
+            modelo_nombre: Clave del modelo en MODELOS_DISPONIBLES
+            procesos: Procesos del pool de codificación en CPU (None = sin pool)
+            hilos_por_proceso: Hilos de torch por proceso del pool
+            almacenamiento: 'vector' (float32) o 'halfvec' (float16);
+                None = el del registro para el modelo
+        """
         self.generator = EmbeddingGenerator(modelo_nombre)
+        
+        # Partición del modelo en embeddings_vectoriales (las escrituras sobre
+        # la tabla padre se enrutan por modelo_embedding)
+        self.almacen = almacen_embedding(self.generator.modelo_path, almacenamiento)
+        if self.almacen['dimension'] != self.generator.dimension:
+            raise ValueError(
+                f"Dimensión {self.generator.dimension} del modelo distinta de la de "
+                f"{self.almacen['tabla']} ({self.almacen['dimension']})"
+            )
+        print(f"   Almacenamiento: {self.almacen['tabla']}.{self.almacen['columna']} "
+              f"({self.almacen['tipo']})")
+        
+        if procesos is not None or hilos_por_proceso is not None:
+            self.generator.iniciar_pool(procesos, hilos_por_proceso)
         self.estadisticas = {
             'total_procesados': 0,
             'nuevos': 0,
             'actualizados': 0,
             'errores': 0,
-            'tiempo_total': 0
+            'tiempo_total': 0,
+            'filas_escritas': 0,
+            'tiempo_escritura': 0.0,
+            'codificados': 0,
+            'reutilizados': 0
         }
+        self.ultimo_id_guardado: Optional[int] = None
     
-    def obtener_articulos_pendientes(
+    def iterar_articulos_pendientes(
         self,
         solo_sin_embeddings: bool = True,
-        limite: Optional[int] = None
-    ) -> List[ArticuloNormativo]:
-        """Obtener artículos que necesitan embeddings
+        limite: Optional[int] = None,
+        desde_id: Optional[int] = None,
+        tamano_pagina: int = 1000
+    ) -> Iterator[List[Tuple[int, str]]]:
+        """Recorrer los artículos pendientes por páginas, sin cargarlos todos
+        
+        Paginación keyset sobre id (WHERE id > último ORDER BY id LIMIT n):
+        cada página es una consulta corta que usa la PK, sin OFFSET ni una
+        transacción abierta durante toda la codificación. Dentro de la
+        página las filas se leen con yield_per (cursor de servidor). Solo
+        se leen id y texto, nunca objetos ORM completos.
         
         Args:
-            solo_sin_embeddings: Solo artículos sin embeddings del modelo actual
+            solo_sin_embeddings: Solo artículos sin embedding del modelo actual
             limite: Límite de artículos (None = todos)
+            desde_id: Reanudar después de este id (ver ultimo_id_guardado)
+            tamano_pagina: Artículos por página
             
-        Returns:
-            Lista de artículos
+        Yields:
+            Listas de (articulo_id, texto) en orden creciente de id, omitiendo
+            textos de menos de 10 caracteres
         """
-        with get_db_session() as session:
-            query = session.query(ArticuloNormativo)
+        from sqlalchemy import exists, and_
+        
+        ultimo_id = desde_id or 0
+        restantes = limite
+        
+        while restantes is None or restantes > 0:
+            tamano = tamano_pagina if restantes is None else min(tamano_pagina, restantes)
             
-            if solo_sin_embeddings:
-                # Subconsulta: artículos que ya tienen embedding de este modelo
-                from sqlalchemy import exists, and_
+            with get_db_session() as session:
+                query = session.query(
+                    ArticuloNormativo.id,
+                    ArticuloNormativo.texto_normalizado,
+                    ArticuloNormativo.texto_completo
+                ).filter(ArticuloNormativo.id > ultimo_id)
                 
-                subquery = session.query(EmbeddingVectorial.articulo_id).filter(
-                    and_(
-                        EmbeddingVectorial.articulo_id == ArticuloNormativo.id,
-                        EmbeddingVectorial.modelo_embedding == self.generator.modelo_path
+                if solo_sin_embeddings:
+                    subquery = session.query(EmbeddingVectorial.articulo_id).filter(
+                        and_(
+                            EmbeddingVectorial.articulo_id == ArticuloNormativo.id,
+                            EmbeddingVectorial.modelo_embedding == self.generator.modelo_path
+                        )
                     )
-                )
+                    query = query.filter(~exists(subquery))
                 
-                # Filtrar artículos sin embedding
-                query = query.filter(~exists(subquery))
+                filas = [
+                    (fila.id, fila.texto_normalizado or fila.texto_completo)
+                    for fila in query.order_by(ArticuloNormativo.id)
+                    .limit(tamano)
+                    .yield_per(min(tamano, 500))
+                ]
             
-            if limite:
-                query = query.limit(limite)
+            if not filas:
+                return
             
-            articulos = query.all()
+            ultimo_id = filas[-1][0]
+            if restantes is not None:
+                restantes -= len(filas)
             
-            # Desconectar de la sesión para evitar lazy loading issues
-            for art in articulos:
-                session.expunge(art)
+            pagina = [(articulo_id, texto) for articulo_id, texto in filas
+                      if texto and len(texto.strip()) >= 10]
+            if pagina:
+                yield pagina
             
-            return articulos
+            if len(filas) < tamano:
+                return
     
-    def procesar_articulo(
-        self,
-        articulo: ArticuloNormativo,
-        actualizar_existente: bool = False
-    ) -> Optional[EmbeddingGenerado]:
-        """Procesar un artículo individual
+    def buscar_por_hash(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """Vectores ya guardados para estos hashes de contenido (modelo actual)
         
         Args:
-            articulo: Artículo a procesar
-            actualizar_existente: Si True, actualiza embedding existente
+            hashes: Hashes de contenido (ver hash_contenido)
             
         Returns:
-            EmbeddingGenerado o None si falla
+            Diccionario hash -> embedding, solo con los hashes encontrados
         """
-        inicio = datetime.now()
+        if not hashes:
+            return {}
         
-        try:
-            # Usar texto normalizado si existe, sino completo
-            texto = articulo.texto_normalizado or articulo.texto_completo
-            
-            if not texto or len(texto.strip()) < 10:
-                print(f"⚠ Artículo {articulo.id}: Texto insuficiente")
-                return None
-            
-            # Generar embedding
-            embedding = self.generator.generar_embedding(texto)
-            
-            tiempo = (datetime.now() - inicio).total_seconds()
+        columna = getattr(EmbeddingVectorial, self.almacen['columna'])
+        with get_db_session() as session:
+            filas = session.query(
+                EmbeddingVectorial.hash_contenido,
+                columna.label('vector')
+            ).filter(
+                EmbeddingVectorial.modelo_embedding == self.generator.modelo_path,
+                EmbeddingVectorial.hash_contenido.in_(set(hashes)),
+                columna.isnot(None)
+            ).distinct(EmbeddingVectorial.hash_contenido).all()
+        
+        return {fila.hash_contenido: vector_a_numpy(fila.vector) for fila in filas}
+    
+    def codificar_pagina(
+        self,
+        pagina: List[Tuple[int, str]],
+        batch_size: int = 32,
+        conocidos: Optional[Dict[str, np.ndarray]] = None
+    ) -> List[EmbeddingGenerado]:
+        """Generar embeddings de una página, codificando solo textos nuevos
+        
+        Los artículos cuyo hash ya tiene vector (conocidos) lo copian, y los
+        textos repetidos dentro de la página se codifican una sola vez: una
+        versión nueva de un decreto solo paga forward passes por los
+        artículos que realmente cambiaron.
+        
+        Args:
+            pagina: Lista de (articulo_id, texto)
+            batch_size: Tamaño de lote para el encode
+            conocidos: Vectores existentes por hash (ver buscar_por_hash)
             
-            return EmbeddingGenerado(
-                articulo_id=articulo.id,
-                embedding=embedding,
-                tiempo_generacion=tiempo,
-                modelo=self.generator.modelo_path,
-                dimension=len(embedding)
+        Returns:
+            Embeddings en el orden de la página
+        """
+        modelo = self.generator.modelo_path
+        hashes = [hash_contenido(texto, modelo) for _, texto in pagina]
+        vectores = dict(conocidos or {})
+        
+        # Un texto por hash desconocido
+        nuevos: Dict[str, str] = {}
+        for (_, texto), huella in zip(pagina, hashes):
+            if huella not in vectores and huella not in nuevos:
+                nuevos[huella] = texto
+        
+        if nuevos:
+            codificados = self.generator.generar_batch(
+                list(nuevos.values()),
+                batch_size=batch_size,
+                mostrar_progreso=False
             )
-            
-        except Exception as e:
-            print(f"✗ Error procesando artículo {articulo.id}: {str(e)}")
-            self.estadisticas['errores'] += 1
-            return None
+            vectores.update(zip(nuevos.keys(), codificados))
+        
+        self.estadisticas['codificados'] += len(nuevos)
+        self.estadisticas['reutilizados'] += len(pagina) - len(nuevos)
+        
+        return [
+            EmbeddingGenerado(
+                articulo_id=articulo_id,
+                embedding=vectores[huella],
+                tiempo_generacion=0.0,
+                modelo=modelo,
+                dimension=len(vectores[huella]),
+                hash_contenido=huella
+            )
+            for (articulo_id, _), huella in zip(pagina, hashes)
+        ]
+    
+    @staticmethod
+    def _proyeccion(session, articulo_ids: List[int]) -> Dict[int, Dict]:
+        """Proyección de recuperación (COLUMNAS_PROYECCION) de cada artículo"""
+        return {
+            fila.id: {
+                'pais_id': fila.pais_id,
+                'codigo_pais': fila.codigo_iso,
+                'estado': fila.estado,
+                'vigente': fila.estado == 'vigente',
+                'numero_documento': fila.numero_documento,
+                'numero_articulo': fila.numero_articulo
+            }
+            for fila in session.query(
+                ArticuloNormativo.id,
+                ArticuloNormativo.numero_articulo,
+                DocumentoNormativo.pais_id,
+                DocumentoNormativo.estado,
+                DocumentoNormativo.numero_documento,
+                Pais.codigo_iso
+            ).join(
+                DocumentoNormativo, ArticuloNormativo.documento_id == DocumentoNormativo.id
+            ).join(
+                Pais, DocumentoNormativo.pais_id == Pais.id
+            ).filter(
+                ArticuloNormativo.id.in_(articulo_ids)
+            )
+        }
     
     def guardar_embeddings(
         self,
         embeddings: List[EmbeddingGenerado],
         actualizar_existente: bool = False
     ):
-        """Guardar embeddings en la base de datos
+        """Guardar embeddings en la base de datos (upsert masivo)
+        
+        Una sola sentencia INSERT ... ON CONFLICT (articulo_id,
+        modelo_embedding) ejecutada como executemany para todo el bloque, en
+        lugar de un SELECT y un objeto ORM por artículo. Las filas nuevas se
+        distinguen de las actualizadas con las claves que ya existían (en
+        tablas particionadas RETURNING no admite xmax). Cada fila lleva además la
+        proyección de recuperación (país, estado, números de documento y
+        artículo), para que la búsqueda no necesite joins. El vector va a la
+        columna del almacenamiento elegido (embedding o embedding_half) y la
+        otra queda a NULL.
         
         Args:
             embeddings: Lista de embeddings generados
             actualizar_existente: Si True, actualiza existentes
         """
+        from sqlalchemy.dialects.postgresql import insert
+        
+        if not embeddings:
+            return
+        
+        inicio = datetime.now()
+        ahora = datetime.utcnow()
+        
+        sentencia = insert(EmbeddingVectorial.__table__)
+        if actualizar_existente:
+            sentencia = sentencia.on_conflict_do_update(
+                index_elements=['articulo_id', 'modelo_embedding'],
+                set_={
+                    'embedding': sentencia.excluded.embedding,
+                    'embedding_half': sentencia.excluded.embedding_half,
+                    'dimension_vector': sentencia.excluded.dimension_vector,
+                    'hash_contenido': sentencia.excluded.hash_contenido,
+                    **{
+                        columna: sentencia.excluded[columna]
+                        for columna in self.COLUMNAS_PROYECCION
+                    },
+                    'fecha_generacion': sentencia.excluded.fecha_generacion
+                }
+            )
+        else:
+            sentencia = sentencia.on_conflict_do_nothing(
+                index_elements=['articulo_id', 'modelo_embedding']
+            )
+        
         with get_db_session() as session:
-            for emb in embeddings:
-                # Verificar si existe
-                existente = session.query(EmbeddingVectorial).filter(
-                    EmbeddingVectorial.articulo_id == emb.articulo_id,
-                    EmbeddingVectorial.modelo_embedding == emb.modelo
-                ).first()
-                
-                if existente:
-                    if actualizar_existente:
-                        existente.embedding = emb.embedding.tolist()
-                        existente.fecha_generacion = datetime.utcnow()
-                        existente.dimension_vector = emb.dimension
-                        self.estadisticas['actualizados'] += 1
-                    else:
-                        continue  # Saltar
-                else:
-                    # Crear nuevo
-                    nuevo = EmbeddingVectorial(
-                        articulo_id=emb.articulo_id,
-                        modelo_embedding=emb.modelo,
-                        dimension_vector=emb.dimension,
-                        embedding=emb.embedding.tolist(),
-                        fecha_generacion=datetime.utcnow(),
-                        confianza_embedding=1.0
-                    )
-                    session.add(nuevo)
-                    self.estadisticas['nuevos'] += 1
+            # Proyección de recuperación de cada artículo, en la misma transacción
+            sin_datos = dict.fromkeys(self.COLUMNAS_PROYECCION)
+            proyeccion = self._proyeccion(session, [emb.articulo_id for emb in embeddings])
+            
+            vacio = {'embedding': None, 'embedding_half': None}
+            filas = [
+                {
+                    'articulo_id': emb.articulo_id,
+                    'modelo_embedding': emb.modelo,
+                    'dimension_vector': emb.dimension,
+                    **vacio,
+                    self.almacen['columna']: emb.embedding,
+                    'hash_contenido': emb.hash_contenido,
+                    **proyeccion.get(emb.articulo_id, sin_datos),
+                    'fecha_generacion': ahora,
+                    'confianza_embedding': 1.0
+                }
+                for emb in embeddings
+            ]
+            
+            existentes = {
+                fila.articulo_id
+                for fila in session.query(EmbeddingVectorial.articulo_id).filter(
+                    EmbeddingVectorial.modelo_embedding == self.generator.modelo_path,
+                    EmbeddingVectorial.articulo_id.in_([emb.articulo_id for emb in embeddings])
+                )
+            }
             
-            session.commit()
+            resultado = session.execute(
+                sentencia.returning(EmbeddingVectorial.__table__.c.articulo_id),
+                filas
+            ).all()
+        
+        insertados = sum(1 for fila in resultado if fila.articulo_id not in existentes)
+        self.estadisticas['nuevos'] += insertados
+        self.estadisticas['actualizados'] += len(resultado) - insertados
+        self.estadisticas['filas_escritas'] += len(resultado)
+        self.estadisticas['tiempo_escritura'] += (datetime.now() - inicio).total_seconds()
+        
+        # Los bloques se escriben en orden de id: todo lo anterior está guardado
+        self.ultimo_id_guardado = max(emb.articulo_id for emb in embeddings)
     
     def procesar_todos(
         self,
         batch_size: int = 32,
-        guardar_cada: int = 100,
-        limite: Optional[int] = None
+        guardar_cada: int = 1000,
+        limite: Optional[int] = None,
+        actualizar: bool = False,
+        desde_id: Optional[int] = None,
+        reutilizar: bool = True
     ):
         """Procesar todos los artículos pendientes
         
+        Los artículos se leen por páginas de guardar_cada (memoria
+        constante) y cada página se codifica y guarda como un bloque:
+        dentro del bloque generar_batch agrupa por longitud en tokens.
+        
         Args:
             batch_size: Tamaño de lote para procesamiento
-            guardar_cada: Guardar cada N artículos
+            guardar_cada: Artículos por bloque de lectura, codificación y guardado
             limite: Límite de artículos a procesar
+            actualizar: Re-generar también los artículos que ya tienen embedding
+            desde_id: Reanudar después de este id de artículo
+            reutilizar: Copiar vectores existentes de textos idénticos
+                (ignorado con actualizar: se re-codifica todo)
         """
         print("\n" + "="*80)
         print("GENERACIÓN DE EMBEDDINGS - INICIO")
@@ -324,73 +830,39 @@ class ArticulosEmbedder:
         
         inicio_total = datetime.now()
         
-        # Obtener artículos pendientes
-        print("\n📊 Obteniendo artículos pendientes...")
-        articulos = self.obtener_articulos_pendientes(
-            solo_sin_embeddings=True,
-            limite=limite
-        )
-        
-        if not articulos:
-            print("✓ Todos los artículos ya tienen embeddings")
-            return
-        
-        print(f"   Artículos a procesar: {len(articulos)}")
         print(f"   Modelo: {self.generator.modelo_nombre}")
         print(f"   Dimensión: {self.generator.dimension}")
-        
-        # Procesar por lotes
-        embeddings_pendientes = []
+        if desde_id:
+            print(f"   Reanudando después del artículo {desde_id}")
         
         print("\n🔄 Generando embeddings...")
         
-        with tqdm(total=len(articulos), desc="Procesando") as pbar:
-            batch_textos = []
-            batch_articulos = []
-            
-            for i, articulo in enumerate(articulos):
-                texto = articulo.texto_normalizado or articulo.texto_completo
-                
-                if texto and len(texto.strip()) >= 10:
-                    batch_textos.append(texto)
-                    batch_articulos.append(articulo)
+        with tqdm(desc="Procesando", unit=" art") as pbar:
+            for pagina in self.iterar_articulos_pendientes(
+                solo_sin_embeddings=not actualizar,
+                limite=limite,
+                desde_id=desde_id,
+                tamano_pagina=guardar_cada
+            ):
+                conocidos = None
+                if reutilizar and not actualizar:
+                    conocidos = self.buscar_por_hash([
+                        hash_contenido(texto, self.generator.modelo_path)
+                        for _, texto in pagina
+                    ])
                 
-                # Procesar batch cuando está lleno
-                if len(batch_textos) >= batch_size or i == len(articulos) - 1:
-                    if batch_textos:
-                        # Generar embeddings del batch
-                        embeddings = self.generator.generar_batch(
-                            batch_textos,
-                            batch_size=batch_size
-                        )
-                        
-                        # Crear objetos EmbeddingGenerado
-                        for art, emb in zip(batch_articulos, embeddings):
-                            embeddings_pendientes.append(
-                                EmbeddingGenerado(
-                                    articulo_id=art.id,
-                                    embedding=emb,
-                                    tiempo_generacion=0.0,
-                                    modelo=self.generator.modelo_path,
-                                    dimension=len(emb)
-                                )
-                            )
-                        
-                        # Guardar si alcanzamos el límite
-                        if len(embeddings_pendientes) >= guardar_cada:
-                            self.guardar_embeddings(embeddings_pendientes)
-                            embeddings_pendientes = []
-                        
-                        batch_textos = []
-                        batch_articulos = []
+                # Generar embeddings del bloque (lotes por longitud)
+                self.guardar_embeddings(
+                    self.codificar_pagina(pagina, batch_size, conocidos),
+                    actualizar
+                )
                 
-                pbar.update(1)
-                self.estadisticas['total_procesados'] += 1
+                pbar.update(len(pagina))
+                self.estadisticas['total_procesados'] += len(pagina)
         
-        # Guardar embeddings restantes
-        if embeddings_pendientes:
-            print("\n💾 Guardando embeddings finales...")
-            self.guardar_embeddings(embeddings_pendientes)
+        if not self.estadisticas['total_procesados']:
+            print("✓ Todos los artículos ya tienen embeddings")
+            return
         
         # Estadísticas finales
         tiempo_total = (datetime.now() - inicio_total).total_seconds()
@@ -398,6 +870,400 @@ class ArticulosEmbedder:
         
         self.imprimir_estadisticas()
     
+    def procesar_pipeline(
+        self,
+        batch_size: int = 32,
+        bloque: int = 1000,
+        limite: Optional[int] = None,
+        profundidad_cola: int = 4,
+        actualizar: bool = False,
+        desde_id: Optional[int] = None,
+        reutilizar: bool = True
+    ):
+        """Procesar artículos pendientes con lectura, codificación y escritura solapadas
+        
+        Un hilo lector recorre los artículos pendientes por páginas y los encola,
+        el hilo principal codifica (el modelo libera el GIL en el forward) y
+        un hilo escritor guarda cada bloque en BD. Las colas acotadas
+        aplican backpressure: si la BD va lenta el encoder espera en lugar
+        de acumular vectores en memoria.
+        
+        Args:
+            batch_size: Tamaño de lote para el encode
+            bloque: Artículos por bloque (unidad de cola y de escritura)
+            limite: Límite de artículos a procesar
+            profundidad_cola: Bloques máximos en cada cola
+            actualizar: Re-generar también los artículos que ya tienen embedding
+            desde_id: Reanudar después de este id de artículo
+            reutilizar: Copiar vectores existentes de textos idénticos
+                (la búsqueda por hash se hace en el hilo lector)
+        """
+        print("\n" + "="*80)
+        print("GENERACIÓN DE EMBEDDINGS - PIPELINE")
+        print("="*80)
+        print(f"   Modelo: {self.generator.modelo_nombre}")
+        print(f"   Bloque: {bloque} artículos, colas de {profundidad_cola} bloques")
+        
+        inicio_total = datetime.now()
+        
+        FIN = object()
+        detener = threading.Event()
+        errores: List[BaseException] = []
+        cola_lectura: queue.Queue = queue.Queue(maxsize=profundidad_cola)
+        cola_escritura: queue.Queue = queue.Queue(maxsize=profundidad_cola)
+        tiempos = {'lectura': 0.0, 'codificacion': 0.0, 'escritura': 0.0}
+        
+        def poner(cola: queue.Queue, elemento):
+            """put bloqueante que se rinde si el pipeline se detiene"""
+            while not detener.is_set():
+                try:
+                    cola.put(elemento, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def lector():
+            try:
+                paginas = self.iterar_articulos_pendientes(
+                    solo_sin_embeddings=not actualizar,
+                    limite=limite,
+                    desde_id=desde_id,
+                    tamano_pagina=bloque
+                )
+                while True:
+                    t0 = datetime.now()
+                    pendientes = next(paginas, None)
+                    if pendientes is None:
+                        return
+                    conocidos = None
+                    if reutilizar and not actualizar:
+                        conocidos = self.buscar_por_hash([
+                            hash_contenido(texto, self.generator.modelo_path)
+                            for _, texto in pendientes
+                        ])
+                    tiempos['lectura'] += (datetime.now() - t0).total_seconds()
+                    
+                    if not poner(cola_lectura, (pendientes, conocidos)):
+                        return
+            except BaseException as e:
+                errores.append(e)
+                detener.set()
+            finally:
+                poner(cola_lectura, FIN)
+        
+        def escritor():
+            while True:
+                embeddings = cola_escritura.get()
+                if embeddings is FIN:
+                    return
+                if detener.is_set():
+                    continue  # Drenar sin escribir
+                try:
+                    t0 = datetime.now()
+                    self.guardar_embeddings(embeddings, actualizar)
+                    tiempos['escritura'] += (datetime.now() - t0).total_seconds()
+                except BaseException as e:
+                    errores.append(e)
+                    detener.set()
+        
+        hilo_lector = threading.Thread(target=lector, name='embeddings-lector', daemon=True)
+        hilo_escritor = threading.Thread(target=escritor, name='embeddings-escritor', daemon=True)
+        hilo_lector.start()
+        hilo_escritor.start()
+        
+        try:
+            with tqdm(desc="Procesando", unit=" art") as pbar:
+                while not detener.is_set():
+                    try:
+                        pendientes = cola_lectura.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    if pendientes is FIN:
+                        break
+                    pendientes, conocidos = pendientes
+                    
+                    t0 = datetime.now()
+                    embeddings = self.codificar_pagina(pendientes, batch_size, conocidos)
+                    tiempos['codificacion'] += (datetime.now() - t0).total_seconds()
+                    
+                    if not poner(cola_escritura, embeddings):
+                        break
+                    
+                    pbar.update(len(pendientes))
+                    self.estadisticas['total_procesados'] += len(pendientes)
+        except BaseException:
+            detener.set()
+            raise
+        finally:
+            # El escritor termina de guardar lo encolado antes de FIN
+            cola_escritura.put(FIN)
+            hilo_escritor.join()
+            hilo_lector.join(timeout=5)
+        
+        if errores:
+            raise errores[0]
+        
+        self.estadisticas['tiempo_total'] = (datetime.now() - inicio_total).total_seconds()
+        
+        print(f"\n⏱ Tiempo por etapa (solapadas): lectura {tiempos['lectura']:.1f}s, "
+              f"codificación {tiempos['codificacion']:.1f}s, escritura {tiempos['escritura']:.1f}s")
+        self.imprimir_estadisticas()
+    
+    def hashes_fragmentados(self, articulo_ids: List[int]) -> Dict[int, Optional[str]]:
+        """Hash del texto con el que se fragmentó cada artículo (modelo actual)
+        
+        Args:
+            articulo_ids: Artículos a consultar
+            
+        Returns:
+            Diccionario articulo_id -> hash_contenido, solo con los artículos
+            que ya tienen fragmentos
+        """
+        if not articulo_ids:
+            return {}
+        
+        with get_db_session() as session:
+            filas = session.query(
+                EmbeddingFragmento.articulo_id,
+                EmbeddingFragmento.hash_contenido
+            ).filter(
+                EmbeddingFragmento.modelo_embedding == self.generator.modelo_path,
+                EmbeddingFragmento.articulo_id.in_(articulo_ids),
+                EmbeddingFragmento.posicion == 0
+            ).all()
+        
+        return {fila.articulo_id: fila.hash_contenido for fila in filas}
+    
+    def guardar_fragmentos(
+        self,
+        fragmentos: List[Fragmento],
+        embeddings: np.ndarray,
+        hashes: Dict[int, str]
+    ):
+        """Guardar los fragmentos de un bloque de artículos (upsert masivo)
+        
+        Como guardar_embeddings: un INSERT ... ON CONFLICT (articulo_id,
+        modelo_embedding, posicion) DO UPDATE ejecutado como executemany.
+        Las posiciones sobrantes de una fragmentación anterior (el texto
+        cambió y ahora tiene menos ventanas) se borran en la misma
+        transacción. Cada fragmento lleva la proyección de recuperación de
+        su artículo.
+        
+        Args:
+            fragmentos: Fragmentos del bloque
+            embeddings: Vector de cada fragmento
+            hashes: Hash de contenido de cada artículo del bloque
+        """
+        from sqlalchemy import text
+        from sqlalchemy.dialects.postgresql import insert
+        
+        inicio = datetime.now()
+        ahora = datetime.utcnow()
+        modelo_path = self.generator.modelo_path
+        
+        totales = dict.fromkeys(hashes, 0)
+        for frag in fragmentos:
+            totales[frag.articulo_id] += 1
+        
+        sentencia = insert(EmbeddingFragmento.__table__)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=['articulo_id', 'modelo_embedding', 'posicion'],
+            set_={
+                columna: sentencia.excluded[columna]
+                for columna in (
+                    'dimension_vector', 'offset_inicio', 'offset_fin', 'num_tokens',
+                    'embedding', 'embedding_half', 'hash_contenido',
+                    *self.COLUMNAS_PROYECCION, 'fecha_generacion'
+                )
+            }
+        )
+        
+        vacio = {'embedding': None, 'embedding_half': None}
+        sin_datos = dict.fromkeys(self.COLUMNAS_PROYECCION)
+        filas = [
+            {
+                'articulo_id': frag.articulo_id,
+                'modelo_embedding': modelo_path,
+                'dimension_vector': len(emb),
+                'posicion': frag.posicion,
+                'offset_inicio': frag.offset_inicio,
+                'offset_fin': frag.offset_fin,
+                'num_tokens': frag.num_tokens,
+                **vacio,
+                self.almacen['columna']: emb,
+                'hash_contenido': hashes[frag.articulo_id],
+                'fecha_generacion': ahora
+            }
+            for frag, emb in zip(fragmentos, embeddings)
+        ]
+        
+        with get_db_session() as session:
+            proyeccion = self._proyeccion(session, list(totales))
+            for fila in filas:
+                fila.update(proyeccion.get(fila['articulo_id'], sin_datos))
+            
+            session.execute(text("""
+                DELETE FROM embeddings_fragmentos f
+                USING unnest(CAST(:ids AS integer[]), CAST(:totales AS integer[]))
+                    AS n(articulo_id, total)
+                WHERE f.modelo_embedding = :modelo
+                    AND f.articulo_id = n.articulo_id
+                    AND f.posicion >= n.total
+            """), {
+                'ids': list(totales.keys()),
+                'totales': list(totales.values()),
+                'modelo': modelo_path
+            })
+            
+            existentes = {
+                (fila.articulo_id, fila.posicion)
+                for fila in session.query(
+                    EmbeddingFragmento.articulo_id, EmbeddingFragmento.posicion
+                ).filter(
+                    EmbeddingFragmento.modelo_embedding == modelo_path,
+                    EmbeddingFragmento.articulo_id.in_(list(totales))
+                )
+            }
+            
+            tabla = EmbeddingFragmento.__table__
+            resultado = session.execute(
+                sentencia.returning(tabla.c.articulo_id, tabla.c.posicion),
+                filas
+            ).all() if filas else []
+        
+        insertados = sum(
+            1 for fila in resultado if (fila.articulo_id, fila.posicion) not in existentes
+        )
+        self.estadisticas['nuevos'] += insertados
+        self.estadisticas['actualizados'] += len(resultado) - insertados
+        self.estadisticas['filas_escritas'] += len(resultado)
+        self.estadisticas['tiempo_escritura'] += (datetime.now() - inicio).total_seconds()
+    
+    def fragmentar_pagina(
+        self,
+        pagina: List[Tuple[int, str]],
+        batch_size: int = 32,
+        ventana: Optional[int] = None,
+        solape: int = 64,
+        limite: Optional[int] = None
+    ) -> int:
+        """Fragmentar, codificar y guardar los artículos nuevos o cambiados de una página
+        
+        Un artículo se (re)fragmenta si no tiene fragmentos del modelo o si
+        el hash de su texto actual no coincide con el de sus fragmentos.
+        Tras guardar, ultimo_id_guardado apunta al último artículo cubierto
+        (el de la página, o el último fragmentado si limite la cortó).
+        
+        Args:
+            pagina: Lista de (articulo_id, texto)
+            batch_size: Tamaño de lote para el encode
+            ventana: Tokens por fragmento (None = secuencia máxima del modelo)
+            solape: Tokens de solape entre fragmentos
+            limite: Artículos máximos a fragmentar de esta página
+            
+        Returns:
+            Artículos fragmentados
+        """
+        modelo_path = self.generator.modelo_path
+        guardados = self.hashes_fragmentados([articulo_id for articulo_id, _ in pagina])
+        
+        pendientes = []
+        for articulo_id, texto in pagina:
+            huella = hash_contenido(texto, modelo_path)
+            if guardados.get(articulo_id) != huella:
+                pendientes.append((articulo_id, texto, huella))
+        ultimo_id = pagina[-1][0]
+        if limite is not None and len(pendientes) > limite:
+            pendientes = pendientes[:limite]
+            ultimo_id = pendientes[-1][0] if pendientes else pagina[0][0] - 1
+        if not pendientes:
+            self.ultimo_id_guardado = ultimo_id
+            return 0
+        
+        fragmentos: List[Fragmento] = []
+        textos: List[str] = []
+        for articulo_id, texto, _ in pendientes:
+            for posicion, (desde, hasta, num_tokens) in enumerate(
+                self.generator.fragmentar(texto, ventana, solape)
+            ):
+                fragmentos.append(Fragmento(articulo_id, posicion, desde, hasta, num_tokens))
+                textos.append(texto[desde:hasta])
+        
+        embeddings = self.generator.generar_batch(
+            textos, batch_size=batch_size, mostrar_progreso=False
+        ) if textos else []
+        
+        self.guardar_fragmentos(
+            fragmentos,
+            embeddings,
+            {articulo_id: huella for articulo_id, _, huella in pendientes}
+        )
+        self.estadisticas['codificados'] += len(textos)
+        self.ultimo_id_guardado = ultimo_id
+        return len(pendientes)
+    
+    def procesar_fragmentos(
+        self,
+        batch_size: int = 32,
+        guardar_cada: int = 1000,
+        limite: Optional[int] = None,
+        ventana: Optional[int] = None,
+        solape: int = 64,
+        desde_id: Optional[int] = None
+    ):
+        """Generar embeddings de fragmentos para los artículos nuevos o cambiados
+        
+        Cada artículo se divide en ventanas de tokens solapadas (un solo
+        fragmento si cabe entero) que se guardan en embeddings_fragmentos.
+        Los artículos se leen por páginas keyset de guardar_cada (ver
+        iterar_articulos_pendientes) y cada página se fragmenta, codifica y
+        guarda como un bloque (ver fragmentar_pagina); los que ya tienen
+        fragmentos de su texto actual se omiten.
+        
+        Args:
+            batch_size: Tamaño de lote para el encode
+            guardar_cada: Artículos por página de lectura, codificación y guardado
+            limite: Límite de artículos a fragmentar
+            ventana: Tokens por fragmento (None = secuencia máxima del modelo)
+            solape: Tokens de solape entre fragmentos
+            desde_id: Reanudar después de este id de artículo
+        """
+        print("\n" + "="*80)
+        print("GENERACIÓN DE EMBEDDINGS DE FRAGMENTOS")
+        print("="*80)
+        
+        inicio_total = datetime.now()
+        if desde_id:
+            print(f"   Reanudando después del artículo {desde_id}")
+        
+        print("\n✂ Fragmentando y generando embeddings...")
+        with tqdm(desc="Revisando", unit=" art") as pbar:
+            # Todas las páginas: un artículo con fragmentos puede haber cambiado
+            for pagina in self.iterar_articulos_pendientes(
+                solo_sin_embeddings=False,
+                desde_id=desde_id,
+                tamano_pagina=guardar_cada
+            ):
+                restantes = None if limite is None else limite - self.estadisticas['total_procesados']
+                if restantes is not None and restantes <= 0:
+                    break
+                
+                self.estadisticas['total_procesados'] += self.fragmentar_pagina(
+                    pagina, batch_size, ventana, solape, restantes
+                )
+                pbar.update(len(pagina))
+        
+        if not self.estadisticas['total_procesados']:
+            print("✓ Todos los artículos ya tienen fragmentos de su texto actual")
+            return
+        
+        print(f"   Fragmentos: {self.estadisticas['codificados']} "
+              f"({self.estadisticas['codificados'] / self.estadisticas['total_procesados']:.2f} por artículo)")
+        self.estadisticas['tiempo_total'] = (datetime.now() - inicio_total).total_seconds()
+        
+        self.imprimir_estadisticas()
+    
     def imprimir_estadisticas(self):
         """Imprimir estadísticas de procesamiento"""
         print("\n" + "="*80)
@@ -411,12 +1277,24 @@ class ArticulosEmbedder:
         print(f"   • Nuevos embeddings: {stats['nuevos']}")
         print(f"   • Actualizados: {stats['actualizados']}")
         print(f"   • Errores: {stats['errores']}")
+        if stats['reutilizados']:
+            print(f"   • Codificados: {stats['codificados']} "
+                  f"(reutilizados por hash de contenido: {stats['reutilizados']})")
         print(f"   • Tiempo total: {stats['tiempo_total']:.2f} segundos")
         
         if stats['total_procesados'] > 0:
             promedio = stats['tiempo_total'] / stats['total_procesados']
             print(f"   • Tiempo promedio: {promedio:.3f} seg/artículo")
             print(f"   • Velocidad: {1/promedio:.1f} artículos/seg")
+        
+        if self.ultimo_id_guardado is not None:
+            print(f"   • Último artículo guardado: {self.ultimo_id_guardado} "
+                  f"(reanudar con --desde-id {self.ultimo_id_guardado})")
+        
+        if stats['tiempo_escritura'] > 0:
+            print(f"   • Escritura BD: {stats['filas_escritas']} filas en "
+                  f"{stats['tiempo_escritura']:.2f} s "
+                  f"({stats['filas_escritas'] / stats['tiempo_escritura']:.0f} filas/seg)")
 
 
 # ============================================================================
@@ -488,6 +1366,106 @@ class EmbeddingsVerificador:
                 print(f"\n📐 Dimensiones:")
                 for dim, count in dimensiones:
                     print(f"   • {dim}D: {count} embeddings")
+    
+    @staticmethod
+    def medir_perdida_float16(
+        modelo_path: str,
+        muestras: int = 200,
+        top_k: int = 10,
+        semilla: int = 42
+    ) -> Dict:
+        """Pérdida por redondear a float16 los vectores del corpus (sin índice)
+        
+        Toma los vectores float32 guardados del modelo y usa una muestra de
+        artículos como consultas (excluyéndose a sí mismos). Para cada una
+        compara el top-k exacto (fuerza bruta en NumPy) por coseno con los
+        vectores en float32 y redondeados a float16, que es lo que guardaría
+        embedding_half. No es el recall de la búsqueda ANN de pgvector: mide
+        solo la pérdida por el tipo, y la del índice HNSW se suma aparte.
+        
+        Args:
+            modelo_path: modelo_embedding con vectores float32 ya generados
+            muestras: Artículos usados como consulta
+            top_k: Resultados comparados por consulta
+            semilla: Semilla del muestreo
+        """
+        with get_db_session() as session:
+            filas = session.query(EmbeddingVectorial.embedding).filter(
+                EmbeddingVectorial.modelo_embedding == modelo_path,
+                EmbeddingVectorial.embedding.isnot(None)
+            ).all()
+        
+        if len(filas) <= top_k:
+            raise ValueError(
+                f"Se necesitan más de {top_k} embeddings float32 de {modelo_path} "
+                f"(hay {len(filas)})"
+            )
+        
+        def normalizar(matriz: np.ndarray) -> np.ndarray:
+            normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+            return matriz / np.maximum(normas, 1e-12)
+        
+        completo = normalizar(np.vstack([vector_a_numpy(fila.embedding) for fila in filas]))
+        medio = normalizar(completo.astype(np.float16).astype(np.float32))
+        total, dimension = completo.shape
+        
+        generador = np.random.default_rng(semilla)
+        consultas = generador.choice(total, size=min(muestras, total), replace=False)
+        
+        solapamientos, top1, errores = [], [], []
+        for desde in range(0, len(consultas), 32):
+            bloque = consultas[desde:desde + 32]
+            sim_completo = completo[bloque] @ completo.T
+            sim_medio = medio[bloque] @ medio.T
+            errores.append(np.abs(sim_completo - sim_medio).max(axis=1))
+            
+            filas_bloque = np.arange(len(bloque))
+            sim_completo[filas_bloque, bloque] = -np.inf
+            sim_medio[filas_bloque, bloque] = -np.inf
+            
+            for i in filas_bloque:
+                exacto = np.argpartition(-sim_completo[i], top_k)[:top_k]
+                aproximado = np.argpartition(-sim_medio[i], top_k)[:top_k]
+                solapamientos.append(len(np.intersect1d(exacto, aproximado)) / top_k)
+                top1.append(np.argmax(sim_completo[i]) == np.argmax(sim_medio[i]))
+        
+        errores = np.concatenate(errores)
+        # pgvector: 4 bytes por dimensión (vector) o 2 (halfvec) + 8 de cabecera
+        return {
+            'modelo': modelo_path,
+            'vectores': total,
+            'dimension': dimension,
+            'consultas': len(consultas),
+            'top_k': top_k,
+            'solapamiento': float(np.mean(solapamientos)),
+            'solapamiento_min': float(np.min(solapamientos)),
+            'top1': float(np.mean(top1)),
+            'error_max': float(errores.max()),
+            'error_medio': float(errores.mean()),
+            'bytes_vector': total * (4 * dimension + 8),
+            'bytes_halfvec': total * (2 * dimension + 8)
+        }
+    
+    @staticmethod
+    def imprimir_perdida_float16(modelo_path: str, muestras: int = 200, top_k: int = 10):
+        """Imprimir la pérdida por float16 (halfvec) de un modelo"""
+        print("\n" + "="*80)
+        print("PÉRDIDA POR FLOAT16 (halfvec) vs FLOAT32 (vector), BÚSQUEDA EXACTA")
+        print("="*80)
+        
+        r = EmbeddingsVerificador.medir_perdida_float16(modelo_path, muestras, top_k)
+        
+        print(f"\n🤖 {r['modelo'].split('/')[-1]}: {r['vectores']} vectores de {r['dimension']}D, "
+              f"{r['consultas']} consultas")
+        print(f"\n🎯 Top-{r['top_k']} exacto compartido con float32: {r['solapamiento']:.4f} "
+              f"(mínimo {r['solapamiento_min']:.2f})")
+        print(f"   • Mismo primer resultado: {r['top1'] * 100:.1f}%")
+        print(f"   • Error de similitud coseno: máx {r['error_max']:.2e}, "
+              f"medio {r['error_medio']:.2e}")
+        print(f"\n💾 Almacenamiento estimado (sin índice):")
+        print(f"   • vector:  {r['bytes_vector'] / 1024**2:.1f} MB")
+        print(f"   • halfvec: {r['bytes_halfvec'] / 1024**2:.1f} MB "
+              f"({r['bytes_halfvec'] / r['bytes_vector'] * 100:.0f}%)")
 
 
 # ============================================================================
@@ -522,11 +1500,88 @@ def main():
         action='store_true',
         help='Actualizar embeddings existentes'
     )
+    parser.add_argument(
+        '--sin-reutilizar',
+        action='store_true',
+        help='Codificar todos los textos aunque ya exista el vector de un texto idéntico'
+    )
+    parser.add_argument(
+        '--desde-id',
+        type=int,
+        help='Reanudar después de este id de artículo (ver "Último artículo guardado")'
+    )
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Solapar lectura de BD, codificación y escritura (colas acotadas)'
+    )
+    parser.add_argument(
+        '--profundidad-cola',
+        type=int,
+        default=4,
+        help='Bloques máximos en cola entre etapas del pipeline'
+    )
+    parser.add_argument(
+        '--recrear-indices',
+        action='store_true',
+        help='Eliminar los índices ANN del modelo (también los parciales por país) antes '
+             'de la carga y reconstruir los mismos después (CREATE INDEX CONCURRENTLY)'
+    )
+    parser.add_argument(
+        '--indices-por-pais',
+        action='store_true',
+        help='Con --recrear-indices, construir también los índices parciales por país '
+             'aunque no existieran'
+    )
+    parser.add_argument(
+        '--procesos',
+        type=int,
+        help='Procesos de codificación en CPU (pool multiproceso, cada uno fijado a sus núcleos)'
+    )
+    parser.add_argument(
+        '--hilos-por-proceso',
+        type=int,
+        help='Hilos de torch por proceso del pool (default: núcleos / procesos)'
+    )
+    parser.add_argument(
+        '--almacenamiento',
+        choices=['vector', 'halfvec'],
+        help='Columna de destino: vector (float32) o halfvec (float16, mitad de espacio); '
+             'default: la del registro por modelo. Al cambiarla, usar --actualizar'
+    )
+    parser.add_argument(
+        '--fragmentos',
+        action='store_true',
+        help='Generar embeddings de fragmentos (ventanas de tokens solapadas)'
+    )
+    parser.add_argument(
+        '--ventana',
+        type=int,
+        help='Tokens por fragmento (default: secuencia máxima del modelo)'
+    )
+    parser.add_argument(
+        '--solape',
+        type=int,
+        default=64,
+        help='Tokens de solape entre fragmentos consecutivos'
+    )
     parser.add_argument(
         '--verificar',
         action='store_true',
         help='Solo verificar cobertura de embeddings'
     )
+    parser.add_argument(
+        '--perdida-float16',
+        action='store_true',
+        help='Medir cuánto cambia el top-10 exacto (sin índice ANN) al redondear '
+             'a float16 (halfvec) los vectores float32 del modelo'
+    )
+    parser.add_argument(
+        '--muestras',
+        type=int,
+        default=200,
+        help='Consultas para --perdida-float16'
+    )
     parser.add_argument(
         '--listar-modelos',
         action='store_true',
@@ -555,19 +1610,62 @@ def main():
         EmbeddingsVerificador.imprimir_reporte()
         return
     
+    # Pérdida por float16 (halfvec)
+    if args.perdida_float16:
+        EmbeddingsVerificador.imprimir_perdida_float16(
+            MODELOS_DISPONIBLES[args.modelo]['nombre'], muestras=args.muestras
+        )
+        return
+    
     # Generar embeddings
+    processor = None
+    indices_eliminados = None
     try:
         # Inicializar BD
         DatabaseEngine.initialize()
         
         # Crear processor
-        processor = ArticulosEmbedder(modelo_nombre=args.modelo)
+        processor = ArticulosEmbedder(
+            modelo_nombre=args.modelo,
+            procesos=args.procesos,
+            hilos_por_proceso=args.hilos_por_proceso,
+            almacenamiento=args.almacenamiento
+        )
+        
+        # Carga masiva sin pagar la inserción en el índice ANN fila a fila
+        if args.recrear_indices:
+            indices_eliminados = eliminar_indices_ann(
+                processor.generator.modelo_path,
+                fragmentos=args.fragmentos,
+                articulos=not args.fragmentos
+            )
         
         # Procesar artículos
-        processor.procesar_todos(
-            batch_size=args.batch_size,
-            limite=args.limite
-        )
+        if args.fragmentos:
+            processor.procesar_fragmentos(
+                batch_size=args.batch_size,
+                limite=args.limite,
+                ventana=args.ventana,
+                solape=args.solape,
+                desde_id=args.desde_id
+            )
+        elif args.pipeline:
+            processor.procesar_pipeline(
+                batch_size=args.batch_size,
+                limite=args.limite,
+                profundidad_cola=args.profundidad_cola,
+                actualizar=args.actualizar,
+                desde_id=args.desde_id,
+                reutilizar=not args.sin_reutilizar
+            )
+        else:
+            processor.procesar_todos(
+                batch_size=args.batch_size,
+                limite=args.limite,
+                actualizar=args.actualizar,
+                desde_id=args.desde_id,
+                reutilizar=not args.sin_reutilizar
+            )
         
         # Verificar resultados
         print("\n")
@@ -578,11 +1676,35 @@ def main():
         print("="*80)
         print("\n🚀 Próximo paso: python scripts/rag_engine.py")
         
-    except Exception as e:
-        print(f"\n❌ ERROR: {str(e)}")
+    except (Exception, KeyboardInterrupt) as e:
+        print(f"\n❌ ERROR: {str(e) or type(e).__name__}")
+        if processor is not None and processor.ultimo_id_guardado is not None:
+            print(f"   ↻ Reanudar con: --desde-id {processor.ultimo_id_guardado}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
+    finally:
+        if processor is not None:
+            processor.generator.cerrar_pool()
+        if indices_eliminados is not None:
+            # También tras un error: la búsqueda no debe quedarse sin índice
+            print("\n🔨 Reconstruyendo índices ANN...")
+            if indices_eliminados:
+                # Los mismos índices que había, incluidos los parciales por país
+                tiempos = reconstruir_indices_eliminados(
+                    indices_eliminados,
+                    por_pais=args.indices_por_pais,
+                    almacenamiento=args.almacenamiento
+                )
+            else:
+                tiempos = reconstruir_indices_ann(
+                    processor.generator.modelo_path,
+                    fragmentos=args.fragmentos,
+                    articulos=not args.fragmentos,
+                    por_pais=args.indices_por_pais,
+                    almacenamiento=args.almacenamiento
+                )
+            print(f"   ✓ {len(tiempos)} índices en {sum(tiempos.values()):.1f} s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,939 @@
+"""
+AALabelPP - Clientes LLM Asíncronos
+Llamadas a OpenAI/Gemini con limitación de tasa, reintentos, timeouts y streaming
+
+Fecha: 2026-10-17
+Versión: 1.0
+"""
+
+import os
+import re
+import time
+import random
+import hashlib
+import json
+import asyncio
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+SYSTEM_PROMPT = "Eres un experto en regulación farmacéutica de la región andina."
+
+URLS_BASE = {
+    'openai': os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1'),
+    'gemini': os.getenv('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com/v1beta')
+}
+
+# Límites del proveedor (por defecto, ajustables por entorno)
+LIMITES_DEFAULT = {
+    'rpm': int(os.getenv('LLM_RPM', '60')),              # Requests por minuto
+    'tpm': int(os.getenv('LLM_TPM', '90000')),           # Tokens por minuto
+    'timeout': float(os.getenv('LLM_TIMEOUT', '120')),   # Segundos por llamada
+    'max_reintentos': int(os.getenv('LLM_MAX_REINTENTOS', '5'))
+}
+
+# Llamadas simultáneas máximas por proveedor (por defecto)
+CONCURRENCIA_POR_PROVEEDOR = {
+    'openai': 4,
+    'gemini': 4,
+    'mock': 8
+}
+
+# Códigos HTTP que justifican reintentar
+CODIGOS_REINTENTABLES = {408, 409, 429, 500, 502, 503, 504}
+
+# Tipos de error enviados dentro de un stream SSE que justifican reintentar
+ERRORES_STREAM_REINTENTABLES = {
+    'server_error', 'rate_limit_exceeded', 'rate_limit_error', 'overloaded_error',
+    'RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'INTERNAL', 'DEADLINE_EXCEEDED'
+}
+
+# Encabezados de bloque de la respuesta de armonización
+MARCADOR_CONTENIDO = '### CONTENIDO ARMONIZADO'
+MARCADOR_JUSTIFICACION = '### JUSTIFICACIÓN'
+MARCADOR_FUENTES = '### FUENTES'
+
+
+# ============================================================================
+# EXCEPCIONES
+# ============================================================================
+
+class ErrorProveedorLLM(Exception):
+    """Error devuelto por un proveedor LLM"""
+    
+    def __init__(
+        self,
+        mensaje: str,
+        reintentable: bool = False,
+        retry_after: Optional[float] = None,
+        estado: Optional[int] = None
+    ):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+        self.retry_after = retry_after
+        self.estado = estado  # Código HTTP, si lo hay
+
+
+# ============================================================================
+# LIMITACIÓN DE TASA
+# ============================================================================
+
+class TokenBucket:
+    """Token bucket asíncrono
+    
+    Sin locks: entre la comprobación y el descuento no hay await, así que
+    dentro de un event loop es seguro. No se ata a ningún loop, por lo que
+    puede reutilizarse entre distintas llamadas a asyncio.run().
+    """
+    
+    def __init__(self, capacidad: float, tasa_por_segundo: float):
+        """Inicializar bucket
+        
+        Args:
+            capacidad: Ráfaga máxima
+            tasa_por_segundo: Reposición sostenida
+        """
+        self.capacidad = capacidad
+        self.tasa = tasa_por_segundo
+        self.disponibles = capacidad
+        self._ultima = time.monotonic()
+    
+    def _reponer(self):
+        ahora = time.monotonic()
+        self.disponibles = min(
+            self.capacidad,
+            self.disponibles + (ahora - self._ultima) * self.tasa
+        )
+        self._ultima = ahora
+    
+    def devolver(self, cantidad: float):
+        """Devolver unidades reservadas y no usadas (negativo = consumo extra)
+        
+        Un consumo mayor que lo reservado deja el saldo en negativo: las
+        siguientes adquisiciones esperan a que se reponga.
+        """
+        self._reponer()
+        self.disponibles = min(self.capacidad, self.disponibles + cantidad)
+    
+    async def adquirir(self, cantidad: float = 1.0) -> float:
+        """Esperar hasta disponer de `cantidad` unidades
+        
+        Returns:
+            Unidades descontadas (las peticiones mayores que la ráfaga se
+            limitan a la capacidad); es lo que debe liquidarse después
+        """
+        cantidad = min(cantidad, self.capacidad)
+        
+        while True:
+            self._reponer()
+            if self.disponibles >= cantidad:
+                self.disponibles -= cantidad
+                return cantidad
+            await asyncio.sleep((cantidad - self.disponibles) / self.tasa)
+
+
+class LimitadorTasa:
+    """Límites combinados de requests y tokens por minuto"""
+    
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+    
+    async def adquirir(self, tokens_estimados: int) -> float:
+        """Reservar una request y tokens; devuelve los tokens reservados"""
+        await self.requests.adquirir(1)
+        return await self.tokens.adquirir(tokens_estimados)
+    
+    def liquidar(self, reservados: float, usados: int):
+        """Ajustar una reserva de tokens al consumo real de la llamada
+        
+        `reservados` es lo que devolvió adquirir (no la estimación pedida)
+        """
+        self.tokens.devolver(reservados - usados)
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación rápida de tokens (4 caracteres ≈ 1 token)"""
+    return max(1, len(texto) // 4)
+
+
+# ============================================================================
+# PARSING INCREMENTAL (STREAMING)
+# ============================================================================
+
+class ParserSeccionesIncremental:
+    """Parser incremental de la respuesta de armonización
+    
+    Recibe los fragmentos del stream y detecta los encabezados de bloque a
+    medida que llegan (aunque queden partidos entre fragmentos). Cuando
+    aparece ### JUSTIFICACIÓN el contenido armonizado está completo y se
+    entrega a `al_contenido`; cuando aparece ### FUENTES la generación
+    puede cortarse, ya que las fuentes se reconstruyen desde los artículos
+    recuperados.
+    """
+    
+    def __init__(
+        self,
+        al_contenido: Optional[Callable[[str], None]] = None,
+        parar_en_fuentes: bool = True
+    ):
+        """Inicializar parser
+        
+        Args:
+            al_contenido: Callback con el contenido armonizado completo
+            parar_en_fuentes: Pedir el corte del stream al llegar a FUENTES
+        """
+        self.al_contenido = al_contenido
+        self.parar_en_fuentes = parar_en_fuentes
+        self._texto = ''
+        self._fin: Optional[int] = None
+        self.contenido: Optional[str] = None
+    
+    def _buscar(self, marcador: str, longitud_previa: int) -> int:
+        """Buscar un marcador solo en la zona nueva (más el solape)"""
+        return self._texto.find(marcador, max(0, longitud_previa - len(marcador)))
+    
+    def alimentar(self, fragmento: str) -> bool:
+        """Añadir un fragmento
+        
+        Returns:
+            True si la generación puede detenerse
+        """
+        if self._fin is not None:
+            if not self.parar_en_fuentes:
+                self._texto += fragmento
+            return self.parar_en_fuentes
+        
+        longitud_previa = len(self._texto)
+        self._texto += fragmento
+        
+        if self.contenido is None:
+            pos = self._buscar(MARCADOR_JUSTIFICACION, longitud_previa)
+            if pos < 0:
+                return False
+            
+            self.contenido = self._texto[:pos].replace(MARCADOR_CONTENIDO, '').strip()
+            if self.al_contenido is not None:
+                self.al_contenido(self.contenido)
+        
+        pos = self._buscar(MARCADOR_FUENTES, longitud_previa)
+        if pos >= 0:
+            self._fin = pos
+            return self.parar_en_fuentes
+        
+        return False
+    
+    @property
+    def cortado(self) -> bool:
+        """Si se alcanzó FUENTES (la respuesta se trunca ahí)"""
+        return self._fin is not None and self.parar_en_fuentes
+    
+    def respuesta(self) -> str:
+        """Texto recibido (sin el bloque FUENTES si se cortó)"""
+        if self.cortado:
+            return self._texto[:self._fin]
+        return self._texto
+
+
+def consumir_stream(fragmentos: Iterator[str], parser: ParserSeccionesIncremental) -> str:
+    """Consumir un stream síncrono hasta el final o hasta el corte"""
+    try:
+        for fragmento in fragmentos:
+            if parser.alimentar(fragmento):
+                break
+    finally:
+        # Cerrar el generador libera la conexión y detiene la generación
+        cerrar = getattr(fragmentos, 'close', None)
+        if cerrar is not None:
+            cerrar()
+    
+    return parser.respuesta()
+
+
+async def consumir_stream_async(
+    fragmentos: AsyncIterator[str],
+    parser: ParserSeccionesIncremental
+) -> str:
+    """Consumir un stream asíncrono hasta el final o hasta el corte"""
+    try:
+        async for fragmento in fragmentos:
+            if parser.alimentar(fragmento):
+                break
+    finally:
+        await fragmentos.aclose()
+    
+    return parser.respuesta()
+
+
+# ============================================================================
+# PROVEEDORES ENCHUFABLES
+# ============================================================================
+
+class ProveedorLLM(ABC):
+    """Interfaz de proveedor LLM
+    
+    Un proveedor recibe el prompt de usuario y devuelve el texto generado.
+    Los generadores (LLMGenerator síncrono y AsyncLLMGenerator) delegan en
+    él cuando el nombre del modelo coincide con un prefijo registrado, y
+    siguen aplicando su control de concurrencia, rate limiting y reintentos.
+    """
+    
+    tipo = 'proveedor'
+    
+    @abstractmethod
+    def generar(self, prompt: str, temperatura: float, max_tokens: int) -> str:
+        """Generación síncrona"""
+    
+    async def generar_async(self, prompt: str, temperatura: float, max_tokens: int) -> str:
+        """Generación asíncrona (por defecto, la síncrona en un hilo)"""
+        return await asyncio.to_thread(self.generar, prompt, temperatura, max_tokens)
+    
+    def generar_stream(self, prompt: str, temperatura: float, max_tokens: int) -> Iterator[str]:
+        """Generación en streaming (por defecto, un único fragmento)"""
+        yield self.generar(prompt, temperatura, max_tokens)
+    
+    async def generar_stream_async(
+        self,
+        prompt: str,
+        temperatura: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """Streaming asíncrono (por defecto, un único fragmento)"""
+        yield await self.generar_async(prompt, temperatura, max_tokens)
+
+
+PROVEEDORES: Dict[str, Callable[[str], ProveedorLLM]] = {}
+
+
+def registrar_proveedor(prefijo: str, fabrica: Callable[[str], ProveedorLLM]):
+    """Registrar un proveedor para los modelos que empiezan por `prefijo`
+    
+    Args:
+        prefijo: Prefijo del nombre de modelo (ej. 'mock')
+        fabrica: Callable que recibe el nombre completo del modelo
+    """
+    PROVEEDORES[prefijo] = fabrica
+
+
+def crear_proveedor(modelo: str) -> Optional[ProveedorLLM]:
+    """Instanciar el proveedor registrado para el modelo (None = built-in)"""
+    for prefijo, fabrica in PROVEEDORES.items():
+        if modelo.startswith(prefijo):
+            return fabrica(modelo)
+    return None
+
+
+class ProveedorMock(ProveedorLLM):
+    """Proveedor LLM simulado, offline y determinista
+    
+    Devuelve respuestas bien formadas (### CONTENIDO ARMONIZADO /
+    ### JUSTIFICACIÓN / ### FUENTES) construidas a partir del prompt, con
+    latencia log-normal, throughput de tokens de salida y tasa de errores
+    429 configurables. El contenido solo depende del prompt; la latencia y
+    los errores dependen de la semilla. Sirve para medir el overhead propio
+    del pipeline sin API keys ni red.
+    
+    Configuración desde el nombre del modelo:
+        mock                                  (valores por defecto)
+        mock:latencia=0.5,sigma=0.3,error=0.05,tps=80,semilla=42
+    """
+    
+    tipo = 'mock'
+    
+    def __init__(
+        self,
+        latencia: float = 1.0,
+        sigma: float = 0.25,
+        error: float = 0.0,
+        tps: float = 100.0,
+        semilla: Optional[int] = None
+    ):
+        """Inicializar proveedor simulado
+        
+        Args:
+            latencia: Mediana de la latencia hasta el primer token (segundos)
+            sigma: Dispersión de la log-normal de latencia
+            error: Probabilidad de devolver un 429 simulado (0-1)
+            tps: Tokens de salida por segundo
+            semilla: Semilla para latencias y errores (None = aleatorio)
+        """
+        self.latencia = latencia
+        self.sigma = sigma
+        self.error = error
+        self.tps = tps
+        self._random = random.Random(semilla)
+    
+    @classmethod
+    def desde_modelo(cls, modelo: str) -> 'ProveedorMock':
+        """Crear desde 'mock:clave=valor,...'"""
+        opciones = {}
+        if ':' in modelo:
+            for par in modelo.split(':', 1)[1].split(','):
+                if par.strip():
+                    clave, valor = par.split('=', 1)
+                    opciones[clave.strip()] = float(valor)
+        
+        if 'semilla' in opciones:
+            opciones['semilla'] = int(opciones['semilla'])
+        
+        return cls(**opciones)
+    
+    def responder(self, prompt: str, max_tokens: int) -> str:
+        """Respuesta determinista construida desde el prompt"""
+        seccion = re.search(r'la sección "([^"]+)"', prompt)
+        nombre = seccion.group(1) if seccion else "Sección"
+        
+        fuentes = re.findall(
+            r'\[ARTÍCULO \d+ - ([^\]]+)\]\s*Documento: (.+)\s*Artículo: (.+)',
+            prompt
+        )
+        huella = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        
+        lineas_fuentes = [
+            f"- {pais.strip()}: {documento.strip()}, {articulo.strip()}"
+            for pais, documento, articulo in fuentes
+        ] or ["- Sin evidencia en el prompt"]
+        
+        respuesta = f"""### CONTENIDO ARMONIZADO
+[SIMULADO {huella}] Contenido armonizado para "{nombre}" según {len(fuentes)} artículos de evidencia, aplicando el criterio de máxima restrictividad.
+
+### JUSTIFICACIÓN
+[SIMULADO] Se consideraron los requisitos de todos los países presentes en la evidencia.
+
+### FUENTES
+{chr(10).join(lineas_fuentes)}
+"""
+        # Respetar max_tokens (4 caracteres ≈ 1 token)
+        return respuesta[:max_tokens * 4]
+    
+    def _latencia_primer_token(self) -> float:
+        """Latencia simulada hasta el primer token (o ErrorProveedorLLM)"""
+        if self._random.random() < self.error:
+            raise ErrorProveedorLLM(
+                "HTTP 429: límite de tasa simulado",
+                reintentable=True,
+                retry_after=None,
+                estado=429
+            )
+        
+        return self._random.lognormvariate(0, self.sigma) * self.latencia
+    
+    def _fragmentos(self, respuesta: str, caracteres: int = 16) -> Iterator[str]:
+        """Trocear la respuesta en fragmentos de ~4 tokens"""
+        for inicio in range(0, len(respuesta), caracteres):
+            yield respuesta[inicio:inicio + caracteres]
+    
+    def generar(self, prompt: str, temperatura: float, max_tokens: int) -> str:
+        respuesta = self.responder(prompt, max_tokens)
+        time.sleep(self._latencia_primer_token() + estimar_tokens(respuesta) / self.tps)
+        return respuesta
+    
+    async def generar_async(self, prompt: str, temperatura: float, max_tokens: int) -> str:
+        respuesta = self.responder(prompt, max_tokens)
+        await asyncio.sleep(self._latencia_primer_token() + estimar_tokens(respuesta) / self.tps)
+        return respuesta
+    
+    def generar_stream(self, prompt: str, temperatura: float, max_tokens: int) -> Iterator[str]:
+        respuesta = self.responder(prompt, max_tokens)
+        time.sleep(self._latencia_primer_token())
+        for fragmento in self._fragmentos(respuesta):
+            time.sleep(estimar_tokens(fragmento) / self.tps)
+            yield fragmento
+    
+    async def generar_stream_async(
+        self,
+        prompt: str,
+        temperatura: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        respuesta = self.responder(prompt, max_tokens)
+        await asyncio.sleep(self._latencia_primer_token())
+        for fragmento in self._fragmentos(respuesta):
+            await asyncio.sleep(estimar_tokens(fragmento) / self.tps)
+            yield fragmento
+
+
+registrar_proveedor('mock', ProveedorMock.desde_modelo)
+
+
+# ============================================================================
+# GENERADOR ASÍNCRONO
+# ============================================================================
+
+class AsyncLLMGenerator:
+    """Generador LLM asíncrono con rate limiting y reintentos
+    
+    Habla directamente con las APIs REST de OpenAI (chat/completions) y
+    Gemini (generateContent). La URL base es configurable, de modo que
+    puede apuntarse a un servidor de pruebas local.
+    
+    Uso:
+        async with generador:
+            texto = await generador.generar(prompt)
+    """
+    
+    def __init__(
+        self,
+        modelo: str = 'gpt-4',
+        api_key: Optional[str] = None,
+        max_en_vuelo: Optional[int] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_reintentos: Optional[int] = None,
+        base_url: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        """Inicializar generador
+        
+        Args:
+            modelo: 'gpt-4', 'gpt-3.5-turbo', 'gemini-pro'
+            api_key: API key (si no está en env)
+            max_en_vuelo: Llamadas simultáneas máximas (None = según proveedor)
+            rpm: Requests por minuto (None = LLM_RPM)
+            tpm: Tokens por minuto (None = LLM_TPM)
+            timeout: Timeout por llamada en segundos (None = LLM_TIMEOUT)
+            max_reintentos: Reintentos ante 429/5xx/timeouts (None = LLM_MAX_REINTENTOS)
+            base_url: URL base de la API (None = oficial o *_BASE_URL)
+            transport: Transporte httpx (p. ej. httpx.MockTransport en pruebas)
+        """
+        self.modelo = modelo
+        self.proveedor = crear_proveedor(modelo)
+        
+        if self.proveedor is not None:
+            self.tipo = self.proveedor.tipo
+            self.api_key = api_key
+        
+        elif modelo.startswith('gpt'):
+            self.tipo = 'openai'
+            self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+            if not self.api_key:
+                raise ValueError("OPENAI_API_KEY no configurada")
+        
+        elif modelo.startswith('gemini'):
+            self.tipo = 'gemini'
+            self.api_key = api_key or os.getenv('GOOGLE_API_KEY')
+            if not self.api_key:
+                raise ValueError("GOOGLE_API_KEY no configurada")
+        
+        else:
+            raise ValueError(f"Modelo no soportado: {modelo}")
+        
+        self.base_url = (base_url or URLS_BASE.get(self.tipo, '')).rstrip('/')
+        self.timeout = timeout or LIMITES_DEFAULT['timeout']
+        self.max_reintentos = (
+            max_reintentos if max_reintentos is not None
+            else LIMITES_DEFAULT['max_reintentos']
+        )
+        self.max_en_vuelo = max_en_vuelo or CONCURRENCIA_POR_PROVEEDOR.get(self.tipo, 4)
+        self.limitador = LimitadorTasa(
+            rpm or LIMITES_DEFAULT['rpm'],
+            tpm or LIMITES_DEFAULT['tpm']
+        )
+        self.transport = transport
+        self._cliente: Optional[httpx.AsyncClient] = None
+        
+        self.estadisticas = {
+            'llamadas': 0,
+            'reintentos': 0,
+            'errores': 0,
+            'cortes_anticipados': 0
+        }
+        
+        print(f"\n🤖 Usando {self.tipo} (async): {modelo}")
+        print(f"   Límites: {self.limitador.requests.capacidad} RPM, "
+              f"{self.limitador.tokens.capacidad} TPM, {self.max_en_vuelo} en vuelo")
+    
+    async def __aenter__(self):
+        self._cliente = httpx.AsyncClient(timeout=self.timeout, transport=self.transport)
+        return self
+    
+    async def __aexit__(self, *exc):
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+    
+    async def generar(
+        self,
+        prompt: str,
+        temperatura: float = 0.1,
+        max_tokens: int = 2000
+    ) -> str:
+        """Generar texto con reintentos y backoff exponencial con jitter
+        
+        Args:
+            prompt: Prompt completo
+            temperatura: Creatividad (0.0-1.0)
+            max_tokens: Tokens máximos
+        
+        Returns:
+            Texto generado
+        """
+        if self._cliente is None:
+            # Fuera de `async with`: cliente propio de esta llamada
+            async with httpx.AsyncClient(timeout=self.timeout, transport=self.transport) as cliente:
+                return await self._generar_con_reintentos(cliente, prompt, temperatura, max_tokens)
+        
+        return await self._generar_con_reintentos(self._cliente, prompt, temperatura, max_tokens)
+    
+    async def _generar_con_reintentos(
+        self,
+        cliente: httpx.AsyncClient,
+        prompt: str,
+        temperatura: float,
+        max_tokens: int
+    ) -> str:
+        """Bucle de rate limiting + llamada + backoff
+        
+        Cada intento reserva el peor caso (prompt + max_tokens) y, al
+        terminar, la reserva se liquida con el uso real que informa el
+        proveedor (usage), de modo que el throughput sostenido llega al
+        TPM real. Un intento fallido devuelve la salida reservada; tras un
+        429 el prompt sigue reservado y el reintento no lo vuelve a cobrar.
+        Se liquida siempre lo que el bucket descontó de verdad, que es menor
+        que lo pedido cuando el prompt supera la ráfaga.
+        """
+        tokens_prompt = estimar_tokens(SYSTEM_PROMPT + prompt)
+        prompt_reservado = False
+        reservado = 0.0  # Tokens descontados a esta llamada y sin liquidar
+        
+        intento = 0
+        while True:
+            reservado += await self.limitador.adquirir(
+                max_tokens + (0 if prompt_reservado else tokens_prompt)
+            )
+            self.estadisticas['llamadas'] += 1
+            
+            try:
+                texto, usados = await asyncio.wait_for(
+                    self._llamar(cliente, prompt, temperatura, max_tokens),
+                    timeout=self.timeout
+                )
+                self.limitador.liquidar(
+                    reservado,
+                    usados if usados is not None else tokens_prompt + estimar_tokens(texto)
+                )
+                return texto
+            except (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError) as e:
+                error = ErrorProveedorLLM(f"{type(e).__name__}: {e}", reintentable=True)
+            except ErrorProveedorLLM as e:
+                error = e
+            
+            reservado, prompt_reservado = self._liquidar_fallo(reservado, tokens_prompt, error)
+            
+            if not error.reintentable or intento >= self.max_reintentos:
+                self.estadisticas['errores'] += 1
+                raise error
+            
+            espera = self._calcular_espera(intento, error.retry_after)
+            print(f"   ⏳ {self.tipo}: {error} - reintento {intento + 1}/{self.max_reintentos} en {espera:.1f}s")
+            self.estadisticas['reintentos'] += 1
+            intento += 1
+            await asyncio.sleep(espera)
+    
+    async def generar_stream(
+        self,
+        prompt: str,
+        temperatura: float = 0.1,
+        max_tokens: int = 2000,
+        al_contenido: Optional[Callable[[str], None]] = None,
+        parar_en_fuentes: bool = True
+    ) -> str:
+        """Generar en streaming con parsing incremental de bloques
+        
+        El contenido armonizado se entrega a `al_contenido` en cuanto su
+        bloque termina. Los errores reintentables antes de ese momento
+        reinician el stream; después, se devuelve lo recibido (el contenido
+        ya está completo).
+        
+        Args:
+            prompt: Prompt completo
+            temperatura: Creatividad (0.0-1.0)
+            max_tokens: Tokens máximos
+            al_contenido: Callback con el contenido armonizado
+            parar_en_fuentes: Cortar la generación al empezar ### FUENTES
+        
+        Returns:
+            Texto generado (sin FUENTES si se cortó)
+        """
+        if self._cliente is None:
+            async with httpx.AsyncClient(timeout=self.timeout, transport=self.transport) as cliente:
+                return await self._generar_stream_con_reintentos(
+                    cliente, prompt, temperatura, max_tokens, al_contenido, parar_en_fuentes
+                )
+        
+        return await self._generar_stream_con_reintentos(
+            self._cliente, prompt, temperatura, max_tokens, al_contenido, parar_en_fuentes
+        )
+    
+    async def _generar_stream_con_reintentos(
+        self,
+        cliente: httpx.AsyncClient,
+        prompt: str,
+        temperatura: float,
+        max_tokens: int,
+        al_contenido: Optional[Callable[[str], None]],
+        parar_en_fuentes: bool
+    ) -> str:
+        """Bucle de rate limiting + stream + backoff
+        
+        Reserva y liquidación como en _generar_con_reintentos; el stream no
+        informa de usage, así que la salida se estima sobre el texto
+        recibido (menor que max_tokens si se cortó en FUENTES).
+        """
+        tokens_prompt = estimar_tokens(SYSTEM_PROMPT + prompt)
+        prompt_reservado = False
+        reservado = 0.0
+        
+        intento = 0
+        while True:
+            reservado += await self.limitador.adquirir(
+                max_tokens + (0 if prompt_reservado else tokens_prompt)
+            )
+            self.estadisticas['llamadas'] += 1
+            parser = ParserSeccionesIncremental(al_contenido, parar_en_fuentes)
+            
+            try:
+                respuesta = await asyncio.wait_for(
+                    consumir_stream_async(
+                        self._stream(cliente, prompt, temperatura, max_tokens), parser
+                    ),
+                    timeout=self.timeout
+                )
+                self.limitador.liquidar(reservado, tokens_prompt + estimar_tokens(respuesta))
+                if parser.cortado:
+                    self.estadisticas['cortes_anticipados'] += 1
+                return respuesta
+            except (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError) as e:
+                error = ErrorProveedorLLM(f"{type(e).__name__}: {e}", reintentable=True)
+            except ErrorProveedorLLM as e:
+                error = e
+            
+            if parser.contenido is not None:
+                # El contenido ya se entregó: no se regenera
+                self.limitador.liquidar(reservado, tokens_prompt + estimar_tokens(parser.respuesta()))
+                print(f"   ⚠ {self.tipo}: {error} - stream interrumpido tras el contenido")
+                return parser.respuesta()
+            
+            reservado, prompt_reservado = self._liquidar_fallo(reservado, tokens_prompt, error)
+            
+            if not error.reintentable or intento >= self.max_reintentos:
+                self.estadisticas['errores'] += 1
+                raise error
+            
+            espera = self._calcular_espera(intento, error.retry_after)
+            print(f"   ⏳ {self.tipo}: {error} - reintento {intento + 1}/{self.max_reintentos} en {espera:.1f}s")
+            self.estadisticas['reintentos'] += 1
+            intento += 1
+            await asyncio.sleep(espera)
+    
+    def _liquidar_fallo(
+        self,
+        reservado: float,
+        tokens_prompt: int,
+        error: ErrorProveedorLLM
+    ) -> Tuple[float, bool]:
+        """Liquidar un intento fallido (sin salida generada)
+        
+        Se devuelve todo lo reservado salvo el prompt. Tras un 429 el prompt
+        queda reservado para el reintento; con otros errores se da por
+        consumido y el reintento lo vuelve a cobrar.
+        
+        Returns:
+            (tokens que siguen reservados, si el prompt ya está reservado)
+        """
+        prompt = min(reservado, tokens_prompt)
+        self.limitador.liquidar(reservado, prompt)
+        if error.estado == 429:
+            return prompt, True
+        return 0.0, False
+    
+    @staticmethod
+    def _calcular_espera(
+        intento: int,
+        retry_after: Optional[float],
+        base: float = 1.0,
+        maximo: float = 60.0
+    ) -> float:
+        """Backoff exponencial con jitter completo (respeta Retry-After)"""
+        espera = random.uniform(0, min(maximo, base * (2 ** intento)))
+        if retry_after is not None:
+            espera = max(espera, retry_after)
+        return espera
+    
+    async def _llamar(
+        self,
+        cliente: httpx.AsyncClient,
+        prompt: str,
+        temperatura: float,
+        max_tokens: int
+    ) -> Tuple[str, Optional[int]]:
+        """Una llamada al proveedor
+        
+        Returns:
+            (texto, tokens usados según el proveedor o None si no los informa)
+        """
+        if self.proveedor is not None:
+            return await self.proveedor.generar_async(prompt, temperatura, max_tokens), None
+        
+        if self.tipo == 'openai':
+            respuesta = await cliente.post(
+                f"{self.base_url}/chat/completions",
+                headers={'Authorization': f"Bearer {self.api_key}"},
+                json={
+                    'model': self.modelo,
+                    'messages': [
+                        {'role': 'system', 'content': SYSTEM_PROMPT},
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    'temperature': temperatura,
+                    'max_tokens': max_tokens
+                }
+            )
+            datos = self._verificar(respuesta)
+            return (
+                datos['choices'][0]['message']['content'],
+                datos.get('usage', {}).get('total_tokens')
+            )
+        
+        respuesta = await cliente.post(
+            f"{self.base_url}/models/{self.modelo}:generateContent",
+            params={'key': self.api_key},
+            json={
+                'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                'generationConfig': {
+                    'temperature': temperatura,
+                    'maxOutputTokens': max_tokens
+                }
+            }
+        )
+        datos = self._verificar(respuesta)
+        partes = datos['candidates'][0]['content']['parts']
+        return (
+            ''.join(parte.get('text', '') for parte in partes),
+            datos.get('usageMetadata', {}).get('totalTokenCount')
+        )
+    
+    async def _stream(
+        self,
+        cliente: httpx.AsyncClient,
+        prompt: str,
+        temperatura: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """Fragmentos de texto de una llamada en streaming (SSE)"""
+        if self.proveedor is not None:
+            async for fragmento in self.proveedor.generar_stream_async(prompt, temperatura, max_tokens):
+                yield fragmento
+            return
+        
+        if self.tipo == 'openai':
+            peticion = cliente.stream(
+                'POST',
+                f"{self.base_url}/chat/completions",
+                headers={'Authorization': f"Bearer {self.api_key}"},
+                json={
+                    'model': self.modelo,
+                    'messages': [
+                        {'role': 'system', 'content': SYSTEM_PROMPT},
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    'temperature': temperatura,
+                    'max_tokens': max_tokens,
+                    'stream': True
+                }
+            )
+        else:
+            peticion = cliente.stream(
+                'POST',
+                f"{self.base_url}/models/{self.modelo}:streamGenerateContent",
+                params={'key': self.api_key, 'alt': 'sse'},
+                json={
+                    'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                    'generationConfig': {
+                        'temperature': temperatura,
+                        'maxOutputTokens': max_tokens
+                    }
+                }
+            )
+        
+        async with peticion as respuesta:
+            if respuesta.status_code >= 400:
+                await respuesta.aread()
+                self._verificar(respuesta)
+            
+            async for linea in respuesta.aiter_lines():
+                if not linea.startswith('data:'):
+                    continue
+                
+                datos = linea[5:].strip()
+                if datos == '[DONE]':
+                    break
+                
+                try:
+                    evento = json.loads(datos)
+                except json.JSONDecodeError as e:
+                    # Evento truncado o corrupto: se reintenta el stream
+                    raise ErrorProveedorLLM(
+                        f"SSE no válido: {e}: {datos[:200]}", reintentable=True
+                    ) from e
+                if evento.get('error'):
+                    raise self._error_evento(evento['error'])
+                
+                # Eventos sin opciones (p. ej. solo usage) no aportan texto
+                if self.tipo == 'openai':
+                    opcion = (evento.get('choices') or [{}])[0]
+                    fragmento = (opcion.get('delta') or {}).get('content')
+                else:
+                    candidato = (evento.get('candidates') or [{}])[0]
+                    partes = (candidato.get('content') or {}).get('parts') or []
+                    fragmento = ''.join(parte.get('text', '') for parte in partes)
+                
+                if fragmento:
+                    yield fragmento
+    
+    @staticmethod
+    def _error_evento(error) -> ErrorProveedorLLM:
+        """Convertir un evento {"error": ...} del stream en ErrorProveedorLLM
+        
+        OpenAI envía {"message", "type", "code"} y Gemini {"code" (HTTP),
+        "message", "status"}; la sobrecarga y los límites se reintentan.
+        """
+        if not isinstance(error, dict):
+            error = {'message': str(error)}
+        
+        estado = error.get('code') if isinstance(error.get('code'), int) else None
+        clase = str(error.get('status') or error.get('type') or error.get('code') or '')
+        if estado is None and clase in ERRORES_STREAM_REINTENTABLES:
+            estado = 429 if 'rate_limit' in clase or clase == 'RESOURCE_EXHAUSTED' else 503
+        
+        return ErrorProveedorLLM(
+            f"Error en el stream ({clase or estado}): {str(error.get('message', ''))[:200]}",
+            reintentable=estado in CODIGOS_REINTENTABLES or clase in ERRORES_STREAM_REINTENTABLES,
+            estado=estado
+        )
+    
+    @staticmethod
+    def _verificar(respuesta: httpx.Response) -> Dict:
+        """Convertir errores HTTP en ErrorProveedorLLM"""
+        if respuesta.status_code < 400:
+            return respuesta.json()
+        
+        retry_after = respuesta.headers.get('retry-after')
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        
+        raise ErrorProveedorLLM(
+            f"HTTP {respuesta.status_code}: {respuesta.text[:200]}",
+            reintentable=respuesta.status_code in CODIGOS_REINTENTABLES,
+            retry_after=retry_after,
+            estado=respuesta.status_code
+        )
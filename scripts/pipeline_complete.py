@@ -33,7 +33,19 @@ class AALabelPPPipeline:
         self,
         modelo_embedding: str = 'multilingual-mpnet',
         modelo_llm: str = 'gpt-4',
-        output_dir: Optional[Path] = None
+        output_dir: Optional[Path] = None,
+        modo_busqueda: str = 'pgvector',
+        ruta_cache_queries: Optional[Path] = None,
+        cache_armonizacion: bool = True,
+        max_concurrencia: Optional[int] = None,
+        llm_async: bool = False,
+        streaming: bool = False,
+        presupuesto_evidencia: Optional[int] = None,
+        oraciones_por_articulo: Optional[int] = None,
+        granularidad: str = 'articulo',
+        agregacion: str = 'max',
+        indices_por_pais: bool = False,
+        almacenamiento: Optional[str] = None
     ):
         """Inicializar pipeline
         
@@ -41,6 +53,19 @@ class AALabelPPPipeline:
             modelo_embedding: Modelo para embeddings
             modelo_llm: Modelo LLM para generación
             output_dir: Directorio de salida (default: data/outputs)
+            modo_busqueda: Modo de recuperación ('pgvector', 'indice' o 'memoria')
+            ruta_cache_queries: Archivo .npz para persistir embeddings de queries
+            cache_armonizacion: Reutilizar respuestas LLM con el mismo prompt
+            max_concurrencia: Secciones armonizadas en paralelo (None = según proveedor)
+            llm_async: Cliente LLM asíncrono con rate limiting y reintentos
+            streaming: Generación en streaming con corte antes de FUENTES
+            presupuesto_evidencia: Tokens de evidencia por prompt (None = sin límite)
+            oraciones_por_articulo: Oraciones más relevantes a conservar por
+                artículo (None = texto completo)
+            granularidad: Unidad de búsqueda ('articulo' o 'fragmento')
+            agregacion: Agregación de fragmentos por artículo ('max' o 'sum')
+            indices_por_pais: Búsqueda repartida entre índices HNSW parciales por país
+            almacenamiento: Columna de vectores ('vector' o 'halfvec')
         """
         self.modelo_embedding = modelo_embedding
         self.modelo_llm = modelo_llm
@@ -61,7 +86,19 @@ class AALabelPPPipeline:
         
         self.rag_engine = RAGEngine(
             modelo_embedding=modelo_embedding,
-            modelo_llm=modelo_llm
+            modelo_llm=modelo_llm,
+            modo_busqueda=modo_busqueda,
+            ruta_cache_queries=ruta_cache_queries,
+            cache_armonizacion=cache_armonizacion,
+            max_concurrencia=max_concurrencia,
+            llm_async=llm_async,
+            streaming=streaming,
+            presupuesto_evidencia=presupuesto_evidencia,
+            oraciones_por_articulo=oraciones_por_articulo,
+            granularidad=granularidad,
+            agregacion=agregacion,
+            indices_por_pais=indices_por_pais,
+            almacenamiento=almacenamiento
         )
         
         print(f"\n✅ Sistema inicializado")
@@ -305,7 +342,82 @@ Ejemplos de uso:
     parser.add_argument(
         '--llm-model',
         default='gpt-4',
-        help='Modelo LLM (gpt-4, gpt-3.5-turbo, gemini-pro)'
+        help='Modelo LLM (gpt-4, gpt-3.5-turbo, gemini-pro, mock[:latencia=..,error=..,tps=..])'
+    )
+    parser.add_argument(
+        '--modo-busqueda',
+        default='pgvector',
+        choices=['pgvector', 'indice', 'memoria'],
+        help='Modo de recuperación (pgvector = índice HNSW, indice = matriz en memoria, memoria = desarrollo)'
+    )
+    
+    parser.add_argument(
+        '--cache-queries',
+        type=Path,
+        help='Archivo .npz para persistir la cache de embeddings de queries'
+    )
+    
+    parser.add_argument(
+        '--sin-cache-llm',
+        action='store_true',
+        help='No reutilizar respuestas LLM cacheadas (fuerza regenerar cada sección)'
+    )
+    
+    parser.add_argument(
+        '--max-concurrencia',
+        type=int,
+        help='Llamadas LLM simultáneas por etiqueta (default: según proveedor, 1 = secuencial)'
+    )
+    
+    parser.add_argument(
+        '--llm-async',
+        action='store_true',
+        help='Cliente LLM asíncrono con límites RPM/TPM, reintentos y timeouts (ver LLM_* en .env)'
+    )
+    
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='Generar en streaming: contenido disponible antes y sin generar el bloque FUENTES'
+    )
+    
+    parser.add_argument(
+        '--presupuesto-evidencia',
+        type=int,
+        default=None,
+        help='Tokens máximos de evidencia por prompt de sección (default: sin límite, ej. 3000)'
+    )
+    
+    parser.add_argument(
+        '--oraciones-por-articulo',
+        type=int,
+        help='Comprimir cada artículo a sus N oraciones más relevantes para la sección'
+    )
+    
+    parser.add_argument(
+        '--granularidad',
+        default='articulo',
+        choices=['articulo', 'fragmento'],
+        help='Buscar por artículo completo o por fragmentos solapados (generate_embeddings.py --fragmentos)'
+    )
+    
+    parser.add_argument(
+        '--agregacion',
+        default='max',
+        choices=['max', 'sum'],
+        help='Con --granularidad fragmento: score del artículo = mejor fragmento (max) o suma'
+    )
+    
+    parser.add_argument(
+        '--indices-por-pais',
+        action='store_true',
+        help='Buscar en índices HNSW parciales por país (db_config.py indices reconstruir --por-pais)'
+    )
+    
+    parser.add_argument(
+        '--almacenamiento',
+        choices=['vector', 'halfvec'],
+        help='Columna de vectores: vector (float32) o halfvec (float16)'
     )
     
     # Opciones de salida
@@ -337,7 +449,19 @@ Ejemplos de uso:
     pipeline = AALabelPPPipeline(
         modelo_embedding=args.embedding_model,
         modelo_llm=args.llm_model,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        modo_busqueda=args.modo_busqueda,
+        ruta_cache_queries=args.cache_queries,
+        cache_armonizacion=not args.sin_cache_llm,
+        max_concurrencia=args.max_concurrencia,
+        llm_async=args.llm_async,
+        streaming=args.streaming,
+        presupuesto_evidencia=args.presupuesto_evidencia or None,
+        oraciones_por_articulo=args.oraciones_por_articulo,
+        granularidad=args.granularidad,
+        agregacion=args.agregacion,
+        indices_por_pais=args.indices_por_pais,
+        almacenamiento=args.almacenamiento
     )
     
     # Ejecutar
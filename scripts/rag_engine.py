@@ -8,10 +8,18 @@ Versión: 1.0
 
 import sys
 import os
+import re
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple, Callable, Iterator
+from dataclasses import dataclass, field, replace
 from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import asyncio
+import unicodedata
+import hashlib
 import json
 
 # ML/NLP
@@ -20,25 +28,45 @@ import numpy as np
 
 # Database
 sys.path.append(str(Path(__file__).parent.parent))
-from database.db_config import get_db_session
+from database.db_config import get_db_session, DatabaseEngine
 from database.models import (
-    ArticuloNormativo, EmbeddingVectorial, 
-    DocumentoNormativo, Pais, SeccionEtiqueta
+    ArticuloNormativo, EmbeddingVectorial, EmbeddingFragmento,
+    DocumentoNormativo, Pais, SeccionEtiqueta, CacheArmonizacion,
+    almacen_embedding, vector_a_numpy
+)
+
+# LLM
+from scripts.llm_providers import (
+    AsyncLLMGenerator, SYSTEM_PROMPT, LIMITES_DEFAULT, CONCURRENCIA_POR_PROVEEDOR,
+    ErrorProveedorLLM, CODIGOS_REINTENTABLES, crear_proveedor,
+    ParserSeccionesIncremental, consumir_stream
 )
 
-# LLM (condicional)
 try:
-    import openai
+    from openai import OpenAI, APIConnectionError, APIStatusError
     OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
 
 try:
     import google.generativeai as genai
+    from google.api_core.exceptions import GoogleAPICallError, RetryError
     GEMINI_AVAILABLE = True
 except ImportError:
     GEMINI_AVAILABLE = False
 
+# Excepciones de los SDK que se traducen a ErrorProveedorLLM
+ERRORES_SDK: Tuple[type, ...] = (
+    ((APIConnectionError, APIStatusError) if OPENAI_AVAILABLE else ())
+    + ((GoogleAPICallError, RetryError) if GEMINI_AVAILABLE else ())
+)
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
 
 # ============================================================================
 # DATACLASSES
@@ -55,6 +83,7 @@ class ArticuloRecuperado:
     similitud: float
     capitulo: Optional[str] = None
     seccion: Optional[str] = None
+    tambien_en: List[str] = field(default_factory=list)  # Citas con texto duplicado
 
 
 @dataclass
@@ -78,6 +107,401 @@ class EtiquetaArmonizada:
     metadata: Dict = field(default_factory=dict)
 
 
+# ============================================================================
+# ÍNDICE VECTORIAL EN MEMORIA
+# ============================================================================
+
+def _vector_a_texto(vector: np.ndarray) -> str:
+    """Representación textual de pgvector ('[x1,x2,...]')"""
+    return '[' + ','.join(f'{x:.8g}' for x in vector) + ']'
+
+
+def _indices_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices de los k mayores scores, ordenados de mayor a menor"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    mejores = np.argpartition(-scores, k - 1)[:k]
+    return mejores[np.argsort(-scores[mejores])]
+
+
+def _inicios_por_articulo(articulo_ids: np.ndarray) -> np.ndarray:
+    """Primera fila de cada artículo (filas ordenadas por articulo_id)"""
+    if not len(articulo_ids):
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, articulo_ids[1:] != articulo_ids[:-1]])
+
+
+def _agregar_por_articulo(scores: np.ndarray, inicios: np.ndarray, agregacion: str) -> np.ndarray:
+    """Agregar scores de fragmentos a scores de artículo en una pasada
+    
+    Args:
+        scores: Matriz (num_fragmentos, num_queries), filas contiguas por artículo
+        inicios: Primera fila de cada artículo
+        agregacion: 'max' (mejor fragmento) o 'sum' (evidencia acumulada)
+        
+    Returns:
+        Matriz (num_articulos, num_queries)
+    """
+    if agregacion == 'sum':
+        return np.add.reduceat(scores, inicios, axis=0)
+    return np.maximum.reduceat(scores, inicios, axis=0)
+
+
+def _seleccionar_top_k(
+    scores: np.ndarray,
+    ids: np.ndarray,
+    grupos: List[np.ndarray],
+    top_k: int,
+    umbral: float
+) -> List[List[Tuple[int, float]]]:
+    """Top-k por query y por grupo sobre una matriz de scores
+    
+    Args:
+        scores: Matriz (num_vectores, num_queries)
+        ids: articulo_id de cada fila de scores
+        grupos: Máscaras booleanas de filas; cada grupo aporta hasta top_k
+        top_k: Resultados por query y grupo
+        umbral: Similitud mínima
+        
+    Returns:
+        Una lista de (articulo_id, similitud) por query, de mayor a menor
+    """
+    num_queries = scores.shape[1]
+    resultados: List[List[Tuple[int, float]]] = [[] for _ in range(num_queries)]
+    
+    for mascara in grupos:
+        filas = np.flatnonzero(mascara)
+        if not filas.size:
+            continue
+        
+        scores_grupo = scores[filas]
+        for j in range(num_queries):
+            columna = scores_grupo[:, j]
+            resultados[j].extend(
+                (int(ids[filas[i]]), float(columna[i]))
+                for i in _indices_top_k(columna, top_k)
+                if columna[i] >= umbral
+            )
+    
+    if len(grupos) > 1:
+        for resultado in resultados:
+            resultado.sort(key=lambda x: x[1], reverse=True)
+    
+    return resultados
+
+
+class IndiceVectorialMemoria:
+    """Índice residente con todos los vectores de un modelo de embeddings
+    
+    Los vectores se cargan una sola vez en una matriz float32 contigua, con
+    arrays paralelos de articulo_id, pais_id y estado del documento. Cada
+    consulta es un único producto matriz-vector más argpartition, con
+    máscaras booleanas para los filtros de país y vigencia.
+    
+    Con fragmentos=True la matriz contiene los vectores de
+    embeddings_fragmentos (filas contiguas por artículo) y los scores se
+    agregan por artículo con reduceat antes del top-k; los arrays de
+    metadatos son siempre por artículo.
+    
+    El índice es una foto de la BD en el momento de la carga: llamar a
+    recargar() tras ingerir normativas o generar embeddings nuevos.
+    """
+    
+    ESTADOS = ('vigente', 'derogado', 'modificado')
+    
+    def __init__(
+        self,
+        modelo_path: str,
+        fragmentos: bool = False,
+        agregacion: str = 'max',
+        columna: str = 'embedding'
+    ):
+        """Inicializar índice vacío
+        
+        Args:
+            modelo_path: Nombre completo del modelo (embeddings_vectoriales.modelo_embedding)
+            fragmentos: Indexar embeddings_fragmentos en lugar de artículos completos
+            agregacion: Agregación de fragmentos por artículo ('max' o 'sum')
+            columna: 'embedding' (vector) o 'embedding_half' (halfvec, se
+                convierte a float32 al cargar)
+        """
+        self.modelo_path = modelo_path
+        self.fragmentos = fragmentos
+        self.agregacion = agregacion
+        self.columna = columna
+        self.matriz = np.empty((0, 0), dtype=np.float32)
+        self._inicios = np.empty(0, dtype=np.int64)
+        self.articulo_ids = np.empty(0, dtype=np.int64)
+        self.pais_ids = np.empty(0, dtype=np.int32)
+        self.estados = np.empty(0, dtype=np.int8)
+        self.paises_por_codigo: Dict[str, int] = {}
+        self._mascaras_pais: Dict[int, np.ndarray] = {}
+        self._mascara_vigente = np.empty(0, dtype=bool)
+        self.fecha_carga: Optional[datetime] = None
+    
+    @classmethod
+    def cargar(
+        cls,
+        modelo_path: str,
+        fragmentos: bool = False,
+        agregacion: str = 'max',
+        columna: str = 'embedding'
+    ) -> 'IndiceVectorialMemoria':
+        """Crear y cargar el índice desde la BD"""
+        indice = cls(modelo_path, fragmentos, agregacion, columna)
+        indice.recargar()
+        return indice
+    
+    def recargar(self):
+        """(Re)cargar todos los vectores del modelo desde la BD"""
+        with get_db_session() as session:
+            self.paises_por_codigo = {
+                codigo.strip(): pais_id
+                for pais_id, codigo in session.query(Pais.id, Pais.codigo_iso).all()
+            }
+            
+            tabla = EmbeddingFragmento if self.fragmentos else EmbeddingVectorial
+            orden = (tabla.articulo_id, EmbeddingFragmento.posicion) if self.fragmentos else (tabla.articulo_id,)
+            columna = getattr(tabla, self.columna)
+            
+            filas = session.query(
+                tabla.articulo_id,
+                columna.label('embedding'),
+                DocumentoNormativo.pais_id,
+                DocumentoNormativo.estado
+            ).join(
+                ArticuloNormativo, tabla.articulo_id == ArticuloNormativo.id
+            ).join(
+                DocumentoNormativo, ArticuloNormativo.documento_id == DocumentoNormativo.id
+            ).filter(
+                tabla.modelo_embedding == self.modelo_path,
+                columna.isnot(None)
+            ).order_by(*orden).all()
+        
+        n = len(filas)
+        dimension = len(filas[0].embedding) if n else 0
+        
+        matriz = np.empty((n, dimension), dtype=np.float32)
+        articulo_ids = np.empty(n, dtype=np.int64)
+        pais_ids = np.empty(n, dtype=np.int32)
+        estados = np.empty(n, dtype=np.int8)
+        
+        codigos_estado = {estado: i for i, estado in enumerate(self.ESTADOS)}
+        for i, fila in enumerate(filas):
+            matriz[i] = vector_a_numpy(fila.embedding)
+            articulo_ids[i] = fila.articulo_id
+            pais_ids[i] = fila.pais_id
+            estados[i] = codigos_estado.get(fila.estado, -1)
+        
+        # Metadatos por artículo (primera fila de cada uno)
+        inicios = _inicios_por_articulo(articulo_ids)
+        articulo_ids = articulo_ids[inicios]
+        pais_ids = pais_ids[inicios]
+        estados = estados[inicios]
+        
+        self.matriz = np.ascontiguousarray(matriz)
+        self._inicios = inicios
+        self.articulo_ids = articulo_ids
+        self.pais_ids = pais_ids
+        self.estados = estados
+        self._mascaras_pais = {
+            int(pais_id): pais_ids == pais_id for pais_id in np.unique(pais_ids)
+        }
+        self._mascara_vigente = estados == codigos_estado['vigente']
+        self.fecha_carga = datetime.now()
+        
+        memoria_mb = self.matriz.nbytes / (1024 * 1024)
+        print(f"   ✓ Índice en memoria: {n} vectores de {len(inicios)} artículos, "
+              f"{dimension}D ({memoria_mb:.1f} MB)")
+    
+    def __len__(self) -> int:
+        return len(self.articulo_ids)
+    
+    def _mascara(self, paises: List[str], solo_vigentes: bool) -> np.ndarray:
+        """Máscara booleana de filas que cumplen los filtros"""
+        mascara = np.zeros(len(self), dtype=bool)
+        for codigo in paises:
+            pais_id = self.paises_por_codigo.get(codigo)
+            if pais_id in self._mascaras_pais:
+                mascara |= self._mascaras_pais[pais_id]
+        
+        if solo_vigentes:
+            mascara &= self._mascara_vigente
+        
+        return mascara
+    
+    def buscar(
+        self,
+        query_embedding: np.ndarray,
+        paises: List[str],
+        top_k: int,
+        umbral: float = 0.0,
+        solo_vigentes: bool = True
+    ) -> List[Tuple[int, float]]:
+        """Top-k por similitud coseno (vectores normalizados)
+        
+        Args:
+            query_embedding: Vector normalizado de la query
+            paises: Códigos ISO de países
+            top_k: Número de resultados
+            umbral: Similitud mínima
+            solo_vigentes: Filtrar documentos con estado 'vigente'
+            
+        Returns:
+            Lista de (articulo_id, similitud) ordenada de mayor a menor
+        """
+        return self.buscar_lote(
+            np.atleast_2d(query_embedding), paises, top_k, umbral, solo_vigentes
+        )[0]
+    
+    def buscar_lote(
+        self,
+        query_embeddings: np.ndarray,
+        paises: List[str],
+        top_k: int,
+        umbral: float = 0.0,
+        solo_vigentes: bool = True,
+        por_pais: bool = False
+    ) -> List[List[Tuple[int, float]]]:
+        """Top-k de varias queries con un único producto matricial
+        
+        Args:
+            query_embeddings: Matriz (num_queries, dimension) normalizada
+            paises: Códigos ISO de países
+            top_k: Número de resultados por query (por país si por_pais)
+            umbral: Similitud mínima
+            solo_vigentes: Filtrar documentos con estado 'vigente'
+            por_pais: Top-k independiente para cada país
+            
+        Returns:
+            Una lista de (articulo_id, similitud) por query, en el mismo orden
+        """
+        num_queries = len(query_embeddings)
+        if not len(self) or top_k <= 0:
+            return [[] for _ in range(num_queries)]
+        
+        if por_pais:
+            grupos = [self._mascara([codigo], solo_vigentes) for codigo in paises]
+        else:
+            grupos = [self._mascara(paises, solo_vigentes)]
+        
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        scores = self.matriz @ queries.T  # (num_vectores, num_queries)
+        
+        if self.fragmentos:
+            scores = _agregar_por_articulo(scores, self._inicios, self.agregacion)
+        
+        return _seleccionar_top_k(scores, self.articulo_ids, grupos, top_k, umbral)
+
+
+# ============================================================================
+# CACHE DE EMBEDDINGS DE QUERIES
+# ============================================================================
+
+class CacheEmbeddingsQuery:
+    """Cache LRU acotada de embeddings de queries
+    
+    Las queries de sección salen de secciones_etiqueta y se repiten para
+    todos los productos; la clave es (modelo, texto normalizado). Si se
+    indica una ruta, la cache se persiste en un .npz para que los
+    reinicios no vuelvan a codificar.
+    """
+    
+    SEPARADOR = '\x1f'
+    
+    def __init__(self, max_entradas: int = 1024, ruta: Optional[Path] = None):
+        """Inicializar cache
+        
+        Args:
+            max_entradas: Número máximo de embeddings en memoria
+            ruta: Archivo .npz de persistencia (None = solo memoria)
+        """
+        self.max_entradas = max_entradas
+        self.ruta = Path(ruta) if ruta else None
+        self._entradas: 'OrderedDict[Tuple[str, str], np.ndarray]' = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        
+        if self.ruta and self.ruta.exists():
+            self.cargar()
+    
+    @staticmethod
+    def normalizar(texto: str) -> str:
+        """Normalizar texto de query (Unicode NFC y espacios)"""
+        return ' '.join(unicodedata.normalize('NFC', texto).split())
+    
+    def obtener(self, modelo_path: str, texto: str) -> Optional[np.ndarray]:
+        """Embedding cacheado o None"""
+        clave = (modelo_path, self.normalizar(texto))
+        embedding = self._entradas.get(clave)
+        
+        if embedding is None:
+            self.fallos += 1
+            return None
+        
+        self._entradas.move_to_end(clave)
+        self.aciertos += 1
+        return embedding
+    
+    def guardar_entrada(self, modelo_path: str, texto: str, embedding: np.ndarray):
+        """Añadir embedding (expulsa el menos usado si se supera el límite)"""
+        clave = (modelo_path, self.normalizar(texto))
+        self._entradas[clave] = np.asarray(embedding, dtype=np.float32)
+        self._entradas.move_to_end(clave)
+        
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._entradas)
+    
+    def estadisticas(self) -> Dict:
+        """Contadores de aciertos/fallos"""
+        total = self.aciertos + self.fallos
+        return {
+            'entradas': len(self),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': self.aciertos / total if total else 0.0
+        }
+    
+    def persistir(self):
+        """Escribir la cache en disco (si hay ruta configurada)"""
+        if not self.ruta or not self._entradas:
+            return
+        
+        # Un array por entrada: modelos distintos pueden tener dimensiones distintas
+        claves = np.array([
+            f"{modelo}{self.SEPARADOR}{texto}" for modelo, texto in self._entradas
+        ])
+        
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.ruta.with_suffix('.tmp.npz')
+        np.savez(tmp, claves=claves, **{
+            f'v{i}': vector for i, vector in enumerate(self._entradas.values())
+        })
+        tmp.replace(self.ruta)
+    
+    def cargar(self):
+        """Cargar la cache desde disco"""
+        try:
+            with np.load(self.ruta, allow_pickle=False) as datos:
+                claves = datos['claves']
+                for i, clave in enumerate(claves):
+                    modelo, texto = str(clave).split(self.SEPARADOR, 1)
+                    self._entradas[(modelo, texto)] = datos[f'v{i}']
+        except (OSError, KeyError, ValueError) as e:
+            print(f"   ⚠ Cache de queries ignorada ({self.ruta}): {e}")
+            self._entradas.clear()
+            return
+        
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+        
+        print(f"   ✓ Cache de queries: {len(self)} embeddings cargados")
+
+
 # ============================================================================
 # RECUPERADOR SEMÁNTICO
 # ============================================================================
@@ -85,156 +509,638 @@ class EtiquetaArmonizada:
 class SemanticRetriever:
     """Recuperador de artículos por similitud semántica"""
     
-    def __init__(self, modelo_embedding: str = 'multilingual-mpnet'):
+    MODOS_BUSQUEDA = ('pgvector', 'indice', 'memoria')
+    GRANULARIDADES = ('articulo', 'fragmento')
+    AGREGACIONES = ('max', 'sum')
+    
+    # Fragmentos candidatos por artículo pedido en la búsqueda ANN
+    FRAGMENTOS_POR_ARTICULO = 4
+    
+    # hnsw.ef_search por defecto del servidor
+    EF_SEARCH_DEFAULT = 40
+    
+    def __init__(
+        self,
+        modelo_embedding: str = 'multilingual-mpnet',
+        modo_busqueda: str = 'pgvector',
+        ef_search: Optional[int] = None,
+        cache_queries: int = 1024,
+        ruta_cache_queries: Optional[Path] = None,
+        granularidad: str = 'articulo',
+        agregacion: str = 'max',
+        indices_por_pais: bool = False,
+        almacenamiento: Optional[str] = None
+    ):
         """Inicializar recuperador
         
         Args:
             modelo_embedding: Nombre corto del modelo
+            modo_busqueda: 'pgvector' (índice HNSW en BD), 'indice' (matriz
+                residente en memoria) o 'memoria' (desarrollo)
+            ef_search: Valor de hnsw.ef_search para la consulta (ivfflat.probes si
+                el índice del modelo es IVFFlat; None = default del servidor).
+                Con pgvector < 0.8 se sube si no cubre top-k por país
+            cache_queries: Tamaño de la cache LRU de embeddings de queries (0 = sin cache)
+            ruta_cache_queries: Archivo .npz para persistir la cache entre ejecuciones
+            granularidad: 'articulo' (un vector por artículo) o 'fragmento'
+                (ventanas de embeddings_fragmentos agregadas por artículo)
+            agregacion: Con fragmentos, 'max' (mejor fragmento) o 'sum'
+            indices_por_pais: En pgvector por artículo, una búsqueda por país
+                sobre su índice HNSW parcial de artículos vigentes
+                (db_config.py indices reconstruir --por-pais), fusionadas
+            almacenamiento: 'vector' o 'halfvec': columna consultada (la que
+                haya escrito generate_embeddings.py); None = la del registro
         """
+        if modo_busqueda not in self.MODOS_BUSQUEDA:
+            raise ValueError(f"Modo de búsqueda no soportado: {modo_busqueda}")
+        if granularidad not in self.GRANULARIDADES:
+            raise ValueError(f"Granularidad no soportada: {granularidad}")
+        if agregacion not in self.AGREGACIONES:
+            raise ValueError(f"Agregación no soportada: {agregacion}")
+        
         # Mapeo de nombres cortos a paths completos
         MODELO_PATHS = {
             'multilingual-mpnet': 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2',
             'multilingual-minilm': 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2',
-            'spanish-roberta': 'hiiamsid/sentence_similarity_spanish_es'
+            'spanish-roberta': 'hiiamsid/sentence_similarity_spanish_es',
+            'labse': 'sentence-transformers/LaBSE'
         }
         
         self.modelo_path = MODELO_PATHS.get(
             modelo_embedding,
             'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
         )
+        self.almacen = almacen_embedding(self.modelo_path, almacenamiento)
+        self.modo_busqueda = modo_busqueda
+        self.ef_search = ef_search
+        self.granularidad = granularidad
+        self.agregacion = agregacion
+        self.indices_por_pais = indices_por_pais
+        self._ids_pais: Dict[str, int] = {}
+        self._iterativa: Optional[bool] = None
+        self._indice: Optional[IndiceVectorialMemoria] = None
+        self.cache = (
+            CacheEmbeddingsQuery(cache_queries, ruta_cache_queries)
+            if cache_queries > 0 else None
+        )
         
         print(f"\n🔍 Cargando modelo de retrieval: {self.modelo_path}")
         self.modelo = SentenceTransformer(self.modelo_path)
-        print(f"   ✓ Modelo cargado")
+        print(f"   ✓ Modelo cargado (modo: {self.modo_busqueda})")
+        print(f"   Almacenamiento: {self.almacen['tabla']}.{self.almacen['columna']} "
+              f"({self.almacen['tipo']})")
+    
+    @property
+    def indice(self) -> IndiceVectorialMemoria:
+        """Índice en memoria (se carga en el primer uso)"""
+        if self._indice is None:
+            self._indice = IndiceVectorialMemoria.cargar(
+                self.modelo_path,
+                fragmentos=self.granularidad == 'fragmento',
+                agregacion=self.agregacion,
+                columna=self.almacen['columna']
+            )
+        return self._indice
     
     def buscar_articulos_relevantes(
         self,
         query: str,
         paises: List[str],
         top_k: int = 5,
-        umbral_similitud: float = 0.5
+        umbral_similitud: float = 0.5,
+        por_pais: bool = False
     ) -> List[ArticuloRecuperado]:
         """Buscar artículos relevantes por similitud semántica
         
         Args:
             query: Texto de consulta
             paises: Lista de códigos ISO de países
-            top_k: Número de resultados
+            top_k: Número de resultados (por país si por_pais)
             umbral_similitud: Similitud mínima (0-1)
+            por_pais: Top-k independiente para cada país
             
         Returns:
             Lista de artículos recuperados
         """
-        # Generar embedding de la query
-        query_embedding = self.modelo.encode(
-            query,
-            convert_to_numpy=True,
-            normalize_embeddings=True
-        )
+        return self.buscar_articulos_relevantes_lote(
+            [query], paises, top_k, umbral_similitud, por_pais
+        )[0]
+    
+    def buscar_articulos_relevantes_lote(
+        self,
+        queries: List[str],
+        paises: List[str],
+        top_k: int = 5,
+        umbral_similitud: float = 0.5,
+        por_pais: bool = False
+    ) -> List[List[ArticuloRecuperado]]:
+        """Buscar artículos para varias queries a la vez
         
-        # Buscar en BD
-        with get_db_session() as session:
-            from sqlalchemy import func, and_
-            
-            # Subconsulta para filtrar por países
-            paises_ids = session.query(Pais.id).filter(
-                Pais.codigo_iso.in_(paises)
-            ).subquery()
-            
-            # Query vectorial con pgvector
-            query_sql = f"""
-                SELECT 
-                    a.id as articulo_id,
-                    a.numero_articulo,
-                    a.texto_completo,
-                    a.capitulo,
-                    a.seccion,
-                    p.nombre as pais,
-                    d.numero_documento,
-                    1 - (e.embedding <=> ARRAY[{','.join(map(str, query_embedding))}]::vector) as similitud
-                FROM embeddings_vectoriales e
-                JOIN articulos_normativos a ON e.articulo_id = a.id
-                JOIN documentos_normativos d ON a.documento_id = d.id
-                JOIN paises p ON d.pais_id = p.id
-                WHERE 
-                    e.modelo_embedding = :modelo
-                    AND d.pais_id IN :paises_ids
-                    AND d.estado = 'vigente'
-                    AND (1 - (e.embedding <=> ARRAY[{','.join(map(str, query_embedding))}]::vector)) >= :umbral
-                ORDER BY e.embedding <=> ARRAY[{','.join(map(str, query_embedding))}]::vector
-                LIMIT :limit
-            """
-            
-            # Ejecutar (simplificado para demostración)
-            # En producción, usar la función SQL o consulta ORM apropiada
-            
-            # Alternativa: Búsqueda in-memory (para desarrollo)
-            articulos = self._buscar_articulos_fallback(
-                session,
-                query_embedding,
+        Todas las queries se codifican en una sola llamada al modelo y se
+        resuelven con una sola ida a la BD (o un único producto matricial
+        en modo 'indice').
+        
+        Args:
+            queries: Textos de consulta
+            paises: Lista de códigos ISO de países
+            top_k: Número de resultados por query (por país si por_pais)
+            umbral_similitud: Similitud mínima (0-1)
+            por_pais: Top-k independiente para cada país, de modo que un
+                país con normativa extensa no acapare toda la evidencia
+            
+        Returns:
+            Una lista de artículos recuperados por query, en el mismo orden
+        """
+        if not queries:
+            return []
+        
+        query_embeddings = self._codificar_queries(queries)
+        
+        if self.modo_busqueda == 'indice':
+            resultados = self.indice.buscar_lote(
+                query_embeddings,
                 paises,
                 top_k,
-                umbral_similitud
+                umbral_similitud,
+                por_pais=por_pais
             )
+            with get_db_session() as session:
+                return self._hidratar_lote(session, resultados)
+        
+        # Buscar en BD
+        with get_db_session() as session:
+            if self.modo_busqueda == 'pgvector' and self.granularidad == 'fragmento':
+                resultados = self._buscar_lote_pgvector_fragmentos(
+                    session,
+                    query_embeddings,
+                    paises,
+                    top_k,
+                    umbral_similitud,
+                    por_pais
+                )
+            elif self.modo_busqueda == 'pgvector' and self.indices_por_pais:
+                resultados = self._buscar_lote_pgvector_por_pais(
+                    session,
+                    query_embeddings,
+                    paises,
+                    top_k,
+                    umbral_similitud,
+                    por_pais
+                )
+            elif self.modo_busqueda == 'pgvector':
+                resultados = self._buscar_lote_pgvector(
+                    session,
+                    query_embeddings,
+                    paises,
+                    top_k,
+                    umbral_similitud,
+                    por_pais
+                )
+            else:
+                # Búsqueda in-memory (desarrollo)
+                resultados = self._buscar_lote_fallback(
+                    session,
+                    query_embeddings,
+                    paises,
+                    top_k,
+                    umbral_similitud,
+                    por_pais
+                )
             
-            return articulos
+            return self._hidratar_lote(session, resultados)
+    
+    def _codificar_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeddings normalizados de las queries, usando la cache
+        
+        Las queries que no están en cache se codifican juntas en un solo
+        forward pass.
+        """
+        if self.cache is None:
+            return self.modelo.encode(
+                queries,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+        
+        embeddings: List[Optional[np.ndarray]] = [
+            self.cache.obtener(self.modelo_path, query) for query in queries
+        ]
+        pendientes = [i for i, emb in enumerate(embeddings) if emb is None]
+        
+        if pendientes:
+            nuevos = self.modelo.encode(
+                [queries[i] for i in pendientes],
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            for i, emb in zip(pendientes, nuevos):
+                embeddings[i] = emb
+                self.cache.guardar_entrada(self.modelo_path, queries[i], emb)
+            self.cache.persistir()
+        
+        return np.vstack(embeddings)
+    
+    def _busqueda_iterativa(self, session) -> bool:
+        """Si el servidor tiene pgvector >= 0.8 (recorrido iterativo del índice)"""
+        from sqlalchemy import text
+        
+        if self._iterativa is None:
+            self._iterativa = bool(session.execute(text("""
+                SELECT string_to_array(extversion, '.')::int[] >= ARRAY[0, 8]
+                FROM pg_extension WHERE extname = 'vector'
+            """)).scalar())
+        return self._iterativa
     
-    def _buscar_articulos_fallback(
+    def _ajustar_busqueda_ann(self, session, candidatos: int):
+        """SET LOCAL de los parámetros de búsqueda del índice ANN del modelo
+        
+        El índice devuelve ef_search candidatos (40 por defecto) y el filtro
+        de país y vigencia se aplica después, así que un país con poca
+        normativa frente al resto podía quedarse sin resultados. Con
+        pgvector >= 0.8 el recorrido iterativo sigue leyendo el índice hasta
+        completar el LIMIT de cada rama; con versiones anteriores se sube
+        ef_search al menos a `candidatos` (top-k por número de países).
+        
+        Args:
+            candidatos: Filas que el índice debe aportar antes del filtro
+        """
+        from sqlalchemy import text
+        
+        ivfflat = self.almacen['tipo_indice'] == 'ivfflat'
+        
+        if self._busqueda_iterativa(session):
+            # relaxed_order: el orden final lo fija el ORDER BY exterior
+            parametro = 'ivfflat.iterative_scan' if ivfflat else 'hnsw.iterative_scan'
+            session.execute(text(f"SET LOCAL {parametro} = relaxed_order"))
+            ef_search = self.ef_search
+        elif ivfflat:
+            ef_search = self.ef_search
+        else:
+            # hnsw.ef_search admite como máximo 1000
+            ef_search = min(1000, max(self.ef_search or self.EF_SEARCH_DEFAULT, candidatos))
+        
+        if ef_search:
+            parametro = 'ivfflat.probes' if ivfflat else 'hnsw.ef_search'
+            # SET LOCAL no admite parámetros enlazados; se valida como entero
+            session.execute(text(f"SET LOCAL {parametro} = {int(ef_search)}"))
+    
+    def _buscar_lote_pgvector(
         self,
         session,
-        query_embedding: np.ndarray,
+        query_embeddings: np.ndarray,
         paises: List[str],
         top_k: int,
-        umbral: float
+        umbral: float,
+        por_pais: bool = False
+    ) -> List[List[Tuple[int, float]]]:
+        """Búsqueda ANN sobre el índice HNSW de la partición del modelo (producción)
+        
+        Los vectores de las queries se envían como un único parámetro
+        vector[] y se expanden con unnest; cada uno resuelve su top-k en un
+        LATERAL con ORDER BY distancia coseno + LIMIT, lo que permite al
+        planificador usar el índice HNSW. Con por_pais, el LATERAL se
+        ejecuta una vez por (query, país). El umbral se aplica sobre los
+        top-k ya recuperados para no romper el recorrido del índice. País y
+        vigencia se leen de la propia fila (proyección de recuperación), sin
+        joins con artículos, documentos ni países.
+        """
+        from sqlalchemy import text
+        
+        self._ajustar_busqueda_ann(session, top_k * max(1, len(paises)))
+        
+        # Partición del modelo; la expresión coincide con su índice HNSW
+        tabla = self.almacen['tabla']
+        vector_e = f"e.{self.almacen['columna']}::{self.almacen['tipo']}"
+        vector_q = f"q.embedding::{self.almacen['tipo']}"
+        
+        if por_pais:
+            grupos_sql = "CROSS JOIN unnest(CAST(:paises AS text[])) AS g(codigo_iso)"
+            filtro_pais = "e.codigo_pais = g.codigo_iso"
+        else:
+            grupos_sql = ""
+            filtro_pais = "e.codigo_pais = ANY(:paises)"
+        
+        query_sql = text(f"""
+            SELECT q.orden, r.articulo_id, r.similitud
+            FROM unnest(CAST(:query_embeddings AS vector[]))
+                WITH ORDINALITY AS q(embedding, orden)
+            {grupos_sql}
+            CROSS JOIN LATERAL (
+                SELECT
+                    e.articulo_id,
+                    1 - ({vector_e} <=> {vector_q}) AS similitud
+                FROM {tabla} e
+                WHERE
+                    {filtro_pais}
+                    AND e.vigente
+                ORDER BY {vector_e} <=> {vector_q}
+                LIMIT :limite
+            ) r
+            WHERE r.similitud >= :umbral
+            ORDER BY q.orden, r.similitud DESC
+        """)
+        
+        filas = session.execute(query_sql, {
+            'query_embeddings': [_vector_a_texto(v) for v in query_embeddings],
+            'paises': list(paises),
+            'limite': top_k,
+            'umbral': umbral
+        }).all()
+        
+        resultados: List[List[Tuple[int, float]]] = [[] for _ in range(len(query_embeddings))]
+        for orden, articulo_id, similitud in filas:
+            resultados[orden - 1].append((articulo_id, float(similitud)))
+        
+        return resultados
+    
+    def _buscar_lote_pgvector_por_pais(
+        self,
+        session,
+        query_embeddings: np.ndarray,
+        paises: List[str],
+        top_k: int,
+        umbral: float,
+        por_pais: bool = False
+    ) -> List[List[Tuple[int, float]]]:
+        """Búsqueda ANN repartida entre los índices parciales de cada país
+        
+        En lugar de un índice global que debe descartar filas de otros países
+        y derogadas (recorriendo mucho más allá del LIMIT), cada país es una
+        rama con WHERE pais_id = N AND vigente sobre las columnas copiadas
+        en la fila del embedding, que coincide con el predicado de su índice
+        parcial. El pais_id va como literal para que el planificador pueda
+        elegir ese índice. Sin por_pais, las ramas se fusionan por similitud
+        dentro del mismo LATERAL; con por_pais se conserva el top-k de cada
+        rama.
+        """
+        from sqlalchemy import text
+        
+        self._ajustar_busqueda_ann(session, top_k)
+        
+        pendientes = [codigo for codigo in paises if codigo not in self._ids_pais]
+        if pendientes:
+            self._ids_pais.update(
+                session.query(Pais.codigo_iso, Pais.id)
+                .filter(Pais.codigo_iso.in_(pendientes))
+                .all()
+            )
+        ids_pais = sorted({self._ids_pais[codigo] for codigo in paises if codigo in self._ids_pais})
+        if not ids_pais:
+            return [[] for _ in range(len(query_embeddings))]
+        
+        tabla = self.almacen['tabla']
+        vector_e = f"e.{self.almacen['columna']}::{self.almacen['tipo']}"
+        vector_q = f"q.embedding::{self.almacen['tipo']}"
+        
+        ramas = "\n                UNION ALL\n".join(f"""
+                (SELECT
+                    e.articulo_id,
+                    1 - ({vector_e} <=> {vector_q}) AS similitud
+                FROM {tabla} e
+                WHERE e.pais_id = {int(pais_id)} AND e.vigente
+                ORDER BY {vector_e} <=> {vector_q}
+                LIMIT :limite)""" for pais_id in ids_pais)
+        
+        if por_pais:
+            candidatos = ramas
+        else:
+            candidatos = f"""
+                SELECT articulo_id, similitud
+                FROM ({ramas}) u
+                ORDER BY similitud DESC
+                LIMIT :limite"""
+        
+        query_sql = text(f"""
+            SELECT q.orden, r.articulo_id, r.similitud
+            FROM unnest(CAST(:query_embeddings AS vector[]))
+                WITH ORDINALITY AS q(embedding, orden)
+            CROSS JOIN LATERAL ({candidatos}
+            ) r
+            WHERE r.similitud >= :umbral
+            ORDER BY q.orden, r.similitud DESC
+        """)
+        
+        filas = session.execute(query_sql, {
+            'query_embeddings': [_vector_a_texto(v) for v in query_embeddings],
+            'limite': top_k,
+            'umbral': umbral
+        }).all()
+        
+        resultados: List[List[Tuple[int, float]]] = [[] for _ in range(len(query_embeddings))]
+        for orden, articulo_id, similitud in filas:
+            resultados[orden - 1].append((articulo_id, float(similitud)))
+        
+        return resultados
+    
+    def _buscar_lote_pgvector_fragmentos(
+        self,
+        session,
+        query_embeddings: np.ndarray,
+        paises: List[str],
+        top_k: int,
+        umbral: float,
+        por_pais: bool = False
+    ) -> List[List[Tuple[int, float]]]:
+        """Búsqueda ANN sobre los fragmentos del modelo, agregada por artículo
+        
+        Igual que _buscar_lote_pgvector, pero cada LATERAL recupera
+        top_k * FRAGMENTOS_POR_ARTICULO fragmentos; después se agregan por
+        (query, grupo, artículo) con MAX o SUM y se conserva el top-k de cada
+        grupo, todo en la misma consulta. Como en los artículos, país y
+        vigencia salen de la proyección de recuperación del fragmento.
+        """
+        from sqlalchemy import text
+        
+        self._ajustar_busqueda_ann(session, top_k * self.FRAGMENTOS_POR_ARTICULO * max(1, len(paises)))
+        
+        if por_pais:
+            grupos_sql = "CROSS JOIN unnest(CAST(:paises AS text[])) AS g(codigo_iso)"
+            grupo = "g.codigo_iso"
+            filtro_pais = "f.codigo_pais = g.codigo_iso"
+        else:
+            grupos_sql = ""
+            grupo = "NULL::text"
+            filtro_pais = "f.codigo_pais = ANY(:paises)"
+        
+        agregado = "SUM" if self.agregacion == 'sum' else "MAX"
+        
+        tabla = self.almacen['tabla_fragmentos']
+        vector_f = f"f.{self.almacen['columna']}::{self.almacen['tipo']}"
+        vector_q = f"q.embedding::{self.almacen['tipo']}"
+        
+        query_sql = text(f"""
+            WITH fragmentos AS (
+                SELECT q.orden, {grupo} AS grupo, r.articulo_id, r.similitud
+                FROM unnest(CAST(:query_embeddings AS vector[]))
+                    WITH ORDINALITY AS q(embedding, orden)
+                {grupos_sql}
+                CROSS JOIN LATERAL (
+                    SELECT
+                        f.articulo_id,
+                        1 - ({vector_f} <=> {vector_q}) AS similitud
+                    FROM {tabla} f
+                    WHERE
+                        {filtro_pais}
+                        AND f.vigente
+                    ORDER BY {vector_f} <=> {vector_q}
+                    LIMIT :limite_fragmentos
+                ) r
+            ),
+            articulos AS (
+                SELECT
+                    orden, grupo, articulo_id,
+                    {agregado}(similitud) AS similitud,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY orden, grupo
+                        ORDER BY {agregado}(similitud) DESC
+                    ) AS rango
+                FROM fragmentos
+                GROUP BY orden, grupo, articulo_id
+            )
+            SELECT orden, articulo_id, similitud
+            FROM articulos
+            WHERE rango <= :limite AND similitud >= :umbral
+            ORDER BY orden, similitud DESC
+        """)
+        
+        filas = session.execute(query_sql, {
+            'query_embeddings': [_vector_a_texto(v) for v in query_embeddings],
+            'paises': list(paises),
+            'limite': top_k,
+            'limite_fragmentos': top_k * self.FRAGMENTOS_POR_ARTICULO,
+            'umbral': umbral
+        }).all()
+        
+        resultados: List[List[Tuple[int, float]]] = [[] for _ in range(len(query_embeddings))]
+        for orden, articulo_id, similitud in filas:
+            resultados[orden - 1].append((articulo_id, float(similitud)))
+        
+        return resultados
+    
+    def _hidratar_articulos(
+        self,
+        session,
+        resultados: List[Tuple[int, float]]
     ) -> List[ArticuloRecuperado]:
-        """Búsqueda fallback in-memory (desarrollo)"""
+        """Obtener texto y metadatos de los artículos ganadores de una query"""
+        return self._hidratar_lote(session, [resultados])[0]
+    
+    def _hidratar_lote(
+        self,
+        session,
+        resultados_lote: List[List[Tuple[int, float]]]
+    ) -> List[List[ArticuloRecuperado]]:
+        """Obtener texto y metadatos de los artículos ganadores
+        
+        Una sola consulta IN para todos los ids del lote (los artículos
+        compartidos entre queries se leen una vez); se conserva el orden
+        de entrada (ranking por similitud).
+        """
+        ids = {articulo_id for resultados in resultados_lote for articulo_id, _ in resultados}
+        if not ids:
+            return [[] for _ in resultados_lote]
+        
+        filas = session.query(
+            ArticuloNormativo.id,
+            ArticuloNormativo.numero_articulo,
+            ArticuloNormativo.texto_completo,
+            ArticuloNormativo.capitulo,
+            ArticuloNormativo.seccion,
+            DocumentoNormativo.numero_documento,
+            Pais.nombre
+        ).join(
+            DocumentoNormativo, ArticuloNormativo.documento_id == DocumentoNormativo.id
+        ).join(
+            Pais, DocumentoNormativo.pais_id == Pais.id
+        ).filter(
+            ArticuloNormativo.id.in_(ids)
+        ).all()
+        
+        por_id = {fila.id: fila for fila in filas}
+        
+        articulos_lote = []
+        for resultados in resultados_lote:
+            articulos = []
+            for articulo_id, similitud in resultados:
+                fila = por_id.get(articulo_id)
+                if fila is None:
+                    continue  # Borrado después de cargar el índice
+                articulos.append(ArticuloRecuperado(
+                    articulo_id=fila.id,
+                    numero_articulo=fila.numero_articulo,
+                    texto=fila.texto_completo,
+                    pais=fila.nombre,
+                    documento=fila.numero_documento,
+                    similitud=similitud,
+                    capitulo=fila.capitulo,
+                    seccion=fila.seccion
+                ))
+            articulos_lote.append(articulos)
+        
+        return articulos_lote
+    
+    def _buscar_lote_fallback(
+        self,
+        session,
+        query_embeddings: np.ndarray,
+        paises: List[str],
+        top_k: int,
+        umbral: float,
+        por_pais: bool = False
+    ) -> List[List[Tuple[int, float]]]:
+        """Búsqueda fallback in-memory (desarrollo)
+        
+        Recuperación en dos fases: primero se puntúan los candidatos
+        trayendo solo (articulo_id, país, embedding); el texto de los top-k
+        ganadores se hidrata después en _hidratar_lote.
+        """
         from sqlalchemy import and_
         
-        # Obtener todos los embeddings de países objetivo
-        paises_objs = session.query(Pais).filter(Pais.codigo_iso.in_(paises)).all()
-        paises_ids = [p.id for p in paises_objs]
+        fragmentos = self.granularidad == 'fragmento'
+        tabla = EmbeddingFragmento if fragmentos else EmbeddingVectorial
+        columna = getattr(tabla, self.almacen['columna'])
         
-        embeddings = session.query(
-            EmbeddingVectorial, ArticuloNormativo, DocumentoNormativo, Pais
+        # Fase 1: solo ids y vectores de los países objetivo
+        candidatos = session.query(
+            tabla.articulo_id,
+            Pais.codigo_iso,
+            columna.label('embedding')
         ).join(
-            ArticuloNormativo, EmbeddingVectorial.articulo_id == ArticuloNormativo.id
+            ArticuloNormativo, tabla.articulo_id == ArticuloNormativo.id
         ).join(
             DocumentoNormativo, ArticuloNormativo.documento_id == DocumentoNormativo.id
         ).join(
             Pais, DocumentoNormativo.pais_id == Pais.id
         ).filter(
             and_(
-                DocumentoNormativo.pais_id.in_(paises_ids),
+                Pais.codigo_iso.in_(paises),
                 DocumentoNormativo.estado == 'vigente',
-                EmbeddingVectorial.modelo_embedding == self.modelo_path
+                tabla.modelo_embedding == self.modelo_path,
+                columna.isnot(None)
             )
-        ).all()
+        ).order_by(tabla.articulo_id).all()
         
-        # Calcular similitudes
-        resultados = []
-        for emb, art, doc, pais in embeddings:
-            # Convertir embedding de BD a numpy
-            emb_vector = np.array(emb.embedding)
-            
-            # Similitud coseno (vectores ya normalizados)
-            similitud = float(np.dot(query_embedding, emb_vector))
-            
-            if similitud >= umbral:
-                resultados.append(ArticuloRecuperado(
-                    articulo_id=art.id,
-                    numero_articulo=art.numero_articulo,
-                    texto=art.texto_completo,
-                    pais=pais.nombre,
-                    documento=doc.numero_documento,
-                    similitud=similitud,
-                    capitulo=art.capitulo,
-                    seccion=art.seccion
-                ))
+        if not candidatos:
+            return [[] for _ in range(len(query_embeddings))]
         
-        # Ordenar por similitud
-        resultados.sort(key=lambda x: x.similitud, reverse=True)
+        # Similitud coseno (vectores ya normalizados) en una sola operación
+        ids = np.fromiter((c.articulo_id for c in candidatos), dtype=np.int64, count=len(candidatos))
+        matriz = np.vstack([vector_a_numpy(c.embedding) for c in candidatos])
+        scores = matriz @ np.asarray(query_embeddings, dtype=np.float32).T
+        codigos = np.array([c.codigo_iso.strip() for c in candidatos])
         
-        return resultados[:top_k]
+        if fragmentos:
+            inicios = _inicios_por_articulo(ids)
+            scores = _agregar_por_articulo(scores, inicios, self.agregacion)
+            ids = ids[inicios]
+            codigos = codigos[inicios]
+        
+        if por_pais:
+            grupos = [codigos == codigo for codigo in paises]
+        else:
+            grupos = [np.ones(len(ids), dtype=bool)]
+        
+        return _seleccionar_top_k(scores, ids, grupos, top_k, umbral)
 
 
 # ============================================================================
@@ -244,27 +1150,41 @@ class SemanticRetriever:
 class LLMGenerator:
     """Generador de contenido usando LLMs"""
     
-    def __init__(self, modelo: str = 'gpt-4', api_key: Optional[str] = None):
+    def __init__(
+        self,
+        modelo: str = 'gpt-4',
+        api_key: Optional[str] = None,
+        max_en_vuelo: Optional[int] = None,
+        max_reintentos: Optional[int] = None
+    ):
         """Inicializar generador
         
         Args:
-            modelo: 'gpt-4', 'gpt-3.5-turbo', 'gemini-pro'
+            modelo: 'gpt-4', 'gpt-3.5-turbo', 'gemini-pro' o un proveedor
+                registrado en llm_providers (ej. 'mock', 'mock:latencia=0.5')
             api_key: API key (si no está en env)
+            max_en_vuelo: Llamadas simultáneas máximas (None = según proveedor)
+            max_reintentos: Reintentos ante errores reintentables del
+                proveedor (None = LLM_MAX_REINTENTOS)
         """
         self.modelo = modelo
+        self.proveedor = crear_proveedor(modelo)
+        
+        if self.proveedor is not None:
+            self.tipo = self.proveedor.tipo
+            print(f"\n🤖 Usando proveedor {self.tipo}: {modelo}")
         
-        if modelo.startswith('gpt'):
+        elif modelo.startswith('gpt'):
             if not OPENAI_AVAILABLE:
                 raise ImportError("openai no instalado: pip install openai")
             
-            if api_key:
-                openai.api_key = api_key
-            elif os.getenv('OPENAI_API_KEY'):
-                openai.api_key = os.getenv('OPENAI_API_KEY')
-            else:
+            api_key = api_key or os.getenv('OPENAI_API_KEY')
+            if not api_key:
                 raise ValueError("OPENAI_API_KEY no configurada")
             
+            # Cliente openai>=1.0 (ChatCompletion ya no existe)
             self.tipo = 'openai'
+            self.client = OpenAI(api_key=api_key)
             print(f"\n🤖 Usando OpenAI: {modelo}")
             
         elif modelo.startswith('gemini'):
@@ -284,6 +1204,15 @@ class LLMGenerator:
         
         else:
             raise ValueError(f"Modelo no soportado: {modelo}")
+        
+        self.max_en_vuelo = max_en_vuelo or CONCURRENCIA_POR_PROVEEDOR.get(self.tipo, 1)
+        self.max_reintentos = (
+            max_reintentos if max_reintentos is not None
+            else LIMITES_DEFAULT['max_reintentos']
+        )
+        self._semaforo = threading.BoundedSemaphore(self.max_en_vuelo)
+        self._lock_estadisticas = threading.Lock()
+        self.estadisticas = {'llamadas': 0, 'reintentos': 0}
     
     def generar(
         self,
@@ -301,11 +1230,80 @@ class LLMGenerator:
         Returns:
             Texto generado
         """
+        with self._semaforo:
+            return self._con_reintentos(lambda: self._generar(prompt, temperatura, max_tokens))
+    
+    def _con_reintentos(self, llamada: Callable[[], str]) -> str:
+        """Reintentar los ErrorProveedorLLM reintentables (del mock o de los SDK)
+        
+        Mismo backoff exponencial con jitter que AsyncLLMGenerator.
+        """
+        intento = 0
+        while True:
+            self._contar('llamadas')
+            try:
+                return llamada()
+            except ErrorProveedorLLM as error:
+                if not error.reintentable or intento >= self.max_reintentos:
+                    raise
+                espera = AsyncLLMGenerator._calcular_espera(intento, error.retry_after)
+                print(f"   ⏳ {self.tipo}: {error} - reintento {intento + 1}/{self.max_reintentos} en {espera:.1f}s")
+                self._contar('reintentos')
+                intento += 1
+                time.sleep(espera)
+    
+    def _contar(self, clave: str):
+        """Incrementar una estadística (el generador se comparte entre hilos)"""
+        with self._lock_estadisticas:
+            self.estadisticas[clave] += 1
+    
+    @staticmethod
+    def _error_sdk(error: Exception) -> ErrorProveedorLLM:
+        """Traducir una excepción de openai o google-api-core a ErrorProveedorLLM
+        
+        Los errores HTTP se reintentan según CODIGOS_REINTENTABLES (como en
+        AsyncLLMGenerator); los de conexión, timeout y plazo agotado siempre.
+        """
+        estado = None
+        retry_after = None
+        reintentable = True
+        
+        if OPENAI_AVAILABLE and isinstance(error, APIStatusError):
+            estado = error.status_code
+            try:
+                retry_after = float(error.response.headers.get('retry-after'))
+            except (TypeError, ValueError):
+                retry_after = None
+            reintentable = estado in CODIGOS_REINTENTABLES
+        
+        elif GEMINI_AVAILABLE and isinstance(error, GoogleAPICallError):
+            estado = error.code if isinstance(error.code, int) else None
+            reintentable = estado in CODIGOS_REINTENTABLES
+        
+        return ErrorProveedorLLM(
+            f"{type(error).__name__}: {str(error)[:200]}",
+            reintentable=reintentable,
+            retry_after=retry_after,
+            estado=estado
+        )
+    
+    def _generar(self, prompt: str, temperatura: float, max_tokens: int) -> str:
+        """Llamada al proveedor (sin control de concurrencia)"""
+        if self.proveedor is not None:
+            return self.proveedor.generar(prompt, temperatura, max_tokens)
+        
+        try:
+            return self._generar_sdk(prompt, temperatura, max_tokens)
+        except ERRORES_SDK as error:
+            raise self._error_sdk(error) from error
+    
+    def _generar_sdk(self, prompt: str, temperatura: float, max_tokens: int) -> str:
+        """Llamada con el cliente de openai o Gemini"""
         if self.tipo == 'openai':
-            response = openai.ChatCompletion.create(
+            response = self.client.chat.completions.create(
                 model=self.modelo,
                 messages=[
-                    {"role": "system", "content": "Eres un experto en regulación farmacéutica de la región andina."},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=temperatura,
@@ -313,17 +1311,235 @@ class LLMGenerator:
             )
             return response.choices[0].message.content
         
-        elif self.tipo == 'gemini':
-            response = self.client.generate_content(
-                prompt,
-                generation_config={
-                    'temperature': temperatura,
-                    'max_output_tokens': max_tokens
-                }
-            )
-            return response.text
+        elif self.tipo == 'gemini':
+            response = self.client.generate_content(
+                prompt,
+                generation_config={
+                    'temperature': temperatura,
+                    'max_output_tokens': max_tokens
+                }
+            )
+            return response.text
+        
+        return ""
+    
+    def generar_stream(
+        self,
+        prompt: str,
+        temperatura: float = 0.1,
+        max_tokens: int = 2000,
+        al_contenido: Optional[Callable[[str], None]] = None,
+        parar_en_fuentes: bool = True
+    ) -> str:
+        """Generar en streaming con parsing incremental de bloques
+        
+        Args:
+            prompt: Prompt completo
+            temperatura: Creatividad (0.0-1.0)
+            max_tokens: Tokens máximos
+            al_contenido: Callback con el contenido armonizado, en cuanto
+                termina su bloque
+            parar_en_fuentes: Cortar la generación al empezar ### FUENTES
+            
+        Returns:
+            Texto generado (sin FUENTES si se cortó)
+        """
+        def intento() -> str:
+            parser = ParserSeccionesIncremental(al_contenido, parar_en_fuentes)
+            try:
+                return consumir_stream(self._stream(prompt, temperatura, max_tokens), parser)
+            except ErrorProveedorLLM:
+                if parser.contenido is not None:
+                    # El contenido ya se entregó: no se regenera
+                    return parser.respuesta()
+                raise
+        
+        with self._semaforo:
+            return self._con_reintentos(intento)
+    
+    def _stream(self, prompt: str, temperatura: float, max_tokens: int) -> Iterator[str]:
+        """Fragmentos de texto del proveedor"""
+        if self.proveedor is not None:
+            yield from self.proveedor.generar_stream(prompt, temperatura, max_tokens)
+            return
+        
+        try:
+            yield from self._stream_sdk(prompt, temperatura, max_tokens)
+        except ERRORES_SDK as error:
+            raise self._error_sdk(error) from error
+    
+    def _stream_sdk(self, prompt: str, temperatura: float, max_tokens: int) -> Iterator[str]:
+        """Fragmentos de texto del cliente de openai o Gemini"""
+        if self.tipo == 'openai':
+            stream = self.client.chat.completions.create(
+                model=self.modelo,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperatura,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            try:
+                for chunk in stream:
+                    fragmento = chunk.choices[0].delta.content if chunk.choices else None
+                    if fragmento:
+                        yield fragmento
+            finally:
+                # Cortar el stream (parar_en_fuentes) cierra la conexión HTTP
+                stream.close()
+        
+        elif self.tipo == 'gemini':
+            for chunk in self.client.generate_content(
+                prompt,
+                generation_config={
+                    'temperature': temperatura,
+                    'max_output_tokens': max_tokens
+                },
+                stream=True
+            ):
+                if chunk.text:
+                    yield chunk.text
+
+
+# ============================================================================
+# CACHE DE ARMONIZACIONES
+# ============================================================================
+
+class CacheArmonizaciones:
+    """Cache de respuestas LLM direccionada por contenido
+    
+    El prompt de sección no incluye el producto, así que para la misma
+    sección, países, artículos recuperados y configuración del modelo la
+    respuesta es reutilizable en todo el catálogo. La clave es el SHA-256
+    del prompt final más modelo, temperatura y max_tokens; las respuestas
+    se guardan en cache_armonizaciones con una capa LRU acotada en memoria
+    delante (la tabla es la copia completa). Los errores de BD no
+    interrumpen la armonización: la cache se degrada a solo memoria.
+    """
+    
+    def __init__(self, persistente: bool = True, max_entradas: int = 512):
+        """Inicializar cache
+        
+        Args:
+            persistente: Guardar/leer en la tabla cache_armonizaciones
+            max_entradas: Respuestas máximas en memoria
+        """
+        self.persistente = persistente
+        self.max_entradas = max_entradas
+        self._memoria: 'OrderedDict[str, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+    
+    @staticmethod
+    def calcular_clave(
+        prompt: str,
+        modelo: str,
+        temperatura: float,
+        max_tokens: int
+    ) -> str:
+        """Hash SHA-256 del prompt y la configuración del modelo"""
+        contenido = json.dumps({
+            'prompt': prompt,
+            'modelo': modelo,
+            'temperatura': temperatura,
+            'max_tokens': max_tokens
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+    
+    def _recordar(self, clave: str, respuesta: str):
+        """Añadir a memoria (expulsa la menos usada si se supera el límite)"""
+        with self._lock:
+            self._memoria[clave] = respuesta
+            self._memoria.move_to_end(clave)
+            
+            while len(self._memoria) > self.max_entradas:
+                self._memoria.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._memoria)
+    
+    def obtener(self, clave: str) -> Optional[str]:
+        """Respuesta cacheada o None"""
+        with self._lock:
+            respuesta = self._memoria.get(clave)
+            if respuesta is not None:
+                self._memoria.move_to_end(clave)
+        
+        if respuesta is None and self.persistente:
+            try:
+                with get_db_session() as session:
+                    registro = session.query(CacheArmonizacion).filter(
+                        CacheArmonizacion.clave_hash == clave
+                    ).first()
+                    
+                    if registro:
+                        registro.num_usos = (registro.num_usos or 0) + 1
+                        registro.fecha_ultimo_uso = datetime.utcnow()
+                        respuesta = registro.respuesta
+            except Exception as e:
+                print(f"   ⚠ Cache de armonizaciones no disponible: {str(e)}")
+                self.persistente = False
+            
+            if respuesta is not None:
+                self._recordar(clave, respuesta)
+        
+        with self._lock:
+            if respuesta is None:
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+        
+        return respuesta
+    
+    def guardar(
+        self,
+        clave: str,
+        respuesta: str,
+        codigo_seccion: str,
+        modelo: str,
+        temperatura: float,
+        max_tokens: int
+    ):
+        """Guardar respuesta en memoria y (si procede) en BD"""
+        if not respuesta or not respuesta.strip():
+            return
+        
+        self._recordar(clave, respuesta)
         
-        return ""
+        if not self.persistente:
+            return
+        
+        from sqlalchemy.dialects.postgresql import insert
+        
+        try:
+            with get_db_session() as session:
+                session.execute(
+                    insert(CacheArmonizacion).values(
+                        clave_hash=clave,
+                        codigo_seccion=codigo_seccion,
+                        modelo_llm=modelo,
+                        temperatura=temperatura,
+                        max_tokens=max_tokens,
+                        respuesta=respuesta,
+                        num_usos=0
+                    ).on_conflict_do_nothing(index_elements=['clave_hash'])
+                )
+        except Exception as e:
+            print(f"   ⚠ No se pudo persistir la cache de armonizaciones: {str(e)}")
+            self.persistente = False
+    
+    def estadisticas(self) -> Dict:
+        """Contadores de aciertos/fallos"""
+        total = self.aciertos + self.fallos
+        return {
+            'entradas': len(self),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': self.aciertos / total if total else 0.0
+        }
 
 
 # ============================================================================
@@ -352,16 +1568,10 @@ class PromptsArmonizacion:
             Prompt completo
         """
         # Construir contexto de evidencia
-        evidencia = []
-        for i, art in enumerate(articulos_relevantes, 1):
-            evidencia.append(f"""
-[ARTÍCULO {i} - {art.pais}]
-Documento: {art.documento}
-Artículo: {art.numero_articulo}
-Relevancia: {art.similitud:.2%}
-
-{art.texto}
-""")
+        evidencia = [
+            PromptsArmonizacion.bloque_evidencia(i, art)
+            for i, art in enumerate(articulos_relevantes, 1)
+        ]
         
         prompt = f"""
 TAREA: Armonizar la sección "{nombre_seccion}" de una etiqueta farmacéutica para los países: {', '.join(paises)}.
@@ -398,6 +1608,28 @@ NOTA: Sé preciso, profesional y apégate estrictamente a la evidencia normativa
         
         return prompt
     
+    @staticmethod
+    def bloque_evidencia(indice: int, art: ArticuloRecuperado, texto: Optional[str] = None) -> str:
+        """Bloque de evidencia de un artículo dentro de prompt_seccion
+        
+        Args:
+            indice: Posición del artículo en la evidencia
+            art: Artículo recuperado
+            texto: Texto a mostrar (None = art.texto)
+        """
+        otras_fuentes = ''
+        if art.tambien_en:
+            otras_fuentes = f"Mismo texto en: {'; '.join(art.tambien_en)}\n"
+        
+        return f"""
+[ARTÍCULO {indice} - {art.pais}]
+Documento: {art.documento}
+Artículo: {art.numero_articulo}
+{otras_fuentes}Relevancia: {art.similitud:.2%}
+
+{art.texto if texto is None else texto}
+"""
+    
     @staticmethod
     def prompt_analisis_justificativo(
         etiqueta: EtiquetaArmonizada
@@ -456,6 +1688,349 @@ TONO: Técnico, preciso, regulatorio
         return prompt
 
 
+# ============================================================================
+# COMPRESIÓN DE EVIDENCIA
+# ============================================================================
+
+class CompresorEvidencia:
+    """Reduce cada artículo recuperado a sus oraciones más relevantes
+    
+    Se aplica entre SemanticRetriever y prompt_seccion. Las oraciones de
+    todos los artículos (de todas las secciones del lote) se codifican en
+    un único encode y se puntúan contra el embedding de la query de su
+    sección. De cada artículo se conservan las mejores oraciones en su
+    orden original, marcando con [...] los huecos; la cita (documento y
+    numero_articulo) no cambia.
+    """
+    
+    # Fin de oración seguido de mayúscula/dígito, o salto de línea
+    # (sin cortar en abreviaturas habituales de textos normativos)
+    PATRON_ORACION = re.compile(
+        r'(?<!\bArt\.)(?<!\bart\.)(?<!\bNo\.)(?<!\bNº\.)(?<!\bNúm\.)'
+        r'(?<=[.;:!?])\s+(?=[A-ZÁÉÍÓÚÑ¿¡0-9(])|\n+'
+    )
+    
+    def __init__(
+        self,
+        retriever: 'SemanticRetriever',
+        oraciones_por_articulo: int = 3,
+        min_caracteres: int = 25
+    ):
+        """Inicializar compresor
+        
+        Args:
+            retriever: Retriever cuyo modelo (y cache de queries) se reutiliza
+            oraciones_por_articulo: Oraciones a conservar por artículo
+            min_caracteres: Fragmentos más cortos se unen a la oración anterior
+        """
+        self.retriever = retriever
+        self.oraciones_por_articulo = oraciones_por_articulo
+        self.min_caracteres = min_caracteres
+        
+        self._lock = threading.Lock()
+        self.estadisticas = {
+            'articulos_comprimidos': 0,
+            'caracteres_originales': 0,
+            'caracteres_comprimidos': 0
+        }
+    
+    def dividir(self, texto: str) -> List[str]:
+        """Dividir un artículo en oraciones"""
+        oraciones: List[str] = []
+        for fragmento in self.PATRON_ORACION.split(texto):
+            fragmento = fragmento.strip()
+            if not fragmento:
+                continue
+            if oraciones and len(fragmento) < self.min_caracteres:
+                oraciones[-1] = f"{oraciones[-1]} {fragmento}"
+            else:
+                oraciones.append(fragmento)
+        return oraciones
+    
+    def comprimir(self, query: str, articulos: List[ArticuloRecuperado]) -> List[ArticuloRecuperado]:
+        """Comprimir la evidencia de una sección"""
+        return self.comprimir_lote([query], [articulos])[0]
+    
+    def comprimir_lote(
+        self,
+        queries: List[str],
+        articulos_por_query: List[List[ArticuloRecuperado]]
+    ) -> List[List[ArticuloRecuperado]]:
+        """Comprimir la evidencia de varias secciones con un solo encode
+        
+        Args:
+            queries: Query de cada sección
+            articulos_por_query: Artículos recuperados de cada sección
+            
+        Returns:
+            Copias de los artículos con el texto comprimido (mismo orden)
+        """
+        n = self.oraciones_por_articulo
+        
+        # (sección, posición del artículo) -> oraciones
+        divididos: Dict[Tuple[int, int], List[str]] = {}
+        for q, articulos in enumerate(articulos_por_query):
+            for a, art in enumerate(articulos):
+                oraciones = self.dividir(art.texto)
+                if len(oraciones) > n:
+                    divididos[(q, a)] = oraciones
+        
+        if not divididos:
+            return articulos_por_query
+        
+        todas = [oracion for oraciones in divididos.values() for oracion in oraciones]
+        secciones = np.array([
+            q for (q, _), oraciones in divididos.items() for _ in oraciones
+        ])
+        
+        query_embeddings = self.retriever._codificar_queries(queries)
+        oracion_embeddings = self.retriever.modelo.encode(
+            todas,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        scores = np.einsum('ij,ij->i', oracion_embeddings, query_embeddings[secciones])
+        
+        resultado = [list(articulos) for articulos in articulos_por_query]
+        originales = comprimidos = 0
+        inicio = 0
+        
+        for (q, a), oraciones in divididos.items():
+            fin = inicio + len(oraciones)
+            elegidas = sorted(_indices_top_k(scores[inicio:fin], n))
+            inicio = fin
+            
+            partes = []
+            for orden, indice in enumerate(elegidas):
+                if orden == 0 and indice > 0 or orden > 0 and indice != elegidas[orden - 1] + 1:
+                    partes.append("[...]")
+                partes.append(oraciones[indice])
+            if elegidas[-1] < len(oraciones) - 1:
+                partes.append("[...]")
+            
+            art = resultado[q][a]
+            texto = ' '.join(partes)
+            originales += len(art.texto)
+            comprimidos += len(texto)
+            resultado[q][a] = replace(art, texto=texto, tambien_en=list(art.tambien_en))
+        
+        with self._lock:
+            self.estadisticas['articulos_comprimidos'] += len(divididos)
+            self.estadisticas['caracteres_originales'] += originales
+            self.estadisticas['caracteres_comprimidos'] += comprimidos
+        
+        print(f"   ✂ Evidencia comprimida: {len(divididos)} artículos, "
+              f"{originales} → {comprimidos} caracteres ({len(todas)} oraciones puntuadas)")
+        
+        return resultado
+
+
+# ============================================================================
+# EMPAQUETADO DE EVIDENCIA
+# ============================================================================
+
+class EmpaquetadorEvidencia:
+    """Ajusta la evidencia de prompt_seccion a un presupuesto de tokens
+    
+    1. Ordena por relevancia
+    2. Fusiona duplicados exactos (de cualquier país) y casi duplicados del
+       mismo país (Jaccard de 3-gramas de palabras), conservando la cita del
+       descartado en `tambien_en`. Entre países un casi duplicado suele ser
+       justo la diferencia normativa que hay que armonizar
+    3. Con presupuesto, recorre por relevancia: los artículos más relevantes
+       entran completos y los siguientes se truncan al presupuesto restante,
+       reservando un mínimo para cada uno de los que faltan
+    
+    Los tokens se cuentan con el tokenizer del modelo (tiktoken para
+    OpenAI); para otros proveedores se estima a 4 caracteres por token.
+    """
+    
+    def __init__(
+        self,
+        modelo_llm: str,
+        presupuesto_tokens: Optional[int] = None,
+        umbral_casi_duplicado: float = 0.85,
+        min_tokens_articulo: int = 80
+    ):
+        """Inicializar empaquetador
+        
+        Args:
+            modelo_llm: Modelo LLM destino (elige el tokenizer)
+            presupuesto_tokens: Tokens máximos para toda la evidencia
+                (None = solo fusionar duplicados, sin truncar)
+            umbral_casi_duplicado: Jaccard a partir del cual dos textos del
+                mismo país se fusionan
+            min_tokens_articulo: Tokens mínimos de texto para incluir un artículo
+        """
+        self.presupuesto_tokens = presupuesto_tokens
+        self.umbral_casi_duplicado = umbral_casi_duplicado
+        self.min_tokens_articulo = min_tokens_articulo
+        
+        self._codificador = None
+        if TIKTOKEN_AVAILABLE and modelo_llm.startswith('gpt'):
+            try:
+                self._codificador = tiktoken.encoding_for_model(modelo_llm)
+            except KeyError:
+                self._codificador = tiktoken.get_encoding('cl100k_base')
+        
+        self._lock = threading.Lock()
+        self.estadisticas = {
+            'prompts': 0,
+            'tokens_originales': 0,
+            'tokens_empaquetados': 0,
+            'duplicados': 0,
+            'truncados': 0,
+            'descartados': 0
+        }
+    
+    def contar_tokens(self, texto: str) -> int:
+        """Tokens del texto según el tokenizer del modelo"""
+        if self._codificador is not None:
+            return len(self._codificador.encode(texto))
+        return max(1, len(texto) // 4)
+    
+    def truncar(self, texto: str, max_tokens: int) -> str:
+        """Recortar a max_tokens, preferiblemente en fin de oración"""
+        max_tokens -= 3  # Marca " [...]"
+        if self._codificador is not None:
+            tokens = self._codificador.encode(texto)
+            if len(tokens) <= max_tokens:
+                return texto
+            recorte = self._codificador.decode(tokens[:max_tokens])
+        else:
+            if len(texto) <= max_tokens * 4:
+                return texto
+            recorte = texto[:max_tokens * 4]
+        
+        fin_oracion = recorte.rfind('. ')
+        if fin_oracion > len(recorte) * 0.6:
+            recorte = recorte[:fin_oracion + 1]
+        
+        return recorte.rstrip() + " [...]"
+    
+    @staticmethod
+    def _shingles(texto: str) -> set:
+        """3-gramas de palabras normalizadas"""
+        palabras = unicodedata.normalize('NFC', texto).lower().split()
+        return {' '.join(palabras[i:i + 3]) for i in range(max(1, len(palabras) - 2))}
+    
+    def _fusionar_duplicados(self, articulos: List[ArticuloRecuperado]) -> Tuple[List[ArticuloRecuperado], int]:
+        """Fusionar duplicados exactos y casi duplicados del mismo país (gana el más relevante)"""
+        conservados: List[ArticuloRecuperado] = []
+        firmas: List[Tuple[str, set]] = []
+        fusionados = 0
+        
+        for art in articulos:
+            normalizado = ' '.join(unicodedata.normalize('NFC', art.texto).lower().split())
+            shingles = self._shingles(normalizado)
+            
+            destino = None
+            for j, (texto_j, shingles_j) in enumerate(firmas):
+                if normalizado == texto_j:
+                    destino = j
+                    break
+                if art.pais != conservados[j].pais:
+                    continue
+                interseccion = len(shingles & shingles_j)
+                if interseccion and interseccion / len(shingles | shingles_j) >= self.umbral_casi_duplicado:
+                    destino = j
+                    break
+            
+            if destino is None:
+                conservados.append(art)
+                firmas.append((normalizado, shingles))
+            else:
+                conservados[destino].tambien_en.append(
+                    f"{art.pais} - {art.documento} Art. {art.numero_articulo}"
+                )
+                fusionados += 1
+        
+        return conservados, fusionados
+    
+    def empaquetar(self, articulos: List[ArticuloRecuperado]) -> Tuple[List[ArticuloRecuperado], Dict]:
+        """Ajustar los artículos al presupuesto
+        
+        Args:
+            articulos: Artículos recuperados
+            
+        Returns:
+            (artículos para el prompt, informe de tokens)
+        """
+        tokens_originales = sum(
+            self.contar_tokens(PromptsArmonizacion.bloque_evidencia(i, art))
+            for i, art in enumerate(articulos, 1)
+        )
+        
+        # Copias: el recorte no debe alterar articulos_fuente
+        ordenados = [
+            replace(art, tambien_en=list(art.tambien_en))
+            for art in sorted(articulos, key=lambda a: a.similitud, reverse=True)
+        ]
+        unicos, duplicados = self._fusionar_duplicados(ordenados)
+        
+        if self.presupuesto_tokens is None:
+            return self._informar(unicos, tokens_originales, duplicados, 0, 0)
+        
+        empaquetados = []
+        restante = self.presupuesto_tokens
+        truncados = descartados = 0
+        
+        for posicion, art in enumerate(unicos):
+            indice = len(empaquetados) + 1
+            cabecera = self.contar_tokens(PromptsArmonizacion.bloque_evidencia(indice, art, texto=''))
+            # Reserva para los que faltan (cabecera similar + texto mínimo)
+            reserva = (len(unicos) - posicion - 1) * (cabecera + self.min_tokens_articulo)
+            disponible = restante - cabecera - reserva
+            
+            if disponible < self.min_tokens_articulo:
+                # Sin reserva posible: usar lo que quede o descartar
+                disponible = restante - cabecera
+                if disponible < self.min_tokens_articulo:
+                    descartados += 1
+                    continue
+            
+            texto = self.truncar(art.texto, disponible)
+            if texto != art.texto:
+                art.texto = texto
+                truncados += 1
+            
+            restante -= cabecera + self.contar_tokens(texto)
+            empaquetados.append(art)
+        
+        return self._informar(empaquetados, tokens_originales, duplicados, truncados, descartados)
+    
+    def _informar(
+        self,
+        empaquetados: List[ArticuloRecuperado],
+        tokens_originales: int,
+        duplicados: int,
+        truncados: int,
+        descartados: int
+    ) -> Tuple[List[ArticuloRecuperado], Dict]:
+        """Informe de tokens del empaquetado y acumulado en estadisticas"""
+        tokens_empaquetados = sum(
+            self.contar_tokens(PromptsArmonizacion.bloque_evidencia(i, art))
+            for i, art in enumerate(empaquetados, 1)
+        )
+        
+        informe = {
+            'tokens_originales': tokens_originales,
+            'tokens_empaquetados': tokens_empaquetados,
+            'tokens_ahorrados': tokens_originales - tokens_empaquetados,
+            'duplicados': duplicados,
+            'truncados': truncados,
+            'descartados': descartados
+        }
+        
+        with self._lock:
+            self.estadisticas['prompts'] += 1
+            for clave in ('tokens_originales', 'tokens_empaquetados', 'duplicados', 'truncados', 'descartados'):
+                self.estadisticas[clave] += informe[clave]
+        
+        return empaquetados, informe
+
+
 # ============================================================================
 # MOTOR RAG PRINCIPAL
 # ============================================================================
@@ -463,20 +2038,82 @@ TONO: Técnico, preciso, regulatorio
 class RAGEngine:
     """Motor RAG completo para armonización"""
     
+    TEMPERATURA_SECCION = 0.1  # Baja creatividad (adherencia a evidencia)
+    MAX_TOKENS_SECCION = 2000
+    
     def __init__(
         self,
         modelo_embedding: str = 'multilingual-mpnet',
-        modelo_llm: str = 'gpt-4'
+        modelo_llm: str = 'gpt-4',
+        modo_busqueda: str = 'pgvector',
+        ruta_cache_queries: Optional[Path] = None,
+        cache_armonizacion: bool = True,
+        max_concurrencia: Optional[int] = None,
+        llm_async: bool = False,
+        streaming: bool = False,
+        al_contenido: Optional[Callable[[str, str], None]] = None,
+        parar_en_fuentes: bool = True,
+        presupuesto_evidencia: Optional[int] = None,
+        oraciones_por_articulo: Optional[int] = None,
+        granularidad: str = 'articulo',
+        agregacion: str = 'max',
+        indices_por_pais: bool = False,
+        almacenamiento: Optional[str] = None
     ):
         """Inicializar motor RAG
         
         Args:
             modelo_embedding: Modelo para embeddings
             modelo_llm: Modelo LLM para generación
+            modo_busqueda: Modo de recuperación ('pgvector', 'indice' o 'memoria')
+            ruta_cache_queries: Archivo .npz para persistir embeddings de queries
+            cache_armonizacion: Reutilizar respuestas LLM con el mismo prompt
+            max_concurrencia: Secciones armonizadas en paralelo (None = límite
+                del proveedor LLM, 1 = secuencial)
+            llm_async: Usar el cliente asíncrono con rate limiting y reintentos
+            streaming: Generar en streaming, parseando los bloques al vuelo
+            al_contenido: Callback (codigo_seccion, contenido) llamado en
+                cuanto el contenido armonizado de una sección está disponible
+            parar_en_fuentes: En streaming, cortar la generación al llegar a
+                ### FUENTES (se reconstruyen desde articulos_fuente)
+            presupuesto_evidencia: Tokens máximos de evidencia por prompt
+                (None = evidencia completa, sin empaquetar)
+            oraciones_por_articulo: Comprimir cada artículo a sus N oraciones
+                más relevantes para la sección (None = texto completo)
+            granularidad: Unidad de búsqueda ('articulo' o 'fragmento')
+            agregacion: Agregación de fragmentos por artículo ('max' o 'sum')
+            indices_por_pais: Búsqueda pgvector repartida entre los índices
+                HNSW parciales de cada país
+            almacenamiento: Columna de vectores ('vector' o 'halfvec'; None =
+                la del registro por modelo)
         """
-        self.retriever = SemanticRetriever(modelo_embedding)
-        self.generator = LLMGenerator(modelo_llm)
+        self.retriever = SemanticRetriever(
+            modelo_embedding,
+            modo_busqueda=modo_busqueda,
+            ruta_cache_queries=ruta_cache_queries,
+            granularidad=granularidad,
+            agregacion=agregacion,
+            indices_por_pais=indices_por_pais,
+            almacenamiento=almacenamiento
+        )
+        self.llm_async = llm_async
+        if llm_async:
+            self.generator = AsyncLLMGenerator(modelo_llm, max_en_vuelo=max_concurrencia)
+        else:
+            self.generator = LLMGenerator(modelo_llm, max_en_vuelo=max_concurrencia)
         self.prompts = PromptsArmonizacion()
+        self.cache_llm = CacheArmonizaciones() if cache_armonizacion else None
+        self.streaming = streaming
+        self.al_contenido = al_contenido
+        self.parar_en_fuentes = parar_en_fuentes
+        self.empaquetador = (
+            EmpaquetadorEvidencia(modelo_llm, presupuesto_evidencia)
+            if presupuesto_evidencia else None
+        )
+        self.compresor = (
+            CompresorEvidencia(self.retriever, oraciones_por_articulo)
+            if oraciones_por_articulo else None
+        )
         
         print(f"\n✅ Motor RAG inicializado")
     
@@ -486,7 +2123,8 @@ class RAGEngine:
         nombre_seccion: str,
         descripcion: str,
         paises: List[str],
-        top_k: int = 5
+        top_k: int = 5,
+        articulos: Optional[List[ArticuloRecuperado]] = None
     ) -> SeccionArmonizada:
         """Armonizar una sección de etiqueta
         
@@ -495,7 +2133,8 @@ class RAGEngine:
             nombre_seccion: Nombre de la sección
             descripcion: Descripción de la sección
             paises: Códigos ISO de países
-            top_k: Artículos a recuperar
+            top_k: Artículos a recuperar por país
+            articulos: Artículos ya recuperados (None = recuperar aquí)
             
         Returns:
             Sección armonizada
@@ -503,62 +2142,149 @@ class RAGEngine:
         print(f"\n📝 Armonizando: {nombre_seccion}")
         
         # 1. RECUPERACIÓN (Retrieval)
-        print(f"   🔍 Recuperando artículos relevantes...")
-        query = f"{nombre_seccion}: {descripcion}"
-        
-        articulos = self.retriever.buscar_articulos_relevantes(
-            query=query,
-            paises=paises,
-            top_k=top_k * len(paises)  # Más artículos para multi-país
-        )
+        if articulos is None:
+            print(f"   🔍 Recuperando artículos relevantes...")
+            query = self._query_seccion(nombre_seccion, descripcion)
+            articulos = self.retriever.buscar_articulos_relevantes(
+                query=query,
+                paises=paises,
+                top_k=top_k,
+                por_pais=True  # Top-k por país: evidencia equilibrada
+            )
+            
+            if self.compresor is not None:
+                articulos = self.compresor.comprimir(query, articulos)
         
         print(f"   ✓ {len(articulos)} artículos recuperados")
         
         if not articulos:
-            print(f"   ⚠ No se encontraron artículos relevantes")
-            return SeccionArmonizada(
-                codigo_seccion=codigo_seccion,
-                nombre_seccion=nombre_seccion,
-                contenido_armonizado="[Insuficiente evidencia normativa]",
-                articulos_fuente=[],
-                justificacion="No se encontraron artículos relevantes en la base de datos.",
-                criterio_aplicado="N/A"
-            )
+            return self._seccion_sin_evidencia(codigo_seccion, nombre_seccion)
         
         # 2. GENERACIÓN (Augmented Generation)
         print(f"   🤖 Generando contenido armonizado...")
-        prompt = self.prompts.prompt_seccion(
+        prompt = self._construir_prompt(nombre_seccion, descripcion, articulos, paises)
+        
+        respuesta = self._generar_con_cache(prompt, codigo_seccion)
+        
+        # 3. PARSING de respuesta
+        return self._construir_seccion(
+            codigo_seccion, nombre_seccion, articulos, respuesta, top_k
+        )
+    
+    async def armonizar_seccion_async(
+        self,
+        codigo_seccion: str,
+        nombre_seccion: str,
+        descripcion: str,
+        paises: List[str],
+        articulos: List[ArticuloRecuperado],
+        top_k: int = 5
+    ) -> SeccionArmonizada:
+        """Armonizar una sección con el generador asíncrono
+        
+        La evidencia debe venir ya recuperada (ver armonizar_etiqueta_completa).
+        
+        Args:
+            codigo_seccion: Código de la sección
+            nombre_seccion: Nombre de la sección
+            descripcion: Descripción de la sección
+            paises: Códigos ISO de países
+            articulos: Artículos recuperados
+            top_k: Artículos por país guardados como fuente
+            
+        Returns:
+            Sección armonizada
+        """
+        print(f"\n📝 Armonizando: {nombre_seccion} ({len(articulos)} artículos)")
+        
+        if not articulos:
+            return self._seccion_sin_evidencia(codigo_seccion, nombre_seccion)
+        
+        prompt = self._construir_prompt(nombre_seccion, descripcion, articulos, paises)
+        
+        respuesta = await self._generar_con_cache_async(prompt, codigo_seccion)
+        
+        return self._construir_seccion(
+            codigo_seccion, nombre_seccion, articulos, respuesta, top_k
+        )
+    
+    def _construir_prompt(
+        self,
+        nombre_seccion: str,
+        descripcion: str,
+        articulos: List[ArticuloRecuperado],
+        paises: List[str]
+    ) -> str:
+        """Prompt de sección con la evidencia ajustada al presupuesto"""
+        if self.empaquetador is not None:
+            articulos, informe = self.empaquetador.empaquetar(articulos)
+            print(f"   📦 Evidencia: {informe['tokens_originales']} → "
+                  f"{informe['tokens_empaquetados']} tokens "
+                  f"({informe['duplicados']} duplicados, {informe['truncados']} truncados, "
+                  f"{informe['descartados']} descartados)")
+        
+        return self.prompts.prompt_seccion(
             nombre_seccion=nombre_seccion,
             descripcion_seccion=descripcion,
             articulos_relevantes=articulos,
             paises=paises
         )
-        
-        respuesta = self.generator.generar(
-            prompt=prompt,
-            temperatura=0.1,  # Baja creatividad (adherencia a evidencia)
-            max_tokens=2000
+    
+    def _seccion_sin_evidencia(self, codigo_seccion: str, nombre_seccion: str) -> SeccionArmonizada:
+        """Sección vacía cuando la recuperación no devuelve artículos"""
+        print(f"   ⚠ No se encontraron artículos relevantes")
+        return SeccionArmonizada(
+            codigo_seccion=codigo_seccion,
+            nombre_seccion=nombre_seccion,
+            contenido_armonizado="[Insuficiente evidencia normativa]",
+            articulos_fuente=[],
+            justificacion="No se encontraron artículos relevantes en la base de datos.",
+            criterio_aplicado="N/A"
         )
-        
-        # 3. PARSING de respuesta
+    
+    def _construir_seccion(
+        self,
+        codigo_seccion: str,
+        nombre_seccion: str,
+        articulos: List[ArticuloRecuperado],
+        respuesta: str,
+        top_k: int
+    ) -> SeccionArmonizada:
+        """Parsear la respuesta del LLM y construir la sección"""
         contenido, justificacion = self._parsear_respuesta(respuesta)
         
-        print(f"   ✓ Contenido generado ({len(contenido)} caracteres)")
+        print(f"   ✓ {nombre_seccion}: contenido generado ({len(contenido)} caracteres)")
         
         return SeccionArmonizada(
             codigo_seccion=codigo_seccion,
             nombre_seccion=nombre_seccion,
             contenido_armonizado=contenido,
-            articulos_fuente=articulos[:top_k],  # Top K para metadata
+            articulos_fuente=self._fuentes_por_pais(articulos, top_k),
             justificacion=justificacion,
             criterio_aplicado="máxima restrictividad"
         )
     
+    @staticmethod
+    def _fuentes_por_pais(articulos: List[ArticuloRecuperado], top_k: int) -> List[ArticuloRecuperado]:
+        """Hasta top_k artículos de cada país, en el orden de recuperación
+        
+        La lista llega ordenada por similitud global; cortarla a top_k
+        dejaría fuera países enteros de las fuentes.
+        """
+        por_pais: Dict[str, int] = {}
+        fuentes = []
+        for articulo in articulos:
+            if por_pais.get(articulo.pais, 0) < top_k:
+                por_pais[articulo.pais] = por_pais.get(articulo.pais, 0) + 1
+                fuentes.append(articulo)
+        return fuentes
+    
     def armonizar_etiqueta_completa(
         self,
         nombre_producto: str,
         paises: List[str],
-        secciones: Optional[List[str]] = None
+        secciones: Optional[List[str]] = None,
+        top_k: int = 5
     ) -> EtiquetaArmonizada:
         """Armonizar etiqueta completa
         
@@ -566,6 +2292,7 @@ class RAGEngine:
             nombre_producto: Nombre del producto
             paises: Códigos ISO de países
             secciones: Códigos de secciones (None = todas)
+            top_k: Artículos a recuperar por sección y país
             
         Returns:
             Etiqueta armonizada completa
@@ -584,18 +2311,58 @@ class RAGEngine:
             if secciones:
                 query = query.filter(SeccionEtiqueta.codigo.in_(secciones))
             
-            secciones_db = query.order_by(SeccionEtiqueta.orden_visualizacion).all()
+            # Copiar campos antes de cerrar la sesión (commit expira las instancias)
+            secciones_db = [
+                (seccion.codigo, seccion.nombre_seccion, seccion.descripcion or "")
+                for seccion in query.order_by(SeccionEtiqueta.orden_visualizacion).all()
+            ]
+        
+        # Recuperar evidencia de todas las secciones en un solo lote
+        print(f"\n🔍 Recuperando artículos relevantes ({len(secciones_db)} secciones)...")
+        queries = [
+            self._query_seccion(nombre_seccion, descripcion)
+            for _, nombre_seccion, descripcion in secciones_db
+        ]
+        articulos_por_seccion = self.retriever.buscar_articulos_relevantes_lote(
+            queries=queries,
+            paises=paises,
+            top_k=top_k,
+            por_pais=True  # Top-k por país: evidencia equilibrada
+        )
+        
+        if self.compresor is not None:
+            articulos_por_seccion = self.compresor.comprimir_lote(queries, articulos_por_seccion)
+        
+        # Armonizar cada sección (las llamadas LLM son independientes entre sí)
+        def armonizar(trabajo) -> SeccionArmonizada:
+            (codigo, nombre_seccion, descripcion), articulos = trabajo
+            return self.armonizar_seccion(
+                codigo_seccion=codigo,
+                nombre_seccion=nombre_seccion,
+                descripcion=descripcion,
+                paises=paises,
+                top_k=top_k,
+                articulos=articulos
+            )
         
-        # Armonizar cada sección
-        secciones_armonizadas = []
-        for seccion_db in secciones_db:
-            seccion_arm = self.armonizar_seccion(
-                codigo_seccion=seccion_db.codigo,
-                nombre_seccion=seccion_db.nombre_seccion,
-                descripcion=seccion_db.descripcion or "",
-                paises=paises
+        trabajos = list(zip(secciones_db, articulos_por_seccion))
+        num_hilos = min(self.generator.max_en_vuelo, len(trabajos))
+        
+        if self.llm_async:
+            print(f"\n⚡ Armonizando {len(trabajos)} secciones (async, {num_hilos} en vuelo)")
+            secciones_armonizadas = asyncio.run(
+                self._armonizar_trabajos_async(trabajos, paises, top_k)
             )
-            secciones_armonizadas.append(seccion_arm)
+        elif num_hilos <= 1:
+            secciones_armonizadas = [armonizar(trabajo) for trabajo in trabajos]
+        else:
+            print(f"\n⚡ Armonizando {len(trabajos)} secciones ({num_hilos} en paralelo)")
+            with ThreadPoolExecutor(
+                max_workers=num_hilos,
+                thread_name_prefix='armonizacion'
+            ) as pool:
+                # map conserva el orden de las secciones
+                secciones_armonizadas = list(pool.map(armonizar, trabajos))
         
         # Crear etiqueta completa
         etiqueta = EtiquetaArmonizada(
@@ -605,8 +2372,22 @@ class RAGEngine:
             fecha_generacion=datetime.now(),
             metadata={
                 'modelo_embedding': self.retriever.modelo_path,
+                'granularidad': self.retriever.granularidad,
                 'modelo_llm': self.generator.modelo,
-                'num_secciones': len(secciones_armonizadas)
+                'num_secciones': len(secciones_armonizadas),
+                'cache_queries': (
+                    self.retriever.cache.estadisticas() if self.retriever.cache else None
+                ),
+                'cache_armonizacion': (
+                    self.cache_llm.estadisticas() if self.cache_llm else None
+                ),
+                'llm': getattr(self.generator, 'estadisticas', None),
+                'evidencia': (
+                    dict(self.empaquetador.estadisticas) if self.empaquetador else None
+                ),
+                'compresion': (
+                    dict(self.compresor.estadisticas) if self.compresor else None
+                )
             }
         )
         
@@ -614,6 +2395,134 @@ class RAGEngine:
         
         return etiqueta
     
+    async def _armonizar_trabajos_async(
+        self,
+        trabajos: List[Tuple[Tuple[str, str, str], List[ArticuloRecuperado]]],
+        paises: List[str],
+        top_k: int
+    ) -> List[SeccionArmonizada]:
+        """Armonizar todas las secciones en un event loop (orden conservado)"""
+        semaforo = asyncio.Semaphore(self.generator.max_en_vuelo)
+        
+        async def armonizar(trabajo) -> SeccionArmonizada:
+            (codigo, nombre_seccion, descripcion), articulos = trabajo
+            async with semaforo:
+                return await self.armonizar_seccion_async(
+                    codigo_seccion=codigo,
+                    nombre_seccion=nombre_seccion,
+                    descripcion=descripcion,
+                    paises=paises,
+                    articulos=articulos,
+                    top_k=top_k
+                )
+        
+        async with self.generator:
+            return list(await asyncio.gather(*(armonizar(t) for t in trabajos)))
+    
+    def _generar_con_cache(self, prompt: str, codigo_seccion: str) -> str:
+        """Generar con el LLM, reutilizando respuestas para prompts idénticos"""
+        temperatura = self.TEMPERATURA_SECCION
+        max_tokens = self.MAX_TOKENS_SECCION
+        
+        if self.cache_llm is None:
+            return self._llamar_llm(prompt, codigo_seccion)
+        
+        clave = CacheArmonizaciones.calcular_clave(
+            prompt, self.generator.modelo, temperatura, max_tokens
+        )
+        
+        respuesta = self.cache_llm.obtener(clave)
+        if respuesta is not None:
+            print(f"   ♻ Respuesta reutilizada de cache")
+            self._entregar_contenido(codigo_seccion, self._parsear_respuesta(respuesta)[0])
+            return respuesta
+        
+        respuesta = self._llamar_llm(prompt, codigo_seccion)
+        self.cache_llm.guardar(
+            clave, respuesta, codigo_seccion,
+            self.generator.modelo, temperatura, max_tokens
+        )
+        
+        return respuesta
+    
+    async def _generar_con_cache_async(self, prompt: str, codigo_seccion: str) -> str:
+        """Versión asíncrona de _generar_con_cache (la cache se consulta en un hilo)"""
+        temperatura = self.TEMPERATURA_SECCION
+        max_tokens = self.MAX_TOKENS_SECCION
+        
+        if self.cache_llm is None:
+            return await self._llamar_llm_async(prompt, codigo_seccion)
+        
+        clave = CacheArmonizaciones.calcular_clave(
+            prompt, self.generator.modelo, temperatura, max_tokens
+        )
+        
+        respuesta = await asyncio.to_thread(self.cache_llm.obtener, clave)
+        if respuesta is not None:
+            print(f"   ♻ Respuesta reutilizada de cache")
+            self._entregar_contenido(codigo_seccion, self._parsear_respuesta(respuesta)[0])
+            return respuesta
+        
+        respuesta = await self._llamar_llm_async(prompt, codigo_seccion)
+        await asyncio.to_thread(
+            self.cache_llm.guardar,
+            clave, respuesta, codigo_seccion,
+            self.generator.modelo, temperatura, max_tokens
+        )
+        
+        return respuesta
+    
+    def _llamar_llm(self, prompt: str, codigo_seccion: str) -> str:
+        """Una generación (streaming o completa) con entrega del contenido"""
+        if not self.streaming:
+            respuesta = self.generator.generar(
+                prompt=prompt,
+                temperatura=self.TEMPERATURA_SECCION,
+                max_tokens=self.MAX_TOKENS_SECCION
+            )
+            self._entregar_contenido(codigo_seccion, self._parsear_respuesta(respuesta)[0])
+            return respuesta
+        
+        return self.generator.generar_stream(
+            prompt=prompt,
+            temperatura=self.TEMPERATURA_SECCION,
+            max_tokens=self.MAX_TOKENS_SECCION,
+            al_contenido=lambda contenido: self._entregar_contenido(codigo_seccion, contenido),
+            parar_en_fuentes=self.parar_en_fuentes
+        )
+    
+    async def _llamar_llm_async(self, prompt: str, codigo_seccion: str) -> str:
+        """Versión asíncrona de _llamar_llm"""
+        if not self.streaming:
+            respuesta = await self.generator.generar(
+                prompt=prompt,
+                temperatura=self.TEMPERATURA_SECCION,
+                max_tokens=self.MAX_TOKENS_SECCION
+            )
+            self._entregar_contenido(codigo_seccion, self._parsear_respuesta(respuesta)[0])
+            return respuesta
+        
+        return await self.generator.generar_stream(
+            prompt=prompt,
+            temperatura=self.TEMPERATURA_SECCION,
+            max_tokens=self.MAX_TOKENS_SECCION,
+            al_contenido=lambda contenido: self._entregar_contenido(codigo_seccion, contenido),
+            parar_en_fuentes=self.parar_en_fuentes
+        )
+    
+    def _entregar_contenido(self, codigo_seccion: str, contenido: str):
+        """Notificar que el contenido armonizado de una sección está listo"""
+        if self.streaming:
+            print(f"   📨 {codigo_seccion}: contenido disponible ({len(contenido)} caracteres)")
+        
+        if self.al_contenido is not None:
+            self.al_contenido(codigo_seccion, contenido)
+    
+    @staticmethod
+    def _query_seccion(nombre_seccion: str, descripcion: str) -> str:
+        """Texto de consulta de retrieval para una sección"""
+        return f"{nombre_seccion}: {descripcion}"
+    
     def _parsear_respuesta(self, respuesta: str) -> Tuple[str, str]:
         """Parsear respuesta del LLM"""
         # Separar contenido y justificación
@@ -657,7 +2566,34 @@ def main():
     parser.add_argument(
         '--modelo-llm',
         default='gpt-4',
-        help='Modelo LLM (gpt-4, gpt-3.5-turbo, gemini-pro)'
+        help='Modelo LLM (gpt-4, gpt-3.5-turbo, gemini-pro, mock[:latencia=..,error=..,tps=..])'
+    )
+    parser.add_argument(
+        '--modo-busqueda',
+        default='pgvector',
+        choices=list(SemanticRetriever.MODOS_BUSQUEDA),
+        help='Modo de recuperación (pgvector = índice HNSW, indice = matriz en memoria, memoria = desarrollo)'
+    )
+    parser.add_argument(
+        '--granularidad',
+        default='articulo',
+        choices=list(SemanticRetriever.GRANULARIDADES),
+        help='Buscar por artículo completo o por fragmentos (embeddings_fragmentos)'
+    )
+    parser.add_argument(
+        '--indices-por-pais',
+        action='store_true',
+        help='Buscar en los índices HNSW parciales de cada país y fusionar'
+    )
+    parser.add_argument(
+        '--almacenamiento',
+        choices=['vector', 'halfvec'],
+        help='Columna de vectores a consultar (default: la del registro por modelo)'
+    )
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='Generar en streaming (contenido disponible antes, sin bloque FUENTES)'
     )
     
     args = parser.parse_args()
@@ -673,7 +2609,14 @@ def main():
         
         try:
             # Crear motor
-            engine = RAGEngine(modelo_llm=args.modelo_llm)
+            engine = RAGEngine(
+                modelo_llm=args.modelo_llm,
+                modo_busqueda=args.modo_busqueda,
+                streaming=args.streaming,
+                granularidad=args.granularidad,
+                indices_por_pais=args.indices_por_pais,
+                almacenamiento=args.almacenamiento
+            )
             
             # Test de armonización de una sección
             paises = args.paises.split(',')
@@ -0,0 +1,128 @@
+"""
+AALabelPP - Configuración de pytest
+Los módulos de scripts/ se importan por nombre, igual que al ejecutarlos.
+
+Los tests de PostgreSQL + pgvector solo se ejecutan con DB_TEST_NAME
+definido (la conexión usa DB_HOST, DB_PORT, DB_USER y DB_PASSWORD); esa
+base se borra y se recrea desde database/schema.sql.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).parent.parent
+sys.path.insert(0, str(RAIZ / 'scripts'))
+sys.path.insert(0, str(RAIZ))
+
+
+TABLAS_DATOS = (
+    'documentos_normativos', 'articulos_normativos',
+    'embeddings_vectoriales', 'embeddings_fragmentos', 'cache_armonizaciones'
+)
+
+
+def vector_texto(vector) -> str:
+    return '[' + ','.join(f'{float(x):.6f}' for x in vector) + ']'
+
+
+@pytest.fixture(scope='session')
+def bd_esquema():
+    """Motor sobre una base recién creada con schema.sql"""
+    nombre = os.getenv('DB_TEST_NAME')
+    if not nombre:
+        pytest.skip("DB_TEST_NAME no definido: se omiten los tests de PostgreSQL")
+
+    from sqlalchemy import create_engine, text
+    from database.db_config import DatabaseConfig, DatabaseEngine
+
+    config = dict(DatabaseConfig.DEFAULT_CONFIG, database=nombre)
+    admin = create_engine(
+        DatabaseConfig.get_connection_string(dict(config, database='postgres')),
+        isolation_level='AUTOCOMMIT'
+    )
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{nombre}"'))
+        conn.execute(text(f'CREATE DATABASE "{nombre}"'))
+    admin.dispose()
+
+    DatabaseEngine.close()
+    engine = DatabaseEngine.initialize(config)
+
+    # Cursor DBAPI sin parámetros: el script contiene % (format) y $$
+    conexion = engine.raw_connection()
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute((RAIZ / 'database' / 'schema.sql').read_text(encoding='utf-8'))
+        conexion.commit()
+    finally:
+        conexion.close()
+
+    yield engine
+    DatabaseEngine.close()
+
+
+@pytest.fixture
+def bd(bd_esquema):
+    """Motor de la base de tests; los datos se vacían al terminar"""
+    from sqlalchemy import text
+
+    yield bd_esquema
+    with bd_esquema.begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(TABLAS_DATOS)} RESTART IDENTITY CASCADE"))
+
+
+@pytest.fixture
+def insertar_articulos(bd):
+    """Insertar un documento con artículos y sus embeddings (proyección incluida)
+
+    Devuelve una función (pais, vectores, estado, modelo) -> ids de artículo
+    """
+    from sqlalchemy import text
+
+    documentos = []
+
+    def insertar(
+        pais,
+        vectores,
+        estado='vigente',
+        modelo='sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+    ):
+        documentos.append(pais)
+        numero = f"{pais}-{len(documentos)}"
+        with bd.begin() as conn:
+            documento_id = conn.execute(text("""
+                INSERT INTO documentos_normativos (pais_id, tipo_documento, numero_documento, titulo, estado)
+                SELECT id, 'Decreto', :numero, 'Documento de prueba', :estado
+                FROM paises WHERE codigo_iso = :pais
+                RETURNING id
+            """), {'numero': numero, 'estado': estado, 'pais': pais}).scalar()
+
+            ids = conn.execute(text("""
+                INSERT INTO articulos_normativos (documento_id, numero_articulo, texto_completo)
+                SELECT :documento_id, 'Art. ' || n, 'Texto del artículo ' || n
+                FROM generate_series(1, :total) AS n
+                ORDER BY n
+                RETURNING id
+            """), {'documento_id': documento_id, 'total': len(vectores)}).scalars().all()
+
+            conn.execute(text("""
+                INSERT INTO embeddings_vectoriales (
+                    articulo_id, modelo_embedding, dimension_vector, embedding,
+                    pais_id, codigo_pais, estado, vigente, numero_documento, numero_articulo
+                )
+                SELECT v.articulo_id, :modelo, vector_dims(v.embedding), v.embedding,
+                       p.id, p.codigo_iso, :estado, :estado = 'vigente', :numero, a.numero_articulo
+                FROM unnest(CAST(:ids AS integer[]), CAST(:vectores AS vector[]))
+                    AS v(articulo_id, embedding)
+                JOIN articulos_normativos a ON a.id = v.articulo_id
+                JOIN paises p ON p.codigo_iso = :pais
+            """), {
+                'ids': list(ids), 'vectores': [vector_texto(v) for v in vectores],
+                'modelo': modelo, 'estado': estado, 'numero': numero, 'pais': pais
+            })
+        return list(ids)
+
+    return insertar
@@ -0,0 +1,208 @@
+"""
+AALabelPP - Tests de la gestión de índices ANN y de los almacenes de embeddings
+Construcción de índices contra una conexión falsa (sin PostgreSQL) y
+migración al particionado por modelo (con DB_TEST_NAME)
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+from sqlalchemy import text
+
+from conftest import vector_texto
+from database.db_config import _construir_indice_ann, crear_almacenes_embedding
+
+
+class ConexionFalsa:
+    """Registra las sentencias; pg_index responde con el estado indicado"""
+    
+    def __init__(self, indisvalid):
+        self.indisvalid = indisvalid
+        self.sentencias = []
+    
+    def execute(self, sentencia, parametros=None):
+        self.sentencias.append(str(sentencia).strip())
+        return SimpleNamespace(scalar=lambda: self.indisvalid)
+
+
+SQL = "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_prueba_hnsw ON t USING hnsw (e)"
+
+
+def test_indice_valido_existente_se_omite():
+    conn = ConexionFalsa(indisvalid=True)
+    
+    assert _construir_indice_ann(conn, None, 1, 'idx_prueba_hnsw', SQL, 10, 't') is None
+    assert SQL not in conn.sentencias
+
+
+def test_indice_invalido_se_rehace():
+    conn = ConexionFalsa(indisvalid=False)
+    
+    segundos = _construir_indice_ann(conn, None, 1, 'idx_prueba_hnsw', SQL, 10, 't')
+    
+    assert segundos >= 0
+    assert conn.sentencias[1:] == [
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_prueba_hnsw", SQL
+    ]
+
+
+def test_indice_nuevo_se_construye():
+    conn = ConexionFalsa(indisvalid=None)
+    
+    assert _construir_indice_ann(conn, None, 1, 'idx_prueba_hnsw', SQL, 10, 't') >= 0
+    assert conn.sentencias[-1] == SQL
+
+
+# ============================================================================
+# MIGRACIÓN A TABLAS PARTICIONADAS (POSTGRESQL)
+# ============================================================================
+
+MPNET = 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+MINILM = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+
+
+def crear_tablas_sin_particionar(conn):
+    """Tablas de embeddings como las creaba schema.sql antes del particionado"""
+    conn.execute(text("DROP TABLE embeddings_vectoriales, embeddings_fragmentos"))
+    conn.execute(text("""
+        CREATE TABLE embeddings_vectoriales (
+            id SERIAL PRIMARY KEY,
+            articulo_id INTEGER REFERENCES articulos_normativos(id) ON DELETE CASCADE,
+            modelo_embedding VARCHAR(100) NOT NULL,
+            dimension_vector INTEGER NOT NULL,
+            embedding vector,
+            hash_contenido CHAR(64),
+            fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version_modelo VARCHAR(50),
+            confianza_embedding FLOAT,
+            UNIQUE(articulo_id, modelo_embedding)
+        )
+    """))
+    conn.execute(text("CREATE INDEX idx_embeddings_articulo ON embeddings_vectoriales(articulo_id)"))
+    conn.execute(text("""
+        CREATE TABLE embeddings_fragmentos (
+            id SERIAL PRIMARY KEY,
+            articulo_id INTEGER REFERENCES articulos_normativos(id) ON DELETE CASCADE,
+            modelo_embedding VARCHAR(100) NOT NULL,
+            dimension_vector INTEGER NOT NULL,
+            posicion INTEGER NOT NULL,
+            offset_inicio INTEGER NOT NULL,
+            offset_fin INTEGER NOT NULL,
+            num_tokens INTEGER,
+            embedding vector,
+            fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(articulo_id, modelo_embedding, posicion)
+        )
+    """))
+    conn.execute(text("CREATE INDEX idx_fragmentos_articulo ON embeddings_fragmentos(articulo_id)"))
+    
+    articulo_id = conn.execute(text("""
+        WITH d AS (
+            INSERT INTO documentos_normativos (pais_id, tipo_documento, numero_documento, titulo)
+            SELECT id, 'Decreto', 'CO-1', 'Documento de prueba' FROM paises WHERE codigo_iso = 'CO'
+            RETURNING id
+        )
+        INSERT INTO articulos_normativos (documento_id, numero_articulo, texto_completo)
+        SELECT id, 'Art. 1', 'Texto del artículo' FROM d
+        RETURNING id
+    """)).scalar()
+    
+    generador = np.random.default_rng(0)
+    for modelo, dimension in ((MPNET, 768), (MINILM, 384)):
+        conn.execute(text("""
+            INSERT INTO embeddings_vectoriales (articulo_id, modelo_embedding, dimension_vector, embedding)
+            VALUES (:articulo_id, :modelo, :dimension, CAST(:embedding AS vector))
+        """), {
+            'articulo_id': articulo_id, 'modelo': modelo, 'dimension': dimension,
+            'embedding': vector_texto(generador.normal(size=dimension))
+        })
+    conn.execute(text("""
+        INSERT INTO embeddings_fragmentos (
+            articulo_id, modelo_embedding, dimension_vector, posicion, offset_inicio, offset_fin, embedding
+        )
+        VALUES (:articulo_id, :modelo, 768, 0, 0, 18, CAST(:embedding AS vector))
+    """), {'articulo_id': articulo_id, 'modelo': MPNET, 'embedding': vector_texto(generador.normal(size=768))})
+    return articulo_id
+
+
+def test_migra_tablas_sin_particionar(bd):
+    with bd.begin() as conn:
+        articulo_id = crear_tablas_sin_particionar(conn)
+    
+    assert crear_almacenes_embedding(bd)
+    
+    with bd.connect() as conn:
+        tipos = dict(conn.execute(text("""
+            SELECT relname, relkind FROM pg_class
+            WHERE relname IN ('embeddings_vectoriales', 'embeddings_fragmentos',
+                              'embeddings_vectoriales_legado', 'embeddings_fragmentos_legado')
+        """)).all())
+        assert tipos == {'embeddings_vectoriales': 'p', 'embeddings_fragmentos': 'p'}
+        
+        filas = conn.execute(text("""
+            SELECT tableoid::regclass::text, id, articulo_id FROM embeddings_vectoriales ORDER BY id
+        """)).all()
+        assert [tuple(fila) for fila in filas] == [
+            ('embeddings_vectoriales_mpnet', 1, articulo_id),
+            ('embeddings_vectoriales_minilm', 2, articulo_id)
+        ]
+        assert conn.execute(text(
+            "SELECT tableoid::regclass::text FROM embeddings_fragmentos"
+        )).scalar() == 'embeddings_fragmentos_mpnet'
+        
+        # La proyección de recuperación se rellena para las filas migradas
+        proyecciones = conn.execute(text("""
+            SELECT codigo_pais, vigente, numero_documento FROM embeddings_vectoriales
+            UNION ALL
+            SELECT codigo_pais, vigente, numero_documento FROM embeddings_fragmentos
+        """)).all()
+        assert [tuple(fila) for fila in proyecciones] == [('CO', True, 'CO-1')] * 3
+        
+        indices = conn.execute(text("""
+            SELECT indexrelid::regclass::text FROM pg_index
+            WHERE indrelid = 'embeddings_vectoriales_mpnet'::regclass
+        """)).scalars().all()
+        assert 'idx_embeddings_mpnet_hnsw' in indices
+        
+        # La secuencia continúa tras los id copiados
+        assert conn.execute(text(
+            "SELECT nextval(pg_get_serial_sequence('embeddings_vectoriales', 'id'))"
+        )).scalar() == 3
+
+
+def test_migracion_con_modelos_sin_particion_no_cambia_nada(bd):
+    with bd.begin() as conn:
+        crear_tablas_sin_particionar(conn)
+        conn.execute(text("UPDATE embeddings_vectoriales SET modelo_embedding = 'openai-ada-002' WHERE id = 2"))
+    
+    assert not crear_almacenes_embedding(bd)
+    
+    with bd.begin() as conn:
+        assert conn.execute(text(
+            "SELECT relkind FROM pg_class WHERE relname = 'embeddings_vectoriales'"
+        )).scalar() == 'r'
+        assert conn.execute(text("SELECT count(*) FROM embeddings_vectoriales")).scalar() == 2
+        
+        conn.execute(text("DELETE FROM embeddings_vectoriales WHERE id = 2"))
+    assert crear_almacenes_embedding(bd)
+
+
+def test_crear_almacenes_rellena_la_proyeccion_vacia(bd, insertar_articulos):
+    ids = insertar_articulos('EC', np.random.default_rng(3).normal(size=(2, 768)))
+    with bd.begin() as conn:
+        conn.execute(text("""
+            UPDATE embeddings_vectoriales
+            SET pais_id = NULL, codigo_pais = NULL, estado = NULL, vigente = NULL,
+                numero_documento = NULL, numero_articulo = NULL
+        """))
+    
+    assert crear_almacenes_embedding(bd)
+    
+    with bd.connect() as conn:
+        filas = conn.execute(text("""
+            SELECT articulo_id, codigo_pais, vigente, numero_articulo
+            FROM embeddings_vectoriales ORDER BY articulo_id
+        """)).all()
+    assert [tuple(fila) for fila in filas] == [
+        (ids[0], 'EC', True, 'Art. 1'), (ids[1], 'EC', True, 'Art. 2')
+    ]
@@ -0,0 +1,130 @@
+"""
+AALabelPP - Tests de generación de embeddings
+Lotes por longitud con un modelo falso (sin descargar modelos ni BD) y
+verificación sobre PostgreSQL (con DB_TEST_NAME)
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+from sqlalchemy import text
+
+from database.models import almacen_embedding
+from generate_embeddings import (
+    ArticulosEmbedder, EmbeddingGenerado, EmbeddingGenerator, EmbeddingsVerificador, Fragmento
+)
+
+
+class TokenizerPalabras:
+    """Un token por palabra más dos especiales"""
+    
+    def __call__(self, textos, **kwargs):
+        return {'input_ids': [[0] * (len(texto.split()) + 2) for texto in textos]}
+
+
+class ModeloFalso:
+    """Codifica cada texto como (palabras, número del texto)"""
+    
+    max_seq_length = 16
+    
+    def __init__(self):
+        self.tokenizer = TokenizerPalabras()
+        self.lotes = []
+    
+    def encode(self, textos, batch_size, **kwargs):
+        self.lotes.append(list(textos))
+        return np.array(
+            [[len(texto.split()), int(texto.split()[-1])] for texto in textos],
+            dtype=np.float32
+        )
+
+
+def generador_falso():
+    generador = EmbeddingGenerator.__new__(EmbeddingGenerator)
+    generador.modelo = ModeloFalso()
+    generador.pool = None
+    generador.dimension = 2
+    return generador
+
+
+def test_generar_batch_restaura_el_orden_de_entrada():
+    generador = generador_falso()
+    longitudes = [3, 9, 1, 6, 9, 2, 4]
+    textos = [' '.join(['x'] * (n - 1) + [str(i)]) for i, n in enumerate(longitudes)]
+    
+    embeddings = generador.generar_batch(textos, max_tokens_lote=24, mostrar_progreso=False)
+    
+    np.testing.assert_array_equal(embeddings[:, 0], longitudes)
+    np.testing.assert_array_equal(embeddings[:, 1], np.arange(len(textos)))
+    
+    # Lotes de largos a cortos, sin superar el presupuesto de tokens con relleno
+    lotes = generador.modelo.lotes
+    assert sum(len(lote) for lote in lotes) == len(textos)
+    for lote in lotes:
+        assert len(lote) * (len(lote[0].split()) + 2) <= 24
+    primeros = [len(lote[0].split()) for lote in lotes]
+    assert primeros == sorted(primeros, reverse=True)
+
+
+def test_generar_batch_vacio():
+    assert generador_falso().generar_batch([]).shape == (0, 2)
+
+
+MPNET = 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+
+
+def embedder_falso():
+    embedder = ArticulosEmbedder.__new__(ArticulosEmbedder)
+    embedder.generator = SimpleNamespace(modelo_path=MPNET)
+    embedder.almacen = almacen_embedding(MPNET)
+    embedder.estadisticas = dict.fromkeys(
+        ('nuevos', 'actualizados', 'filas_escritas', 'tiempo_escritura'), 0
+    )
+    return embedder
+
+
+def test_guardar_embeddings_cuenta_nuevos_y_actualizados(bd, insertar_articulos):
+    vectores = np.random.default_rng(1).normal(size=(2, 768))
+    existente, nuevo = insertar_articulos('CO', vectores)
+    with bd.begin() as conn:
+        conn.execute(text("DELETE FROM embeddings_vectoriales WHERE articulo_id = :id"), {'id': nuevo})
+    embedder = embedder_falso()
+    
+    embedder.guardar_embeddings([
+        EmbeddingGenerado(articulo_id, vector, 0.0, MPNET, 768, 'h' * 64)
+        for articulo_id, vector in zip((existente, nuevo), vectores)
+    ], actualizar_existente=True)
+    
+    assert (embedder.estadisticas['nuevos'], embedder.estadisticas['actualizados']) == (1, 1)
+    assert embedder.ultimo_id_guardado == nuevo
+
+
+def test_guardar_fragmentos_reemplaza_las_posiciones(bd, insertar_articulos):
+    vectores = np.random.default_rng(2).normal(size=(2, 768))
+    articulo_id, = insertar_articulos('CO', vectores[:1])
+    embedder = embedder_falso()
+    
+    embedder.guardar_fragmentos(
+        [Fragmento(articulo_id, 0, 0, 10, 5), Fragmento(articulo_id, 1, 8, 20, 5)],
+        vectores, {articulo_id: 'a' * 64}
+    )
+    embedder.guardar_fragmentos([Fragmento(articulo_id, 0, 0, 20, 9)], vectores[:1], {articulo_id: 'b' * 64})
+    
+    assert (embedder.estadisticas['nuevos'], embedder.estadisticas['actualizados']) == (2, 1)
+    with bd.connect() as conn:
+        filas = conn.execute(text("SELECT posicion, hash_contenido FROM embeddings_fragmentos")).all()
+    assert [tuple(fila) for fila in filas] == [(0, 'b' * 64)]
+
+
+def test_perdida_float16_sobre_el_corpus(insertar_articulos):
+    vectores = np.random.default_rng(0).normal(size=(40, 768))
+    insertar_articulos('CO', vectores)
+    
+    r = EmbeddingsVerificador.medir_perdida_float16(
+        'sentence-transformers/paraphrase-multilingual-mpnet-base-v2', muestras=10, top_k=5
+    )
+    
+    assert (r['vectores'], r['dimension'], r['consultas']) == (40, 768, 10)
+    assert r['solapamiento'] >= 0.9
+    assert 0 < r['error_max'] < 1e-2
+    assert r['bytes_halfvec'] < r['bytes_vector']
@@ -0,0 +1,345 @@
+"""
+AALabelPP - Tests del cliente LLM asíncrono
+Reintentos, Retry-After, SSE y limitación de tasa contra un endpoint falso
+(httpx.MockTransport), sin red ni API keys
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import llm_providers
+from llm_providers import (
+    AsyncLLMGenerator, ErrorProveedorLLM, ParserSeccionesIncremental, ProveedorLLM, SYSTEM_PROMPT,
+    TokenBucket, consumir_stream, estimar_tokens
+)
+
+
+RESPUESTA = (
+    "### CONTENIDO ARMONIZADO\nConservar por debajo de 25 °C.\n\n"
+    "### JUSTIFICACIÓN\nCriterio más restrictivo.\n\n"
+    "### FUENTES\n- CO: Decreto 677, Art. 72\n"
+)
+
+
+def respuesta_sse(fragmentos, corrupto=False):
+    """Cuerpo text/event-stream al estilo de chat/completions"""
+    eventos = [
+        {'choices': [{'index': 0, 'delta': {'content': fragmento}}]}
+        for fragmento in fragmentos
+    ]
+    lineas = [f"data: {json.dumps(evento)}\n\n" for evento in eventos]
+    if corrupto:
+        lineas.insert(1, 'data: {"choices": [{"index": 0, "del\n\n')
+    lineas.append("data: [DONE]\n\n")
+    return httpx.Response(
+        200,
+        headers={'content-type': 'text/event-stream'},
+        content=''.join(lineas).encode('utf-8')
+    )
+
+
+def respuesta_eventos(*eventos):
+    """Cuerpo text/event-stream con eventos arbitrarios"""
+    lineas = [f"data: {json.dumps(evento)}\n\n" for evento in eventos] + ["data: [DONE]\n\n"]
+    return httpx.Response(
+        200,
+        headers={'content-type': 'text/event-stream'},
+        content=''.join(lineas).encode('utf-8')
+    )
+
+
+def delta(texto):
+    return {'choices': [{'index': 0, 'delta': {'content': texto}}]}
+
+
+class EndpointFalso:
+    """Devuelve las respuestas programadas en orden y anota cada petición"""
+    
+    def __init__(self, *respuestas):
+        self.respuestas = list(respuestas)
+        self.peticiones = []
+    
+    def __call__(self, peticion: httpx.Request) -> httpx.Response:
+        self.peticiones.append((time.monotonic(), json.loads(peticion.content)))
+        return self.respuestas.pop(0)
+
+
+def crear_generador(endpoint, **opciones):
+    return AsyncLLMGenerator(
+        'gpt-4',
+        api_key='test',
+        base_url='http://llm.local/v1',
+        transport=httpx.MockTransport(endpoint),
+        **opciones
+    )
+
+
+@pytest.fixture
+def sin_jitter(monkeypatch):
+    """Backoff determinista: el jitter aleatorio vale 0"""
+    monkeypatch.setattr(llm_providers.random, 'uniform', lambda a, b: 0.0)
+
+
+def test_stream_reintenta_429_respetando_retry_after(sin_jitter):
+    endpoint = EndpointFalso(
+        httpx.Response(429, headers={'retry-after': '0.3'}, json={'error': 'rate limit'}),
+        respuesta_sse([RESPUESTA[:30], RESPUESTA[30:70], RESPUESTA[70:]])
+    )
+    generador = crear_generador(endpoint)
+    contenidos = []
+    
+    respuesta = asyncio.run(generador.generar_stream(
+        'prompt', al_contenido=contenidos.append, parar_en_fuentes=True
+    ))
+    
+    assert len(endpoint.peticiones) == 2
+    assert endpoint.peticiones[1][1]['stream'] is True
+    assert generador.estadisticas['reintentos'] == 1
+    assert generador.estadisticas['llamadas'] == 2
+    # El reintento esperó al menos lo indicado por Retry-After
+    assert endpoint.peticiones[1][0] - endpoint.peticiones[0][0] >= 0.3
+    assert contenidos == ["Conservar por debajo de 25 °C."]
+    assert '### FUENTES' not in respuesta
+    assert generador.estadisticas['cortes_anticipados'] == 1
+
+
+def test_stream_sse_corrupto_se_reintenta(sin_jitter):
+    endpoint = EndpointFalso(
+        # El evento corrupto llega antes de cerrarse el contenido
+        respuesta_sse([RESPUESTA[:20], RESPUESTA[20:]], corrupto=True),
+        respuesta_sse([RESPUESTA])
+    )
+    generador = crear_generador(endpoint)
+    
+    respuesta = asyncio.run(generador.generar_stream('prompt', parar_en_fuentes=False))
+    
+    assert respuesta == RESPUESTA
+    assert generador.estadisticas['reintentos'] == 1
+
+
+def test_stream_evento_error_se_reintenta(sin_jitter):
+    endpoint = EndpointFalso(
+        respuesta_eventos(delta(RESPUESTA[:20]), {'error': {'message': 'overloaded', 'type': 'server_error'}}),
+        respuesta_sse([RESPUESTA])
+    )
+    generador = crear_generador(endpoint)
+    
+    respuesta = asyncio.run(generador.generar_stream('prompt', parar_en_fuentes=False))
+    
+    assert respuesta == RESPUESTA
+    assert generador.estadisticas['reintentos'] == 1
+
+
+def test_stream_evento_error_no_reintentable():
+    endpoint = EndpointFalso(respuesta_eventos(
+        {'error': {'message': 'demasiado largo', 'type': 'invalid_request_error',
+                   'code': 'context_length_exceeded'}}
+    ))
+    generador = crear_generador(endpoint)
+    
+    with pytest.raises(ErrorProveedorLLM) as error:
+        asyncio.run(generador.generar_stream('prompt'))
+    
+    assert not error.value.reintentable
+    assert len(endpoint.peticiones) == 1
+
+
+def test_stream_eventos_sin_opciones_se_ignoran():
+    endpoint = EndpointFalso(respuesta_eventos(
+        {'choices': [{'index': 0, 'delta': {'role': 'assistant'}}]},
+        delta(RESPUESTA),
+        {'choices': [], 'usage': {'total_tokens': 120}}
+    ))
+    generador = crear_generador(endpoint)
+    
+    assert asyncio.run(generador.generar_stream('prompt', parar_en_fuentes=False)) == RESPUESTA
+
+
+def test_stream_gemini_candidatos_vacios_y_error(sin_jitter):
+    def candidato(texto):
+        return {'candidates': [{'content': {'parts': [{'text': texto}]}}]}
+    
+    endpoint = EndpointFalso(
+        respuesta_eventos(
+            candidato(RESPUESTA[:20]),
+            {'error': {'code': 429, 'message': 'cuota', 'status': 'RESOURCE_EXHAUSTED'}}
+        ),
+        respuesta_eventos({'candidates': []}, candidato(RESPUESTA), {'candidates': [{}]})
+    )
+    generador = AsyncLLMGenerator(
+        'gemini-pro', api_key='test', base_url='http://llm.local/v1beta',
+        transport=httpx.MockTransport(endpoint)
+    )
+    
+    respuesta = asyncio.run(generador.generar_stream('prompt', parar_en_fuentes=False))
+    
+    assert respuesta == RESPUESTA
+    assert generador.estadisticas['reintentos'] == 1
+
+
+def test_error_no_reintentable_no_se_reintenta():
+    endpoint = EndpointFalso(httpx.Response(401, json={'error': 'clave inválida'}))
+    generador = crear_generador(endpoint)
+    
+    with pytest.raises(ErrorProveedorLLM) as error:
+        asyncio.run(generador.generar('prompt'))
+    
+    assert error.value.estado == 401
+    assert len(endpoint.peticiones) == 1
+    assert generador.estadisticas['errores'] == 1
+
+
+def test_reintentos_agotados(sin_jitter):
+    endpoint = EndpointFalso(*[httpx.Response(503, json={}) for _ in range(3)])
+    generador = crear_generador(endpoint, max_reintentos=2)
+    
+    with pytest.raises(ErrorProveedorLLM):
+        asyncio.run(generador.generar('prompt'))
+    
+    assert len(endpoint.peticiones) == 3
+    assert generador.estadisticas['reintentos'] == 2
+
+
+def test_reserva_de_tokens_se_liquida_con_usage(sin_jitter):
+    usados = 150
+    completado = {
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': RESPUESTA}}],
+        'usage': {'prompt_tokens': 100, 'completion_tokens': 50, 'total_tokens': usados}
+    }
+    endpoint = EndpointFalso(
+        httpx.Response(429, headers={'retry-after': '0'}, json={}),
+        httpx.Response(200, json=completado)
+    )
+    generador = crear_generador(endpoint, tpm=60_000)
+    
+    assert asyncio.run(generador.generar('prompt', max_tokens=2000)) == RESPUESTA
+    
+    # Solo queda descontado el uso real: ni los 2000 de salida reservados
+    # ni un segundo cobro del prompt por el 429
+    tokens = generador.limitador.tokens
+    tokens._reponer()
+    assert tokens.disponibles == pytest.approx(60_000 - usados, abs=50)
+
+
+def test_reserva_mayor_que_la_rafaga_se_liquida_por_lo_descontado():
+    completado = {
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'ok'}}],
+        'usage': {'total_tokens': 300}
+    }
+    generador = crear_generador(EndpointFalso(httpx.Response(200, json=completado)), tpm=1000)
+    
+    # Prompt + salida (~2500) supera la ráfaga: el bucket descuenta 1000
+    asyncio.run(generador.generar('x' * 8000, max_tokens=500))
+    
+    tokens = generador.limitador.tokens
+    tokens._reponer()
+    assert tokens.disponibles == pytest.approx(1000 - 300, abs=10)
+
+
+def test_limitador_espacia_las_llamadas(sin_jitter):
+    # 1200 TPM = 20 tokens/s; la segunda llamada espera a reponer el déficit
+    reserva = estimar_tokens(SYSTEM_PROMPT + 'prompt') + 700
+    usados = 1200 - reserva + 10
+    completado = {
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'ok'}}],
+        'usage': {'total_tokens': usados}
+    }
+    endpoint = EndpointFalso(
+        httpx.Response(200, json=completado),
+        httpx.Response(200, json=completado)
+    )
+    generador = crear_generador(endpoint, tpm=1200)
+    
+    async def dos_llamadas():
+        await generador.generar('prompt', max_tokens=700)
+        await generador.generar('prompt', max_tokens=700)
+    
+    asyncio.run(dos_llamadas())
+    
+    separacion = endpoint.peticiones[1][0] - endpoint.peticiones[0][0]
+    # Déficit de 10 tokens a 20 tokens/s: ~0.5 s (sin liquidar serían ~12 s)
+    assert 0.4 <= separacion < 3.0
+
+
+def test_token_bucket_ritmo_sostenido():
+    bucket = TokenBucket(capacidad=1, tasa_por_segundo=10)
+    
+    async def adquirir(veces):
+        for _ in range(veces):
+            await bucket.adquirir(1)
+    
+    inicio = time.monotonic()
+    asyncio.run(adquirir(5))
+    
+    # La primera es ráfaga; las otras 4 esperan 0.1 s cada una
+    assert time.monotonic() - inicio >= 0.38
+
+
+def test_token_bucket_devolver_no_supera_la_capacidad():
+    bucket = TokenBucket(capacidad=100, tasa_por_segundo=1)
+    asyncio.run(bucket.adquirir(80))
+    
+    bucket.devolver(500)
+    assert bucket.disponibles == 100
+    
+    bucket.devolver(-150)
+    assert bucket.disponibles < 0
+
+
+def test_espera_respeta_retry_after():
+    assert AsyncLLMGenerator._calcular_espera(0, retry_after=7.5) >= 7.5
+    assert AsyncLLMGenerator._calcular_espera(10, retry_after=None) <= 60.0
+
+
+@pytest.mark.parametrize('tamano', [1, 3, 7, len(RESPUESTA)])
+def test_parser_marcadores_partidos_entre_fragmentos(tamano):
+    entregas = []
+    parser = ParserSeccionesIncremental(al_contenido=entregas.append)
+    fragmentos = [RESPUESTA[i:i + tamano] for i in range(0, len(RESPUESTA), tamano)]
+    
+    paradas = [parser.alimentar(fragmento) for fragmento in fragmentos]
+    
+    # El contenido se entrega una sola vez y el corte llega con FUENTES
+    assert entregas == ['Conservar por debajo de 25 °C.']
+    assert parser.contenido == entregas[0]
+    assert parser.cortado and paradas.index(True) < len(fragmentos)
+    assert parser.respuesta() == RESPUESTA[:RESPUESTA.index('### FUENTES')]
+
+
+def test_parser_sin_corte_conserva_fuentes():
+    parser = ParserSeccionesIncremental(parar_en_fuentes=False)
+    
+    fragmentos = iter([RESPUESTA[i:i + 5] for i in range(0, len(RESPUESTA), 5)])
+    respuesta = consumir_stream(fragmentos, parser)
+    
+    assert not parser.cortado
+    assert respuesta == RESPUESTA
+
+
+def test_consumir_stream_cierra_el_generador_al_cortar():
+    consumidos = []
+    
+    def fragmentos():
+        for fragmento in ['### CONTENIDO ARMONIZADO\nX\n', '### JUSTIFICACIÓN\nY\n',
+                          '### FUE', 'NTES\n', 'no debe leerse']:
+            consumidos.append(fragmento)
+            yield fragmento
+    
+    stream = fragmentos()
+    respuesta = consumir_stream(stream, ParserSeccionesIncremental())
+    
+    assert consumidos[-1] == 'NTES\n'
+    assert stream.gi_frame is None
+    assert '### FUENTES' not in respuesta
+
+
+def test_proveedor_sin_generar_no_se_instancia():
+    class ProveedorIncompleto(ProveedorLLM):
+        tipo = 'incompleto'
+    
+    with pytest.raises(TypeError):
+        ProveedorIncompleto()
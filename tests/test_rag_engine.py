@@ -0,0 +1,636 @@
+"""
+AALabelPP - Tests del motor RAG
+Componentes puros de recuperación, caches, empaquetado y generación con el
+proveedor simulado (sin BD ni API keys); la búsqueda pgvector se prueba sobre
+PostgreSQL con DB_TEST_NAME
+"""
+
+import contextlib
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+import rag_engine
+from rag_engine import (
+    ArticuloRecuperado, CacheArmonizaciones, CacheEmbeddingsQuery, CompresorEvidencia, EmpaquetadorEvidencia,
+    IndiceVectorialMemoria, LLMGenerator, _agregar_por_articulo, _indices_top_k,
+    _inicios_por_articulo, _seleccionar_top_k
+)
+from scripts.llm_providers import ErrorProveedorLLM
+
+
+PROMPT_SECCION = 'Redacta la sección "Conservación" del producto.'
+
+
+@pytest.fixture
+def sin_jitter(monkeypatch):
+    """Backoff sin espera: el jitter aleatorio vale 0"""
+    monkeypatch.setattr(random, 'uniform', lambda a, b: 0.0)
+
+
+def normalizado(*valores):
+    vector = np.array(valores, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class ConsultaFalsa:
+    """Consulta encadenable que devuelve filas fijas"""
+    
+    def __init__(self, filas):
+        self.filas = filas
+    
+    def join(self, *args, **kwargs):
+        return self
+    
+    filter = order_by = join
+    
+    def all(self):
+        return self.filas
+
+
+class SesionFalsa:
+    """Sesión con los países y las filas de vectores de un corpus fijo"""
+    
+    def __init__(self, paises, filas):
+        self.paises = paises
+        self.filas = filas
+    
+    def query(self, *columnas):
+        if columnas[0] is rag_engine.Pais.id:
+            return ConsultaFalsa(self.paises)
+        return ConsultaFalsa(self.filas)
+
+
+@pytest.fixture
+def corpus(monkeypatch):
+    """Corpus pequeño: artículo -> (país, estado, vector)"""
+    paises = [(1, 'CO '), (2, 'EC '), (3, 'PE ')]
+    articulos = {
+        1: (1, 'vigente', normalizado(1, 0, 0)),
+        2: (1, 'derogado', normalizado(1, 0, 0)),
+        3: (2, 'vigente', normalizado(0.8, 0.6, 0)),
+        4: (2, 'vigente', normalizado(0, 1, 0)),
+        5: (3, 'vigente', normalizado(0.9, 0.1, 0)),
+    }
+    filas = [
+        SimpleNamespace(articulo_id=articulo_id, embedding=vector, pais_id=pais_id, estado=estado)
+        for articulo_id, (pais_id, estado, vector) in articulos.items()
+    ]
+    monkeypatch.setattr(
+        rag_engine, 'get_db_session',
+        contextlib.contextmanager(lambda: (yield SesionFalsa(paises, filas)))
+    )
+    return articulos
+
+
+# ============================================================================
+# ÍNDICE VECTORIAL EN MEMORIA
+# ============================================================================
+
+def test_indices_top_k_ordenados():
+    scores = np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+    
+    assert list(_indices_top_k(scores, 2)) == [1, 3]
+    assert list(_indices_top_k(scores, 10)) == [1, 3, 2, 0]
+    assert len(_indices_top_k(scores, 0)) == 0
+
+
+def test_seleccionar_top_k_por_grupo_y_umbral():
+    scores = np.array([[0.9, 0.1], [0.8, 0.2], [0.3, 0.95], [0.7, 0.4]], dtype=np.float32)
+    ids = np.array([10, 11, 20, 21])
+    grupos = [np.array([True, True, False, False]), np.array([False, False, True, True])]
+    
+    resultados = _seleccionar_top_k(scores, ids, grupos, top_k=1, umbral=0.15)
+    
+    # Un resultado por grupo, fusionados de mayor a menor; el umbral filtra
+    assert resultados[0] == [(10, pytest.approx(0.9)), (21, pytest.approx(0.7))]
+    assert resultados[1] == [(20, pytest.approx(0.95)), (11, pytest.approx(0.2))]
+
+
+def test_indice_memoria_filtra_pais_y_vigencia(corpus):
+    indice = IndiceVectorialMemoria.cargar('modelo')
+    consulta = normalizado(1, 0, 0)
+    
+    assert len(indice) == 5
+    assert indice.matriz.flags['C_CONTIGUOUS'] and indice.matriz.dtype == np.float32
+    
+    resultado = indice.buscar(consulta, ['CO', 'EC'], top_k=2)
+    assert [articulo_id for articulo_id, _ in resultado] == [1, 3]
+    assert resultado[0][1] == pytest.approx(1.0)
+    
+    con_derogados = indice.buscar(consulta, ['CO'], top_k=5, solo_vigentes=False)
+    assert {articulo_id for articulo_id, _ in con_derogados} == {1, 2}
+    
+    assert indice.buscar(consulta, ['BO'], top_k=3) == []
+
+
+def test_indice_memoria_lote_por_pais_y_umbral(corpus):
+    indice = IndiceVectorialMemoria.cargar('modelo')
+    consultas = np.vstack([normalizado(1, 0, 0), normalizado(0, 1, 0)])
+    
+    por_pais = indice.buscar_lote(consultas, ['CO', 'EC', 'PE'], top_k=1, por_pais=True)
+    assert [articulo_id for articulo_id, _ in por_pais[0]] == [1, 5, 3]
+    assert [articulo_id for articulo_id, _ in por_pais[1]] == [4, 5, 1]
+    
+    con_umbral = indice.buscar_lote(consultas, ['CO', 'EC', 'PE'], top_k=5, umbral=0.95)
+    assert [articulo_id for articulo_id, _ in con_umbral[0]] == [1, 5]
+    assert [articulo_id for articulo_id, _ in con_umbral[1]] == [4]
+
+
+# ============================================================================
+# BÚSQUEDA PGVECTOR (POSTGRESQL)
+# ============================================================================
+
+@pytest.fixture
+def retriever_sin_modelo(monkeypatch):
+    """SemanticRetriever real sin descargar el modelo de embeddings"""
+    monkeypatch.setattr(rag_engine, 'SentenceTransformer', lambda ruta: None)
+    
+    def crear(**opciones):
+        return rag_engine.SemanticRetriever('multilingual-mpnet', cache_queries=0, **opciones)
+    
+    return crear
+
+
+def test_pgvector_por_pais_no_omite_paises_pequenos(insertar_articulos, retriever_sin_modelo):
+    generador = np.random.default_rng(5)
+    consulta = normalizado(*([1.0] + [0.0] * 767))
+    
+    def cercanos(n):
+        return consulta + generador.normal(0, 0.01, (n, 768))
+    
+    def lejanos(n):
+        return generador.normal(0, 1, (n, 768))
+    
+    # Colombia llena el índice cerca de la query; Ecuador tiene poca
+    # normativa y Perú casi toda derogada
+    insertar_articulos('CO', cercanos(1500))
+    ecuador = insertar_articulos('EC', lejanos(3))
+    insertar_articulos('PE', cercanos(300), estado='derogado')
+    peru = insertar_articulos('PE', lejanos(2))
+    
+    retriever = retriever_sin_modelo()
+    
+    def buscar(paises, por_pais):
+        with rag_engine.get_db_session() as session:
+            # Con este tamaño el planificador preferiría un seq scan exacto;
+            # en producción se recorre el índice HNSW
+            session.execute(text("SET LOCAL enable_seqscan = off"))
+            return retriever._buscar_lote_pgvector(
+                session, consulta[None, :], paises, top_k=3, umbral=-1.0, por_pais=por_pais
+            )[0]
+    
+    por_pais = buscar(['CO', 'EC', 'PE'], por_pais=True)
+    solo_ecuador = buscar(['EC'], por_pais=False)
+    
+    ids = [articulo_id for articulo_id, _ in por_pais]
+    assert len(ids) == 8
+    assert set(ecuador) <= set(ids) and set(peru) <= set(ids)
+    assert sorted(articulo_id for articulo_id, _ in solo_ecuador) == ecuador
+
+
+def test_pgvector_fragmentos_filtra_por_la_proyeccion(bd, insertar_articulos, retriever_sin_modelo):
+    from generate_embeddings import ArticulosEmbedder, Fragmento
+    
+    consulta = normalizado(*([1.0] + [0.0] * 767))
+    ruido = np.random.default_rng(7).normal(0, 0.01, (4, 768))
+    colombia = insertar_articulos('CO', consulta + ruido[:2])
+    ecuador = insertar_articulos('EC', consulta + ruido[2:])
+    
+    # Escritura real de fragmentos: cada fila recibe la proyección de su artículo
+    retriever = retriever_sin_modelo(granularidad='fragmento')
+    embedder = ArticulosEmbedder.__new__(ArticulosEmbedder)
+    embedder.generator = SimpleNamespace(modelo_path=retriever.modelo_path)
+    embedder.almacen = retriever.almacen
+    embedder.estadisticas = dict.fromkeys(
+        ('nuevos', 'actualizados', 'filas_escritas', 'tiempo_escritura'), 0
+    )
+    articulos = colombia + ecuador
+    embedder.guardar_fragmentos(
+        [Fragmento(articulo_id, 0, 0, 10, 5) for articulo_id in articulos],
+        consulta + ruido,
+        {articulo_id: '0' * 64 for articulo_id in articulos}
+    )
+    
+    def buscar(paises):
+        with rag_engine.get_db_session() as session:
+            return sorted(articulo_id for articulo_id, _ in retriever._buscar_lote_pgvector_fragmentos(
+                session, consulta[None, :], paises, top_k=5, umbral=-1.0
+            )[0])
+    
+    assert buscar(['EC']) == ecuador
+    
+    # El trigger de documentos lleva la derogación a los fragmentos
+    with bd.begin() as conn:
+        conn.execute(text("""
+            UPDATE documentos_normativos SET estado = 'derogado'
+            WHERE id = (SELECT documento_id FROM articulos_normativos WHERE id = :id)
+        """), {'id': colombia[0]})
+    
+    assert buscar(['CO', 'EC']) == ecuador
+
+
+class SesionRegistro:
+    """Sesión que registra las sentencias SET LOCAL"""
+    
+    def __init__(self):
+        self.sentencias = []
+    
+    def execute(self, sentencia, parametros=None):
+        self.sentencias.append(str(sentencia))
+
+
+def test_ajuste_ann_sin_busqueda_iterativa_sube_ef_search(retriever_sin_modelo):
+    retriever = retriever_sin_modelo()
+    retriever._iterativa = False
+    sesion = SesionRegistro()
+    
+    retriever._ajustar_busqueda_ann(sesion, candidatos=5 * 4)
+    retriever._ajustar_busqueda_ann(sesion, candidatos=50 * 4)
+    retriever._ajustar_busqueda_ann(sesion, candidatos=5000)
+    
+    assert sesion.sentencias == [
+        "SET LOCAL hnsw.ef_search = 40",
+        "SET LOCAL hnsw.ef_search = 200",
+        "SET LOCAL hnsw.ef_search = 1000",
+    ]
+
+
+def test_ajuste_ann_con_busqueda_iterativa(retriever_sin_modelo):
+    retriever = retriever_sin_modelo(ef_search=64)
+    retriever._iterativa = True
+    sesion = SesionRegistro()
+    
+    retriever._ajustar_busqueda_ann(sesion, candidatos=20)
+    
+    assert sesion.sentencias == [
+        "SET LOCAL hnsw.iterative_scan = relaxed_order",
+        "SET LOCAL hnsw.ef_search = 64",
+    ]
+
+
+# ============================================================================
+# AGREGACIÓN DE FRAGMENTOS
+# ============================================================================
+
+def test_agregar_fragmentos_por_articulo():
+    articulo_ids = np.array([7, 7, 7, 9, 12, 12])
+    scores = np.array([[0.1], [0.6], [0.3], [0.5], [0.2], [0.4]], dtype=np.float32)
+    
+    inicios = _inicios_por_articulo(articulo_ids)
+    
+    assert list(inicios) == [0, 3, 4]
+    np.testing.assert_allclose(_agregar_por_articulo(scores, inicios, 'max')[:, 0], [0.6, 0.5, 0.4])
+    np.testing.assert_allclose(_agregar_por_articulo(scores, inicios, 'sum')[:, 0], [1.0, 0.5, 0.6])
+    assert len(_inicios_por_articulo(np.array([], dtype=np.int64))) == 0
+
+
+# ============================================================================
+# CACHE DE EMBEDDINGS DE QUERIES
+# ============================================================================
+
+def test_cache_queries_normaliza_y_cuenta():
+    cache = CacheEmbeddingsQuery(max_entradas=4)
+    cache.guardar_entrada('modelo', 'Indicaciones  de\tuso', np.ones(3))
+    
+    assert cache.obtener('modelo', ' Indicaciones de uso ') is not None
+    assert cache.obtener('otro-modelo', 'Indicaciones de uso') is None
+    assert cache.estadisticas() == {
+        'entradas': 1, 'aciertos': 1, 'fallos': 1, 'tasa_aciertos': 0.5
+    }
+
+
+def test_cache_queries_expulsa_la_menos_usada():
+    cache = CacheEmbeddingsQuery(max_entradas=2)
+    cache.guardar_entrada('m', 'a', np.zeros(2))
+    cache.guardar_entrada('m', 'b', np.zeros(2))
+    cache.obtener('m', 'a')
+    cache.guardar_entrada('m', 'c', np.zeros(2))
+    
+    assert len(cache) == 2
+    assert cache.obtener('m', 'b') is None
+    assert cache.obtener('m', 'a') is not None
+    assert cache.obtener('m', 'c') is not None
+
+
+def test_cache_queries_persiste_y_recarga(tmp_path):
+    ruta = tmp_path / 'cache' / 'queries.npz'
+    cache = CacheEmbeddingsQuery(max_entradas=8, ruta=ruta)
+    cache.guardar_entrada('mpnet', 'dosis', np.arange(3))
+    cache.guardar_entrada('e5', 'dosis', np.arange(5))
+    cache.persistir()
+    
+    recargada = CacheEmbeddingsQuery(max_entradas=1, ruta=ruta)
+    
+    # Se conserva la entrada más reciente, con su propia dimensión
+    assert len(recargada) == 1
+    assert recargada.obtener('mpnet', 'dosis') is None
+    np.testing.assert_array_equal(recargada.obtener('e5', 'dosis'), np.arange(5))
+
+
+def test_cache_queries_ignora_archivo_corrupto(tmp_path):
+    ruta = tmp_path / 'queries.npz'
+    ruta.write_bytes(b'no es un npz')
+    
+    assert len(CacheEmbeddingsQuery(ruta=ruta)) == 0
+
+
+def test_cache_armonizaciones_memoria_acotada():
+    cache = CacheArmonizaciones(persistente=False, max_entradas=2)
+    argumentos = dict(codigo_seccion='S1', modelo='mock', temperatura=0.1, max_tokens=100)
+    cache.guardar('a', 'respuesta a', **argumentos)
+    cache.guardar('b', 'respuesta b', **argumentos)
+    cache.obtener('a')
+    cache.guardar('c', 'respuesta c', **argumentos)
+    
+    assert len(cache) == 2
+    assert cache.obtener('b') is None
+    assert cache.obtener('a') == 'respuesta a'
+    assert cache.estadisticas()['entradas'] == 2
+
+
+# ============================================================================
+# EMPAQUETADO DE EVIDENCIA
+# ============================================================================
+
+def articulo(articulo_id, pais, similitud, texto):
+    return ArticuloRecuperado(
+        articulo_id=articulo_id, numero_articulo=str(articulo_id), texto=texto,
+        pais=pais, documento='Decreto', similitud=similitud
+    )
+
+
+def texto_distinto(semilla, palabras=100):
+    return ' '.join(f"termino{semilla}_{i}." for i in range(palabras))
+
+
+def test_empaquetador_fusiona_duplicados_sin_alterar_fuentes():
+    texto = 'Conservar en lugar fresco y seco, protegido de la luz solar directa.'
+    articulos = [
+        articulo(1, 'EC', 0.70, texto.upper().replace(' ', '  ')),
+        articulo(2, 'CO', 0.90, texto),
+        articulo(3, 'PE', 0.50, 'Venta bajo fórmula médica en establecimientos autorizados.'),
+    ]
+    
+    empaquetados, informe = EmpaquetadorEvidencia('mock').empaquetar(articulos)
+    
+    # Gana el más relevante y guarda la cita del fusionado
+    assert [art.articulo_id for art in empaquetados] == [2, 3]
+    assert empaquetados[0].tambien_en == ['EC - Decreto Art. 1']
+    assert informe['duplicados'] == 1 and informe['descartados'] == 0
+    assert all(art.tambien_en == [] for art in articulos)
+
+
+def test_empaquetador_respeta_presupuesto_por_relevancia():
+    articulos = [articulo(i, 'CO', 0.5 + i / 10, texto_distinto(i)) for i in range(4)]
+    originales = [art.texto for art in articulos]
+    empaquetador = EmpaquetadorEvidencia('mock', presupuesto_tokens=1200, min_tokens_articulo=80)
+    
+    empaquetados, informe = empaquetador.empaquetar(articulos)
+    
+    assert [art.articulo_id for art in empaquetados] == [3, 2, 1, 0]
+    assert informe['tokens_originales'] > 1200
+    assert informe['tokens_empaquetados'] <= 1200
+    assert informe['truncados'] >= 1
+    # El más relevante entra completo; los recortados llevan la marca
+    assert empaquetados[0].texto == originales[3]
+    assert empaquetados[-1].texto.endswith(' [...]')
+    assert [art.texto for art in articulos] == originales
+
+
+def test_empaquetador_descarta_sin_presupuesto():
+    articulos = [articulo(i, 'CO', 0.9 - i / 10, texto_distinto(i)) for i in range(3)]
+    empaquetador = EmpaquetadorEvidencia('mock', presupuesto_tokens=150, min_tokens_articulo=80)
+    
+    empaquetados, informe = empaquetador.empaquetar(articulos)
+    
+    assert [art.articulo_id for art in empaquetados] == [0]
+    assert informe['descartados'] == 2
+    assert empaquetador.estadisticas['prompts'] == 1
+
+
+def test_empaquetador_casi_duplicados_solo_dentro_del_pais():
+    base = texto_distinto(1, palabras=60)
+    variante = base.replace('termino1_59.', 'hasta 30 °C.')
+    articulos = [
+        articulo(1, 'CO', 0.90, base),
+        articulo(2, 'EC', 0.80, variante),
+        articulo(3, 'CO', 0.70, variante),
+    ]
+    
+    empaquetados, informe = EmpaquetadorEvidencia('mock').empaquetar(articulos)
+    
+    # La variante ecuatoriana es una diferencia normativa, no un duplicado
+    assert [art.articulo_id for art in empaquetados] == [1, 2]
+    assert empaquetados[0].tambien_en == ['CO - Decreto Art. 3']
+    assert informe['duplicados'] == 1
+
+
+def test_empaquetador_sin_presupuesto_no_trunca():
+    articulos = [articulo(i, 'CO', 0.9 - i / 10, texto_distinto(i)) for i in range(3)]
+    
+    empaquetados, informe = EmpaquetadorEvidencia('mock').empaquetar(articulos)
+    
+    assert [art.texto for art in empaquetados] == [art.texto for art in articulos]
+    assert informe['tokens_empaquetados'] == informe['tokens_originales']
+    assert informe['truncados'] == informe['descartados'] == 0
+
+
+# ============================================================================
+# COMPRESIÓN DE EVIDENCIA
+# ============================================================================
+
+class ModeloPalabrasClave:
+    """Codifica cada texto por presencia de palabras clave"""
+    
+    VOCABULARIO = ('temperatura', 'dosis', 'venta')
+    
+    def __init__(self):
+        self.llamadas = 0
+    
+    def encode(self, textos, **kwargs):
+        self.llamadas += 1
+        matriz = np.array([
+            [float(palabra in texto.lower()) for palabra in self.VOCABULARIO] + [0.1]
+            for texto in textos
+        ], dtype=np.float32)
+        return matriz / np.linalg.norm(matriz, axis=1, keepdims=True)
+
+
+class RetrieverFalso:
+    def __init__(self):
+        self.modelo = ModeloPalabrasClave()
+    
+    def _codificar_queries(self, queries):
+        return self.modelo.encode(queries)
+
+
+ARTICULO_LARGO = (
+    "El registro sanitario tiene una vigencia de cinco años renovables. "
+    "Conservar a temperatura inferior a 25 grados centígrados. "
+    "Según el Art. 12 la dosis máxima diaria debe figurar en la etiqueta. "
+    "La venta requiere fórmula médica en todos los casos previstos."
+)
+
+
+def test_compresor_divide_sin_cortar_abreviaturas():
+    compresor = CompresorEvidencia(RetrieverFalso(), min_caracteres=25)
+    
+    oraciones = compresor.dividir(ARTICULO_LARGO + " Ver anexo.\nDisposición final aplicable.")
+    
+    assert len(oraciones) == 5
+    assert oraciones[2].startswith("Según el Art. 12 la dosis")
+    # Los fragmentos cortos se unen a la oración anterior
+    assert oraciones[3].endswith("casos previstos. Ver anexo.")
+
+
+def test_compresor_lote_conserva_las_oraciones_de_cada_query():
+    retriever = RetrieverFalso()
+    compresor = CompresorEvidencia(retriever, oraciones_por_articulo=1)
+    largo = articulo(1, 'CO', 0.9, ARTICULO_LARGO)
+    corto = articulo(2, 'EC', 0.8, 'Conservar en lugar fresco.')
+    
+    resultado = compresor.comprimir_lote(
+        ['temperatura de almacenamiento', 'dosis diaria'],
+        [[largo, corto], [largo]]
+    )
+    
+    assert resultado[0][0].texto == (
+        "[...] Conservar a temperatura inferior a 25 grados centígrados. [...]"
+    )
+    assert resultado[1][0].texto.startswith("[...] Según el Art. 12 la dosis")
+    assert resultado[0][1] is corto
+    assert resultado[0][0].numero_articulo == largo.numero_articulo
+    assert largo.texto == ARTICULO_LARGO
+    # Un encode para las queries y otro para todas las oraciones del lote
+    assert retriever.modelo.llamadas == 2
+    assert compresor.estadisticas['articulos_comprimidos'] == 2
+
+
+# ============================================================================
+# GENERADOR LLM SÍNCRONO
+# ============================================================================
+
+def test_generador_sincrono_reintenta_errores_del_mock(sin_jitter):
+    generador = LLMGenerator('mock:latencia=0.001,error=0.5,tps=1000000,semilla=3')
+    
+    respuestas = [generador.generar(PROMPT_SECCION) for _ in range(10)]
+    
+    assert all('### CONTENIDO ARMONIZADO' in respuesta for respuesta in respuestas)
+    assert generador.estadisticas['reintentos'] > 0
+    assert generador.estadisticas['llamadas'] == 10 + generador.estadisticas['reintentos']
+
+
+def test_generador_sincrono_stream_reintenta(sin_jitter):
+    generador = LLMGenerator('mock:latencia=0.001,error=0.5,tps=1000000,semilla=3')
+    contenidos = []
+    
+    for _ in range(5):
+        generador.generar_stream(PROMPT_SECCION, al_contenido=contenidos.append)
+    
+    assert len(contenidos) == 5
+    assert generador.estadisticas['reintentos'] > 0
+
+
+def test_generador_sincrono_agota_reintentos(sin_jitter):
+    generador = LLMGenerator('mock:latencia=0.001,error=1.0', max_reintentos=2)
+    
+    with pytest.raises(ErrorProveedorLLM):
+        generador.generar(PROMPT_SECCION)
+    
+    assert generador.estadisticas['llamadas'] == 3
+
+
+class ClienteOpenAIFalso:
+    """chat.completions.create lanza los errores indicados y luego responde"""
+    
+    def __init__(self, *errores):
+        self.errores = list(errores)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    def create(self, **kwargs):
+        if self.errores:
+            raise self.errores.pop(0)
+        mensaje = SimpleNamespace(content='### CONTENIDO ARMONIZADO\nTexto')
+        return SimpleNamespace(choices=[SimpleNamespace(message=mensaje)])
+
+
+def generador_openai(cliente):
+    generador = LLMGenerator('mock', max_reintentos=3)
+    generador.proveedor = None
+    generador.tipo = 'openai'
+    generador.client = cliente
+    return generador
+
+
+def error_openai(clase, estado, cabeceras=None):
+    import httpx
+    
+    peticion = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+    respuesta = httpx.Response(estado, headers=cabeceras or {}, request=peticion)
+    return clase('error simulado', response=respuesta, body=None)
+
+
+def test_generador_sincrono_reintenta_errores_del_sdk(sin_jitter, monkeypatch):
+    openai = pytest.importorskip('openai')
+    esperas = []
+    monkeypatch.setattr(rag_engine.time, 'sleep', esperas.append)
+    cliente = ClienteOpenAIFalso(
+        error_openai(openai.RateLimitError, 429, {'retry-after': '7'}),
+        openai.APITimeoutError(request=None)
+    )
+    generador = generador_openai(cliente)
+    
+    assert generador.generar(PROMPT_SECCION).startswith('### CONTENIDO ARMONIZADO')
+    assert generador.estadisticas == {'llamadas': 3, 'reintentos': 2}
+    assert esperas[0] >= 7
+
+
+def test_generador_sincrono_no_reintenta_errores_del_sdk_definitivos(sin_jitter):
+    openai = pytest.importorskip('openai')
+    generador = generador_openai(ClienteOpenAIFalso(error_openai(openai.BadRequestError, 400)))
+    
+    with pytest.raises(ErrorProveedorLLM) as excinfo:
+        generador.generar(PROMPT_SECCION)
+    
+    assert excinfo.value.estado == 400
+    assert not excinfo.value.reintentable
+    assert generador.estadisticas['llamadas'] == 1
+
+
+def test_motor_streaming_entrega_contenido_y_corta_en_fuentes(monkeypatch):
+    monkeypatch.setattr(rag_engine, 'SentenceTransformer', lambda ruta: None)
+    entregados = []
+    motor = rag_engine.RAGEngine(
+        modelo_llm='mock:latencia=0.001,tps=1000000', streaming=True,
+        cache_armonizacion=False, al_contenido=lambda codigo, texto: entregados.append((codigo, texto))
+    )
+    proveedor = motor.generator.proveedor
+    consumidos = []
+    llamadas = []
+    stream_original = proveedor.generar_stream
+    
+    def stream_registrado(*args):
+        llamadas.append(args)
+        for fragmento in stream_original(*args):
+            consumidos.append(fragmento)
+            yield fragmento
+    
+    monkeypatch.setattr(proveedor, 'generar_stream', stream_registrado)
+    evidencia = [articulo(1, 'CO', 0.9, 'Conservar a temperatura inferior a 30 °C.')]
+    
+    seccion = motor.armonizar_seccion(
+        'CONSERVACION', 'Conservación', 'Condiciones de almacenamiento', ['CO'], articulos=evidencia
+    )
+    
+    assert entregados == [('CONSERVACION', seccion.contenido_armonizado)]
+    assert seccion.justificacion
+    assert seccion.articulos_fuente == evidencia
+    # La generación se cortó al empezar FUENTES (se reconstruyen de articulos_fuente)
+    completa = ''.join(stream_original(*llamadas[0]))
+    cortada = ''.join(consumidos)
+    assert '### FUENTES' in completa
+    assert completa.startswith(cortada) and len(cortada) < len(completa)